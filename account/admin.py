@@ -94,4 +94,11 @@ class NewsletterSubscriberAdmin(CustomModelAdminMixin, ImportExportModelAdmin):
 @admin.register(NewsletterCampaign)
 class NewsletterCampaignAdmin(CustomModelAdminMixin, ImportExportModelAdmin):
     resource_class = NewsletterCampaignResource
-    search_fields = ['id', 'subject']
\ No newline at end of file
+    search_fields = ['id', 'subject']
+
+
+@admin.register(NewsletterDelivery)
+class NewsletterDeliveryAdmin(CustomModelAdminMixin, ImportExportModelAdmin):
+    resource_class = NewsletterDeliveryResource
+    search_fields = ['id', 'campaign__subject']
+    list_filter = ('delivery_status', )
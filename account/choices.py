@@ -58,4 +58,11 @@ ACTION_TYPES = (
     ('logout', 'Logout'),
     ('export', 'Export'),
     ('bulk_action', 'Bulk Action'),
-)
\ No newline at end of file
+)
+
+NEWSLETTER_DELIVERY_STATUS = (
+    ('pending', 'Pending'),
+    ('sending', 'Sending'),
+    ('sent', 'Sent'),
+    ('failed', 'Failed'),
+)
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_newslettercampaign_newslettersubscriber'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newslettercampaign',
+            name='delivered_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='newslettercampaign',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='newslettercampaign',
+            name='html_content',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='newslettercampaign',
+            name='recipients_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='newslettercampaign',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='NewsletterDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk', models.PositiveIntegerField()),
+                ('first_subscriber_id', models.PositiveBigIntegerField()),
+                ('last_subscriber_id', models.PositiveBigIntegerField()),
+                ('delivery_status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('recipients_count', models.PositiveIntegerField(default=0)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('queued_at', models.DateTimeField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='account.newslettercampaign')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['campaign', 'delivery_status'], name='account_new_campaig_fb8b63_idx')],
+                'constraints': [models.UniqueConstraint(fields=('campaign', 'chunk'), name='unique_newsletter_delivery_chunk')],
+            },
+        ),
+    ]
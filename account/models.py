@@ -1,5 +1,4 @@
 # Create your models here.
-from datetime import datetime
 
 from django.db import models
 from django.contrib.auth.models import AbstractUser
@@ -7,6 +6,7 @@ from django.utils import timezone
 
 from account.choices import *
 from utils.models import ModelMixin, City, State, Country
+from utils.sequences import DailySequence
 
 
 class User(AbstractUser, ModelMixin):
@@ -114,9 +114,6 @@ class Complaint(ModelMixin):
 
     def save(self, *args, **kwargs):
         """Auto-generate complaint number and set SLA dates"""
-        if not self.complaint_number:
-            self.complaint_number = self._generate_complaint_number()
-
         if not self.response_due_date and self.complaint_status == 'open':
             # Set response due date based on priority
             hours_map = {'urgent': 2, 'high': 8, 'medium': 24, 'low': 48}
@@ -129,17 +126,10 @@ class Complaint(ModelMixin):
             days = days_map.get(self.priority, 7)
             self.resolved_at = timezone.now() + timezone.timedelta(days=days)
 
-        super().save(*args, **kwargs)
-
-    def _generate_complaint_number(self):
-        """Generate unique complaint number"""
-        date_str = datetime.now().strftime('%Y%m%d')
-
-        today_count = Complaint.objects.filter(
-            complaint_number__startswith=f'OM{date_str}'
-        ).count() + 1
-
-        return f'OM{date_str}{today_count:04d}'
+        if self.complaint_number:
+            super().save(*args, **kwargs)
+        else:
+            complaint_numbers.save_numbered(self, lambda: super(Complaint, self).save(*args, **kwargs))
 
     def __str__(self):
         return f"{self.complaint_number} - {self.subject}"
@@ -170,6 +160,9 @@ class Complaint(ModelMixin):
         self.save(update_fields=['resolution', 'resolved_by', 'resolved_at', 'complaint_status'])
 
 
+complaint_numbers = DailySequence('complaint', 'OM', Complaint, 'complaint_number')
+
+
 class ComplaintUpdate(ModelMixin):
     """Track communication and updates on complaints"""
     complaint = models.ForeignKey(Complaint, on_delete=models.CASCADE, related_name='updates')
@@ -247,6 +240,39 @@ class NewsletterCampaign(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     scheduled_at = models.DateTimeField(null=True, blank=True)
     sent = models.BooleanField(default=False)
+    # rendered once when the delivery is planned, every chunk sends the same
+    html_content = models.TextField(null=True, blank=True)
+    recipients_count = models.PositiveIntegerField(default=0)
+    delivered_count = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.subject
+
+
+class NewsletterDelivery(models.Model):
+    """A chunk of the subscribers of a campaign, by primary key range, sent as one task"""
+    campaign = models.ForeignKey(NewsletterCampaign, on_delete=models.CASCADE, related_name='deliveries')
+    chunk = models.PositiveIntegerField()
+    first_subscriber_id = models.PositiveBigIntegerField()
+    last_subscriber_id = models.PositiveBigIntegerField()
+    delivery_status = models.CharField(max_length=10, choices=NEWSLETTER_DELIVERY_STATUS, default='pending')
+    recipients_count = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    queued_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'chunk'], name='unique_newsletter_delivery_chunk'),
+        ]
+        indexes = [
+            models.Index(fields=['campaign', 'delivery_status']),
+        ]
 
     def __str__(self):
-        return self.subject
\ No newline at end of file
+        return f'{self.campaign} #{self.chunk}'
@@ -0,0 +1,151 @@
+"""
+Newsletter delivery.
+
+A due campaign is rendered once and its active subscribers are split, streaming
+their primary keys, into NewsletterDelivery chunks of NEWSLETTER_CHUNK_SIZE. The
+chunks are sent in parallel as a Celery group, each one through a single mail
+connection. A chunk is claimed before it's sent and marked sent after, so when a
+worker dies the next scheduler run queues the chunks left over (pending, or claimed
+longer than NEWSLETTER_CHUNK_TIMEOUT ago) instead of the whole campaign; at most the
+chunk in flight is sent twice.
+"""
+from datetime import timedelta
+
+from celery import group
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from account.models import NewsletterCampaign, NewsletterDelivery, NewsletterSubscriber
+from oumraa import settings
+
+
+def chunk_size():
+    return getattr(settings, 'NEWSLETTER_CHUNK_SIZE', 500)
+
+
+def chunk_timeout():
+    return timedelta(seconds=getattr(settings, 'NEWSLETTER_CHUNK_TIMEOUT', 15 * 60))
+
+
+def plan_campaign(campaign_id):
+    """Render ``campaign_id`` and create its delivery chunks, once"""
+    with transaction.atomic():
+        campaign = NewsletterCampaign.objects.select_for_update().get(pk=campaign_id)
+        if campaign.sent or campaign.started_at:
+            return campaign
+
+        context = {"name": "Subscriber", "body": campaign.body, "subject": campaign.subject}
+        campaign.html_content = render_to_string("emails/newsletter.html", context)
+
+        deliveries, subscriber_ids = [], []
+        size = chunk_size()
+
+        def add_chunk():
+            deliveries.append(NewsletterDelivery(
+                campaign=campaign, chunk=len(deliveries) + 1, first_subscriber_id=subscriber_ids[0],
+                last_subscriber_id=subscriber_ids[-1], recipients_count=len(subscriber_ids),
+            ))
+
+        subscribers = NewsletterSubscriber.objects.filter(is_active=True).order_by('pk').values_list('pk', flat=True)
+        for subscriber_id in subscribers.iterator(chunk_size=size):
+            subscriber_ids.append(subscriber_id)
+            if len(subscriber_ids) == size:
+                add_chunk()
+                subscriber_ids = []
+        if subscriber_ids:
+            add_chunk()
+        NewsletterDelivery.objects.bulk_create(deliveries, batch_size=1000)
+
+        campaign.recipients_count = sum(delivery.recipients_count for delivery in deliveries)
+        campaign.started_at = timezone.now()
+        if not deliveries:
+            campaign.sent, campaign.finished_at = True, campaign.started_at
+        campaign.save()
+    return campaign
+
+
+def queue_campaign(campaign_id):
+    """Queue the chunks of ``campaign_id`` not sent nor queued recently, as one group"""
+    now = timezone.now()
+    deliveries = NewsletterDelivery.objects.filter(campaign_id=campaign_id).filter(
+        Q(delivery_status='pending', queued_at__isnull=True) |
+        Q(delivery_status__in=['pending', 'sending'], queued_at__lt=now - chunk_timeout())
+    )
+    delivery_ids = list(deliveries.values_list('pk', flat=True))
+    if not delivery_ids:
+        return 0
+    NewsletterDelivery.objects.filter(pk__in=delivery_ids).update(delivery_status='pending', queued_at=now)
+
+    from account.tasks import send_newsletter_chunk
+    transaction.on_commit(lambda: group(send_newsletter_chunk.s(pk) for pk in delivery_ids).apply_async())
+    return len(delivery_ids)
+
+
+def send_due_campaigns():
+    """Plan the campaigns that are due and queue their chunks, returns the number of chunks queued"""
+    campaigns = NewsletterCampaign.objects.filter(sent=False, scheduled_at__lte=timezone.now())
+    queued = 0
+    for campaign_id in campaigns.values_list('pk', flat=True):
+        campaign = plan_campaign(campaign_id)
+        if not campaign.sent:
+            queued += queue_campaign(campaign_id)
+    return queued
+
+
+def campaign_message(campaign, email):
+    msg = EmailMultiAlternatives(
+        subject=campaign.subject, body=campaign.html_content,
+        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', None), to=[email],
+    )
+    msg.attach_alternative(campaign.html_content, "text/html")
+    return msg
+
+
+def send_chunk(delivery_id):
+    """Send a claimed chunk through one connection, returns the number of messages sent"""
+    now = timezone.now()
+    claimed = NewsletterDelivery.objects.filter(pk=delivery_id, delivery_status='pending').update(
+        delivery_status='sending', queued_at=now, started_at=now, attempts=F('attempts') + 1)
+    if not claimed:
+        # sent already, or another worker has it
+        return 0
+
+    delivery = NewsletterDelivery.objects.select_related('campaign').get(pk=delivery_id)
+    emails = NewsletterSubscriber.objects.filter(
+        is_active=True, pk__gte=delivery.first_subscriber_id, pk__lte=delivery.last_subscriber_id,
+    ).order_by('pk').values_list('email', flat=True)
+    messages = [campaign_message(delivery.campaign, email) for email in emails]
+    # one connection for the chunk, not one per message
+    sent = (get_connection().send_messages(messages) or 0) if messages else 0
+
+    with transaction.atomic():
+        NewsletterDelivery.objects.filter(pk=delivery_id).update(
+            delivery_status='sent', sent_count=sent, error=None, finished_at=timezone.now())
+        NewsletterCampaign.objects.filter(pk=delivery.campaign_id).update(delivered_count=F('delivered_count') + sent)
+    finish_campaign(delivery.campaign_id)
+    return sent
+
+
+def release_chunk(delivery_id, error):
+    """Hand a chunk that failed back for its retry"""
+    NewsletterDelivery.objects.filter(pk=delivery_id, delivery_status='sending').update(
+        delivery_status='pending', error=str(error), queued_at=timezone.now())
+
+
+def mark_chunk_failed(delivery_id, error):
+    NewsletterDelivery.objects.filter(pk=delivery_id).exclude(delivery_status='sent').update(
+        delivery_status='failed', error=str(error), finished_at=timezone.now())
+    campaign_id = NewsletterDelivery.objects.filter(pk=delivery_id).values_list('campaign_id', flat=True).first()
+    if campaign_id:
+        finish_campaign(campaign_id)
+
+
+def finish_campaign(campaign_id):
+    """Mark ``campaign_id`` sent once none of its chunks is left to send"""
+    if NewsletterDelivery.objects.filter(campaign_id=campaign_id, delivery_status__in=['pending', 'sending']).exists():
+        return False
+    return bool(NewsletterCampaign.objects.filter(pk=campaign_id, sent=False).update(
+        sent=True, finished_at=timezone.now()))
@@ -86,4 +86,11 @@ class NewsletterCampaignResource(resources.ModelResource):
     class Meta:
         model = NewsletterCampaign
         import_id_fields = ('id',)
-        exclude = EXCLUDE_FOR_API
\ No newline at end of file
+        exclude = EXCLUDE_FOR_API
+
+
+class NewsletterDeliveryResource(resources.ModelResource):
+    class Meta:
+        model = NewsletterDelivery
+        import_id_fields = ('id',)
+        exclude = EXCLUDE_FOR_API
@@ -1,11 +1,8 @@
-import datetime
-
 from celery import shared_task
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
 
 from account.helpers import send_templated_mail
-from account.models import NewsletterCampaign, NewsletterSubscriber
+from account.models import SearchQuery
+from account.newsletter import mark_chunk_failed, release_chunk, send_chunk, send_due_campaigns
 from oumraa import settings
 
 
@@ -44,21 +41,22 @@ def send_newsletter_joining_mail(email):
 
 @shared_task
 def send_newsletter_schedular_mail():
-    campaigns = NewsletterCampaign.objects.filter(sent=False, scheduled_at__lte=datetime.datetime.now())
+    return send_due_campaigns()
 
-    for campaign in campaigns:
-        subscribers = NewsletterSubscriber.objects.filter(is_active=True)
 
-        for subscriber in subscribers:
-            context = {"name": "Subscriber", "body": campaign.body, "subject": campaign.subject}
-            html_content = render_to_string("emails/newsletter.html", context)
+@shared_task(bind=True, max_retries=3)
+def send_newsletter_chunk(self, delivery_id):
+    """Send one chunk of a newsletter campaign, retried with a growing delay"""
+    try:
+        return send_chunk(delivery_id)
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            mark_chunk_failed(delivery_id, e)
+            return 0
+        release_chunk(delivery_id, e)
+        raise self.retry(exc=e, countdown=60 * 2 ** self.request.retries)
 
-            msg = EmailMultiAlternatives(
-                subject=campaign.subject, body=html_content,
-                from_email=settings.DEFAULT_FROM_EMAIL, to=[subscriber.email],
-            )
-            msg.attach_alternative(html_content, "text/html")
-            msg.send()
 
-        campaign.sent = True
-        campaign.save()
\ No newline at end of file
+@shared_task
+def log_search_query(query, user_id, results_count, ip_address):
+    SearchQuery.objects.create(query=query, user_id=user_id, results_count=results_count, ip_address=ip_address)
@@ -1,3 +1,139 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core import mail
+from django.core.mail import get_connection
+from django.template.loader import render_to_string
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from account.models import NewsletterCampaign, NewsletterDelivery, NewsletterSubscriber
+from account.newsletter import send_chunk, send_due_campaigns
+from utils.testing import QueryCountTestMixin
+
+
+class AccountQueryCountTests(QueryCountTestMixin, TestCase):
+    urlconf = 'account.urls'
+    url_prefix = '/api/account/'
+    query_counts = {
+        'address-detail': 3,
+        'address-list': 4,
+        'api-root': 0,
+        'city-detail': 2,
+        'city-list': 3,
+        'contact-us': 1,
+        'forgot-password': 2,
+        'google-login': 7,
+        'newsletter': 2,
+        'password-change': 2,
+        'state-detail': 1,
+        'state-list': 2,
+        'test-us': 0,
+        'token_obtain_pair': 3,
+        'token_refresh': 2,
+        'update-profile': 1,
+        'user-detail': 1,
+        'user-list': 2,
+        'user-login': 3,
+        'user-logout': 7,
+        'user-profile': 0,
+        'user-register': 7,
+    }
+
+    requests = {
+        'user-register': {'method': 'post', 'data': {
+            'username': 'new-user', 'email': 'new@example.com', 'password': 'password', 'password_confirm': 'password',
+            'first_name': 'New', 'last_name': 'User',
+        }},
+        'user-login': {'method': 'post', 'data': {'username': 'seed-user', 'password': 'password'}},
+        'token_obtain_pair': {'method': 'post', 'data': {'username': 'seed-user', 'password': 'password'}},
+        'update-profile': {'method': 'patch', 'data': {'first_name': 'Seed'}},
+        'password-change': {'method': 'post', 'data': {'password': 'changed', 'confirm_password': 'changed'}},
+        'forgot-password': {'method': 'post', 'data': {
+            'username': 'seed@example.com', 'password': 'changed', 'confirm_password': 'changed',
+        }},
+        'contact-us': {'method': 'post', 'data': {
+            'name': 'Seed User', 'email': 'seed@example.com', 'phone_number': '9999999999', 'subject': 'Hello',
+            'message': 'Message',
+        }},
+        'newsletter': {'method': 'post', 'data': {'email': 'reader@example.com'}},
+        'test-us': {'method': 'post'},
+        'google-login': {'method': 'post', 'data': {'token': 'google-token'}},
+    }
+
+    def setUp(self):
+        super().setUp()
+        idinfo = {'email': 'google@example.com', 'given_name': 'Google', 'family_name': 'User'}
+        for target, kwargs in [
+            ('account.views.send_instant_email', {}),
+            ('account.views.send_contact_email_task', {}),
+            ('account.views.send_newsletter_joining_mail', {}),
+            ('account.views.id_token.verify_oauth2_token', {'return_value': idinfo}),
+            ('oumraa.settings.GOOGLE_CLIENT_ID', {'new': 'client-id', 'create': True}),
+        ]:
+            patcher = mock.patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_url_kwargs(self, name, params):
+        return {
+            'address-detail': {'id': str(self.seed.address.pk)},
+            'state-detail': {'id': str(self.seed.state.pk)},
+            'city-detail': {'id': str(self.seed.city.pk)},
+            'user-detail': {'id': str(self.seed.user.pk)},
+        }.get(name) or super().get_url_kwargs(name, params)
+
+    def get_request(self, name):
+        if name in ('user-logout', 'token_refresh'):
+            return {'method': 'post', 'data': {'refresh': str(RefreshToken.for_user(self.seed.user))}}
+        return super().get_request(name)
+
+
+class NewsletterDeliveryTests(TestCase):
+
+    def setUp(self):
+        for i in range(5):
+            NewsletterSubscriber.objects.create(email=f'subscriber{i}@example.com')
+        NewsletterSubscriber.objects.create(email='inactive@example.com', is_active=False)
+        self.campaign = NewsletterCampaign.objects.create(subject='News', body='Body',
+                                                          scheduled_at=timezone.now() - timedelta(minutes=1))
+
+    def run_scheduler(self):
+        """The delivery ids queued by one scheduler run"""
+        with mock.patch('oumraa.settings.NEWSLETTER_CHUNK_SIZE', 2, create=True), \
+                mock.patch('account.newsletter.group') as group, self.captureOnCommitCallbacks(execute=True):
+            send_due_campaigns()
+        return [signature.args[0] for signature in group.call_args.args[0]] if group.called else []
+
+    def test_renders_once_and_sends_each_chunk_through_one_connection(self):
+        with mock.patch('account.newsletter.render_to_string', wraps=render_to_string) as render:
+            queued = self.run_scheduler()
+        render.assert_called_once()
+        self.assertEqual(len(queued), 3)
+
+        with mock.patch('account.newsletter.get_connection', wraps=get_connection) as connection:
+            self.assertEqual([send_chunk(delivery_id) for delivery_id in queued], [2, 2, 1])
+        self.assertEqual(connection.call_count, 3)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         [f'subscriber{i}@example.com' for i in range(5)])
+
+        self.campaign.refresh_from_db()
+        self.assertTrue(self.campaign.sent)
+        self.assertEqual((self.campaign.recipients_count, self.campaign.delivered_count), (5, 5))
+        # a duplicate task sends nothing
+        self.assertEqual(send_chunk(queued[0]), 0)
+
+    def test_resumes_the_chunks_left_after_a_crash(self):
+        first, second, third = self.run_scheduler()
+        send_chunk(first)
+        # the worker sending the second chunk died, the third is still queued
+        NewsletterDelivery.objects.filter(pk=second).update(delivery_status='sending',
+                                                            queued_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.run_scheduler(), [second])
 
-# Create your tests here.
+        send_chunk(second)
+        send_chunk(third)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(self.run_scheduler(), [])
+        self.assertTrue(NewsletterCampaign.objects.get(pk=self.campaign.pk).sent)
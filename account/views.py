@@ -108,7 +108,7 @@ class UserViewSet(BaseViewSetSetup):
     }
 
     def get_queryset(self):
-        return User.user_type.filter(id=self.request.user.id)
+        return User.objects.filter(id=self.request.user.id)
 
 
 class UpdateUserProfileView(APIView):
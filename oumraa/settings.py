@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     "corsheaders",
     'import_export',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'account',
     'product',
     'utils',
@@ -57,6 +58,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'utils.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -177,6 +179,24 @@ AUTH_USER_MODEL = "account.User"
 
 CELERY_BROKER_URL = "redis://:OMRAA_REDIS_REDIS@127.0.0.1:6379/0"
 CELERY_RESULT_BACKEND = "redis://:OMRAA_REDIS_REDIS@127.0.0.1:6379/0"
+CELERY_BEAT_SCHEDULE = {
+    'flush-blog-counters': {
+        'task': 'web.tasks.flush_blog_counters_task',
+        'schedule': 30.0,
+    },
+    'release-expired-stock-reservations': {
+        'task': 'product.tasks.release_expired_stock_reservations',
+        'schedule': 60.0,
+    },
+    'sync-flash-sales': {
+        'task': 'product.tasks.sync_flash_sales_task',
+        'schedule': 5.0,
+    },
+    'drain-storage-deletions': {
+        'task': 'product.tasks.drain_storage_deletions_task',
+        'schedule': 60.0,
+    },
+}
 
 
 CACHES = {
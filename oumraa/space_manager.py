@@ -1,32 +1,194 @@
+import logging
+import os
+import shutil
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from PIL import Image, ImageOps
+from PIL import Image, ImageOps, features
 
 import boto3
+from botocore.config import Config
 
 from oumraa import settings
 
+logger = logging.getLogger(__name__)
+
+# the most keys one delete_objects call accepts
+DELETE_BATCH_SIZE = 1000
+
+# largest first, every variant is resized from the previous one
+VARIANT_SIZES = [
+    ('original', None, 95),             # Full size - highest quality
+    ('large', (1200, 1200), 90),        # Product detail - high quality
+    ('medium', (600, 600), 85),         # Product cards - good quality
+    ('thumbnail', (300, 300), 75),      # Small thumbnails - lower quality
+]
+
+# smaller formats stored next to the JPEG of every srcset size (not the original):
+# format -> (Pillow format, content type, extension, quality below the JPEG one, save options)
+MODERN_FORMATS = {
+    'avif': ('AVIF', 'image/avif', 'avif', 20, {'speed': 6}),
+    'webp': ('WEBP', 'image/webp', 'webp', 5, {'method': 4}),
+}
+
+_client = None
+_executor = None
+_lock = threading.Lock()
+
+
+class LocalStorageClient:
+    """Keeps the objects in a local directory, implements the part of the S3 client the manager uses
+
+    Selected with DO_SPACES_BACKEND = 'local', so the image pipeline can run and be
+    benchmarked without DigitalOcean Spaces.
+    """
+
+    def __init__(self, root, base_url):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as destination:
+            shutil.copyfileobj(fileobj, destination)
+
+    def download_fileobj(self, bucket, key, fileobj):
+        with open(self.path(bucket, key), 'rb') as source:
+            shutil.copyfileobj(source, fileobj)
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            try:
+                os.remove(self.path(Bucket, obj['Key']))
+            except FileNotFoundError:
+                pass
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': os.path.getsize(self.path(Bucket, Key))}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn=3600):
+        return f"{self.base_url}/{Params['Bucket']}/{Params['Key']}"
+
+
+def get_storage_client():
+    """Storage client shared by the whole process, created on first use
+
+    boto3 clients are thread safe and keep their connections pooled, creating one per
+    manager paid the client setup and a new TLS connection on every upload.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = _create_storage_client()
+    return _client
+
+
+def _create_storage_client():
+    if getattr(settings, 'DO_SPACES_BACKEND', 'spaces') == 'local':
+        return LocalStorageClient(
+            getattr(settings, 'DO_SPACES_LOCAL_ROOT', os.path.join(settings.MEDIA_ROOT, 'spaces')),
+            getattr(settings, 'DO_SPACES_LOCAL_URL', f'{settings.MEDIA_URL}spaces'),
+        )
+    # DigitalOcean Spaces uses S3-compatible API
+    return boto3.client(
+        's3',
+        endpoint_url=settings.DO_SPACES_ENDPOINT_URL,  # https://fra1.digitaloceanspaces.com
+        aws_access_key_id=settings.DO_SPACES_KEY,
+        aws_secret_access_key=settings.DO_SPACES_SECRET,
+        region_name=settings.DO_SPACES_REGION,
+        config=Config(
+            # every image worker thread uploads concurrently
+            max_pool_connections=getattr(settings, 'DO_SPACES_MAX_POOL_CONNECTIONS', 32),
+            retries={'max_attempts': 3, 'mode': 'standard'},
+            tcp_keepalive=True,
+        )
+    )
+
+
+def get_image_executor():
+    """Thread pool encoding and uploading the image variants, Pillow releases the GIL while encoding"""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 8),
+                                               thread_name_prefix='image-variants')
+    return _executor
+
+
+def enabled_image_formats():
+    """The IMAGE_EXTRA_FORMATS Pillow can encode"""
+    return [image_format for image_format in getattr(settings, 'IMAGE_EXTRA_FORMATS', ['avif', 'webp'])
+            if image_format in MODERN_FORMATS and features.check(image_format)]
+
 
 class DigitalOceanSpacesManager:
     """Digital Ocean Spaces image management with CDN"""
 
-    def __init__(self):
-        # DigitalOcean Spaces uses S3-compatible API
-        self.client = boto3.client(
-            's3',
-            endpoint_url=settings.DO_SPACES_ENDPOINT_URL,  # https://fra1.digitaloceanspaces.com
-            aws_access_key_id=settings.DO_SPACES_KEY,
-            aws_secret_access_key=settings.DO_SPACES_SECRET,
-            region_name=settings.DO_SPACES_REGION
-        )
-        self.bucket_name = settings.DO_SPACES_BUCKET
-        self.cdn_url = settings.DO_SPACES_CDN_URL  # https://your-space.fra1.cdn.digitaloceanspaces.com
+    def __init__(self, client=None, executor=None):
+        self.client = client or get_storage_client()
+        self.executor = executor or get_image_executor()
+        if isinstance(self.client, LocalStorageClient):
+            self.bucket_name = getattr(settings, 'DO_SPACES_BUCKET', 'local')
+            self.cdn_url = f'{self.client.base_url}/{self.bucket_name}'
+        else:
+            self.bucket_name = settings.DO_SPACES_BUCKET
+            self.cdn_url = settings.DO_SPACES_CDN_URL  # https://your-space.fra1.cdn.digitaloceanspaces.com
 
-    def process_and_upload_image(self, image_file, folder="products"):
-        """Process image and upload multiple sizes to DO Spaces"""
+    def upload_source(self, image_file, folder="products"):
+        """Store the uploaded file as is, the size variants are generated from it later"""
         try:
+            file_id = str(uuid.uuid4())
+            extension = os.path.splitext(image_file.name)[1].lower() or '.jpg'
+            source_key = f"{folder}/sources/{file_id}{extension}"
+            self.client.upload_fileobj(
+                image_file,
+                self.bucket_name,
+                source_key,
+                ExtraArgs={
+                    'ContentType': getattr(image_file, 'content_type', None) or 'application/octet-stream',
+                    'Metadata': {'original-name': image_file.name, 'file-id': file_id}
+                }
+            )
+            return {'success': True, 'file_id': file_id, 'source_key': source_key}
+
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f"Upload failed: {str(e)}"
+            }
+
+    def download(self, key, name=None):
+        """Download an object into memory, ``name`` is set as the file name"""
+        buffer = BytesIO()
+        self.client.download_fileobj(self.bucket_name, key, buffer)
+        buffer.seek(0)
+        buffer.name = name or key.rsplit('/', 1)[-1]
+        return buffer
+
+    def process_and_upload_image(self, image_file, folder="products", file_id=None, formats=None):
+        """Process image and upload multiple sizes to DO Spaces
+
+        The variants are resized one from the other (original, large, medium, thumbnail)
+        and each is encoded and uploaded by the thread pool as soon as it is resized. The
+        srcset sizes are also stored in the modern ``formats`` (the enabled ones by default),
+        under ``results['formats']`` as ``{format: {size: {'key', 'url'}}}``.
+        """
+        uploaded_keys = []
+        try:
+            max_size = getattr(settings, 'IMAGE_MAX_ORIGINAL_SIZE', 4096)
+
             # Open and process image
             img = Image.open(image_file)
+            if img.format == 'JPEG':
+                # let the decoder scale down by 1/2, 1/4 or 1/8 while still covering the largest variant
+                img.draft('RGB', (max_size, max_size))
             img = ImageOps.exif_transpose(img)  # Fix rotation issues
 
             # Convert to RGB if needed (for JPEG)
@@ -34,105 +196,136 @@ class DigitalOceanSpacesManager:
                 rgb_img = Image.new('RGB', img.size, (255, 255, 255))
                 rgb_img.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
                 img = rgb_img
+            img.load()
 
-            file_id = str(uuid.uuid4())
+            file_id = file_id or str(uuid.uuid4())
             base_path = f"{folder}/{file_id}"
+            image_formats = enabled_image_formats() if formats is None else formats
 
-            sizes = {
-                'thumbnail': (300, 300, 75),    # Small thumbnails - lower quality
-                'medium': (600, 600, 85),       # Product cards - good quality
-                'large': (1200, 1200, 90),     # Product detail - high quality
-                'original': (*img.size, 95)     # Full size - highest quality
-            }
-
-            upload_results = {}
-            original_size = img.size
-
-            for size_name, (width, height, quality) in sizes.items():
+            futures = []
+            processed_img = img
+            for size_name, box, quality in VARIANT_SIZES:
+                metadata = {'original-name': image_file.name, 'size-variant': size_name, 'file-id': file_id}
+                box = box or (max_size, max_size)
+                if processed_img.width > box[0] or processed_img.height > box[1]:
+                    processed_img = processed_img.copy()
+                    processed_img.thumbnail(box, Image.Resampling.LANCZOS)
+                futures.append((size_name, None, self.executor.submit(
+                    self._encode_and_upload, processed_img, f"{base_path}_{size_name}.jpg", 'JPEG', 'image/jpeg',
+                    {'quality': quality, 'optimize': True, 'progressive': True}, metadata
+                )))
                 if size_name == 'original':
-                    processed_img = img.copy()
-                else:
-                    processed_img = img.copy()
-                    processed_img.thumbnail((width, height), Image.Resampling.LANCZOS)
-
-                img_bytes = BytesIO()
-                processed_img.save(
-                    img_bytes,
-                    format='JPEG',
-                    quality=quality,
-                    optimize=True,
-                    progressive=True
-                )
-                img_bytes.seek(0)
-
-                spaces_key = f"{base_path}_{size_name}.jpg"
-
-                self.client.upload_fileobj(
-                    img_bytes,
-                    self.bucket_name,
-                    spaces_key,
-                    ExtraArgs={
-                        'ACL': 'public-read',
-                        'ContentType': 'image/jpeg',
-                        'CacheControl': 'max-age=31536000, public',
-                        'Metadata': {
-                            'original-name': image_file.name,
-                            'size-variant': size_name,
-                            'width': str(processed_img.width),
-                            'height': str(processed_img.height),
-                            'file-id': file_id
-                        }
-                    }
-                )
+                    continue
+                for image_format in image_formats:
+                    pillow_format, content_type, extension, quality_offset, options = MODERN_FORMATS[image_format]
+                    futures.append((size_name, image_format, self.executor.submit(
+                        self._encode_and_upload, processed_img, f"{base_path}_{size_name}.{extension}",
+                        pillow_format, content_type, {'quality': quality - quality_offset, **options}, metadata
+                    )))
+
+            upload_results = {'formats': {}}
+            errors = []
+            for size_name, image_format, future in futures:
+                try:
+                    spaces_key, size = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                uploaded_keys.append(spaces_key)
 
                 # Generate URLs
+                if image_format:
+                    upload_results['formats'].setdefault(image_format, {})[size_name] = {
+                        'key': spaces_key, 'url': f"{self.cdn_url}/{spaces_key}"
+                    }
+                    continue
                 upload_results[f'{size_name}_key'] = spaces_key
                 upload_results[f'{size_name}_url'] = f"{self.cdn_url}/{spaces_key}"
-                upload_results[f'{size_name}_size'] = processed_img.size
+                upload_results[f'{size_name}_size'] = size
+            if errors:
+                raise errors[0]
 
             return {
                 'success': True,
                 'file_id': file_id,
                 'original_filename': image_file.name,
-                'original_size': original_size,
+                'original_size': upload_results['original_size'],
                 'results': upload_results
             }
 
         except Exception as e:
+            # don't leave the variants of a failed image behind
+            self.delete_image_variants(uploaded_keys)
             return {
                 'success': False,
                 'error': f"Upload failed: {str(e)}"
             }
 
+    def _encode_and_upload(self, img, spaces_key, image_format, content_type, options, metadata):
+        img_bytes = BytesIO()
+        img.save(img_bytes, format=image_format, **options)
+        img_bytes.seek(0)
+
+        self.client.upload_fileobj(
+            img_bytes,
+            self.bucket_name,
+            spaces_key,
+            ExtraArgs={
+                'ACL': 'public-read',
+                'ContentType': content_type,
+                'CacheControl': 'max-age=31536000, public',
+                'Metadata': {**metadata, 'width': str(img.width), 'height': str(img.height)}
+            }
+        )
+        return spaces_key, img.size
+
     def delete_image_variants(self, keys_list):
         """Delete all size variants of an image"""
-        try:
-            if not keys_list:
-                return True
+        failed = self.delete_objects(keys_list)
+        for key, error in failed.items():
+            logger.error('Error deleting %s from DO Spaces: %s', key, error)
+        return not failed
 
-            # Delete objects in batch
-            delete_objects = [{'Key': key} for key in keys_list if key]
-
-            if delete_objects:
-                self.client.delete_objects(
+    def delete_objects(self, keys):
+        """Delete ``keys`` in batches of DELETE_BATCH_SIZE, returns ``{key: error}`` of the ones that failed"""
+        keys = [key for key in dict.fromkeys(keys) if key]
+        failed = {}
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[start:start + DELETE_BATCH_SIZE]
+            try:
+                response = self.client.delete_objects(
                     Bucket=self.bucket_name,
-                    Delete={'Objects': delete_objects}
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
                 )
-            return True
-
-        except Exception as e:
-            print(f"Error deleting from DO Spaces: {e}")
-            return False
+            except Exception as e:
+                failed.update((key, str(e)) for key in batch)
+                continue
+            for error in (response or {}).get('Errors', []):
+                failed[error['Key']] = f"{error.get('Code')}: {error.get('Message')}"
+        return failed
 
-    def get_signed_upload_url(self, key, expires_in=3600):
-        """Generate signed URL for direct uploads (advanced feature)"""
+    def get_signed_upload_url(self, key, expires_in=3600, content_type=None):
+        """Generate signed URL for direct uploads, the PUT must send ``content_type`` when given"""
         try:
+            params = {'Bucket': self.bucket_name, 'Key': key}
+            if content_type:
+                params['ContentType'] = content_type
             url = self.client.generate_presigned_url(
                 'put_object',
-                Params={'Bucket': self.bucket_name, 'Key': key},
+                Params=params,
                 ExpiresIn=expires_in
             )
             return url
-        except Exception as e:
-            print(f"Error generating signed URL: {e}")
-            return None
\ No newline at end of file
+        except Exception:
+            logger.exception('Error generating signed URL for %s', key)
+            return None
+
+    def object_size(self, key):
+        """Size in bytes of a stored object, None when it does not exist"""
+        try:
+            return self.client.head_object(Bucket=self.bucket_name, Key=key)['ContentLength']
+        except Exception:
+            return None
+
+    def object_url(self, key):
+        return f"{self.cdn_url}/{key}"
@@ -1,6 +1,8 @@
+from django import forms
 from django.contrib import admin
 from import_export.admin import ImportExportModelAdmin
 
+from product.bulk_update import BulkUpdateError, start_bulk_update, validate_changes, validate_filters
 from product.resources import *
 from utils.admin import CustomModelAdminMixin
 
@@ -179,6 +181,61 @@ class StockMovementAdmin(CustomModelAdminMixin, ImportExportModelAdmin):
     list_filter = ('status', )
 
 
+@admin.register(ImageContent)
+class ImageContentAdmin(CustomModelAdminMixin, ImportExportModelAdmin):
+    resource_class = ImageContentResource
+    search_fields = ['id', 'content_hash', 'file_id']
+    list_filter = ('status', )
+
+
+@admin.register(StorageDeletion)
+class StorageDeletionAdmin(CustomModelAdminMixin, ImportExportModelAdmin):
+    resource_class = StorageDeletionResource
+    search_fields = ['id', 'key']
+    list_filter = ('attempts', )
+
+
+class BulkProductUpdateForm(forms.ModelForm):
+    class Meta:
+        model = BulkProductUpdate
+        fields = ['filters', 'changes', 'dry_run', 'chunk_size']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        try:
+            validate_filters(cleaned_data.get('filters') or {})
+            validate_changes(cleaned_data.get('changes') or {})
+        except BulkUpdateError as e:
+            raise forms.ValidationError(str(e))
+        return cleaned_data
+
+
+@admin.register(BulkProductUpdate)
+class BulkProductUpdateAdmin(CustomModelAdminMixin, ImportExportModelAdmin):
+    resource_class = BulkProductUpdateResource
+    form = BulkProductUpdateForm
+    search_fields = ['id']
+    list_filter = ('update_status', 'dry_run')
+
+    def get_readonly_fields(self, request, obj=None):
+        # an update is applied once, its record is the audit trail
+        return ['filters', 'changes', 'dry_run', 'chunk_size'] if obj else []
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            return super().save_model(request, obj, form, change)
+        obj.created_by = request.user
+        start_bulk_update(obj)
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(CustomModelAdminMixin, ImportExportModelAdmin):
+    resource_class = StockReservationResource
+    search_fields = ['id', 'reference_id']
+    raw_id_fields = ('product', 'product_variant', 'user')
+    list_filter = ('reservation_status', )
+
+
 @admin.register(FlashSale)
 class FlashSaleAdmin(CustomModelAdminMixin, ImportExportModelAdmin):
     resource_class = FlashSaleResource
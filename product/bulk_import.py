@@ -0,0 +1,448 @@
+"""
+Bulk catalog import.
+
+Reads products, variants and images from a CSV or JSONL file, one record per row
+with a ``type`` column (``product``, ``variant`` or ``image``). The file is parsed as
+a stream and written in chunks with bulk_create/bulk_update; the SKUs, categories,
+brands and attributes are preloaded into dicts, so a chunk costs a handful of queries
+whatever its size. The caches are invalidated and the search index updated once per
+import instead of once per saved row.
+
+- product: sku, name, description, short_description, sub_category (name), brand (name),
+  price, compare_price, cost_price, stock_quantity, low_stock_threshold, track_inventory,
+  allow_backorder, weight, length, width, height, meta_title, meta_description,
+  is_featured, is_popular, is_best_seller, status. Existing SKUs are updated with the
+  columns present in the row.
+- variant: product_sku, sku, price, stock_quantity, attributes (``Color=Red|Size=M`` in
+  CSV, an object in JSONL)
+- image: product_sku, url (a hosted image used as is) or source_key (an object already in
+  the bucket, processed by process_product_image), alt_text, is_primary, sort_order
+
+A variant or image may reference a product of the same file as long as the product row
+comes first. Rows that fail validation are reported with their line number and skipped.
+"""
+import csv
+import io
+import json
+import os
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from product.images import enqueue_image_processing
+from product.models import Brand, Product, ProductAttribute, ProductAttributeValue, ProductImage, ProductVariant, \
+    ProductVariantAttribute, SubCategory
+from product.search import update_product_search_index
+from utils.cache import invalidate_cache_tags
+
+ROW_TYPES = ('product', 'variant', 'image')
+
+PRODUCT_TEXT_FIELDS = ['name', 'description', 'short_description', 'meta_title', 'meta_description', 'status']
+PRODUCT_DECIMAL_FIELDS = ['price', 'compare_price', 'cost_price', 'weight', 'length', 'width', 'height']
+PRODUCT_INTEGER_FIELDS = ['stock_quantity', 'low_stock_threshold']
+PRODUCT_BOOLEAN_FIELDS = ['track_inventory', 'allow_backorder', 'is_featured', 'is_popular', 'is_best_seller']
+REQUIRED_PRODUCT_FIELDS = ['name', 'sub_category', 'price']
+
+
+class RowError(Exception):
+    pass
+
+
+class ImportReport:
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.rows = 0
+        self.created = {row_type: 0 for row_type in ROW_TYPES}
+        self.updated = {row_type: 0 for row_type in ROW_TYPES}
+        # (line, sku, message)
+        self.errors = []
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def as_dict(self):
+        return {
+            'dry_run': self.dry_run,
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'errors': [{'line': line, 'sku': sku, 'error': message} for line, sku, message in self.errors],
+        }
+
+
+def iter_rows(file, file_format):
+    """Yield ``(line, row)`` from a CSV or JSONL file object, text or binary"""
+    if isinstance(file.read(0), bytes):
+        file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line, text in enumerate(file, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except json.JSONDecodeError as e:
+                row = e
+            yield line, row
+    else:
+        raise ValueError(f'Unknown import format {file_format}')
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    return {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(extension)
+
+
+def _provided(value):
+    return value is not None and value != ''
+
+
+def _decimal(value, field):
+    try:
+        return Decimal(str(value).strip())
+    except InvalidOperation:
+        raise RowError(f'{field}: {value!r} is not a number')
+
+
+def _integer(value, field):
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise RowError(f'{field}: {value!r} is not a whole number')
+
+
+def _boolean(value, field):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes', 'y'):
+        return True
+    if text in ('0', 'false', 'no', 'n'):
+        return False
+    raise RowError(f'{field}: {value!r} is not a boolean')
+
+
+def _attributes(value):
+    """``Color=Red|Size=M`` or ``{"Color": "Red"}`` as ``[(name, value)]``"""
+    if not _provided(value):
+        return []
+    if isinstance(value, dict):
+        pairs = value.items()
+    else:
+        try:
+            pairs = [item.split('=', 1) for item in str(value).split('|') if item.strip()]
+            pairs = [(name, attribute_value) for name, attribute_value in pairs]
+        except ValueError:
+            raise RowError(f'attributes: {value!r} must look like Color=Red|Size=M')
+    return [(str(name).strip(), str(attribute_value).strip()) for name, attribute_value in pairs]
+
+
+class CatalogImporter:
+    """Imports the rows of ``iter_rows``, see the module docstring for the columns"""
+
+    def __init__(self, chunk_size=500, dry_run=False):
+        self.chunk_size = chunk_size
+        self.report = ImportReport(dry_run)
+        # skus of the file, a sku may only appear once
+        self.seen_skus = set()
+        # cache tags of everything written, invalidated once at the end
+        self.tags = set()
+        self.indexed_products = set()
+        self._preload()
+
+    def _preload(self):
+        self.product_ids = dict(Product.all_objects.values_list('sku', 'id'))
+        self.variants = {sku: (pk, product_id) for sku, pk, product_id in
+                         ProductVariant.all_objects.values_list('sku', 'id', 'product_id')}
+        sub_categories = list(SubCategory.all_objects.values_list('id', 'name', 'category_id'))
+        self.sub_categories = {name.lower(): (pk, category_id) for pk, name, category_id in sub_categories}
+        self.category_ids = {pk: category_id for pk, _, category_id in sub_categories}
+        self.brands = {name.lower(): pk for pk, name in Brand.all_objects.values_list('id', 'name')}
+        self.attributes = {name.lower(): pk for pk, name in ProductAttribute.all_objects.values_list('id', 'name')}
+        self.attribute_values = {(attribute_id, value.lower()): pk for pk, attribute_id, value in
+                                 ProductAttributeValue.all_objects.values_list('id', 'attribute_id', 'value')}
+
+    def run(self, rows):
+        if self.report.dry_run:
+            # everything is written and validated, then rolled back
+            with transaction.atomic():
+                self._import(rows)
+                transaction.set_rollback(True)
+            return self.report
+
+        self._import(rows)
+        self._finish()
+        return self.report
+
+    def _import(self, rows):
+        chunk = []
+        for line, row in rows:
+            self.report.rows += 1
+            chunk.append((line, row))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk)
+
+    def _import_chunk(self, chunk):
+        by_type = {row_type: [] for row_type in ROW_TYPES}
+        for line, row in chunk:
+            if not isinstance(row, dict):
+                self._error(line, {}, str(row) if isinstance(row, Exception) else 'Not an object')
+                continue
+            row_type = (row.get('type') or '').strip().lower()
+            if row_type not in ROW_TYPES:
+                self._error(line, row, f'type must be one of {", ".join(ROW_TYPES)}')
+                continue
+            by_type[row_type].append((line, row))
+
+        created, updated, errors = dict(self.report.created), dict(self.report.updated), len(self.report.errors)
+        tags, indexed = set(self.tags), set(self.indexed_products)
+        try:
+            with transaction.atomic():
+                self._import_products(by_type['product'])
+                self._import_variants(by_type['variant'])
+                self._import_images(by_type['image'])
+        except Exception as e:
+            # undo the counts of the chunk and report every row of it
+            self.report.created, self.report.updated = created, updated
+            del self.report.errors[errors:]
+            self.tags, self.indexed_products = tags, indexed
+            for rows in by_type.values():
+                for line, row in rows:
+                    self._error(line, row, f'Chunk failed: {e}')
+            self._preload()
+
+    def _error(self, line, row, message):
+        self.report.errors.append((line, row.get('sku') or row.get('product_sku') or '', message))
+
+    def _claim_sku(self, sku):
+        if not _provided(sku):
+            raise RowError('sku is required')
+        sku = str(sku).strip()
+        if sku in self.seen_skus:
+            raise RowError(f'sku {sku} appears more than once in the file')
+        self.seen_skus.add(sku)
+        return sku
+
+    def _product_id(self, row):
+        sku = str(row.get('product_sku') or '').strip()
+        if sku not in self.product_ids:
+            raise RowError(f'Unknown product_sku {sku!r}')
+        return self.product_ids[sku]
+
+    def _product_tags(self, product):
+        tags = {f'product:{product.pk}', 'products:all', f'products:sub_category:{product.sub_category_id}',
+                f'products:category:{self.category_ids[product.sub_category_id]}'}
+        if product.brand_id:
+            tags.add(f'products:brand:{product.brand_id}')
+        return tags
+
+    def _product_values(self, row):
+        values = {}
+        for field in PRODUCT_TEXT_FIELDS:
+            if _provided(row.get(field)):
+                values[field] = str(row[field]).strip()
+        for field in PRODUCT_DECIMAL_FIELDS:
+            if _provided(row.get(field)):
+                values[field] = _decimal(row[field], field)
+        for field in PRODUCT_INTEGER_FIELDS:
+            if _provided(row.get(field)):
+                values[field] = _integer(row[field], field)
+        for field in PRODUCT_BOOLEAN_FIELDS:
+            if _provided(row.get(field)):
+                values[field] = _boolean(row[field], field)
+
+        if _provided(row.get('sub_category')):
+            name = str(row['sub_category']).strip()
+            if name.lower() not in self.sub_categories:
+                raise RowError(f'Unknown sub_category {name!r}')
+            values['sub_category_id'] = self.sub_categories[name.lower()][0]
+        if _provided(row.get('brand')):
+            name = str(row['brand']).strip()
+            if name.lower() not in self.brands:
+                raise RowError(f'Unknown brand {name!r}')
+            values['brand_id'] = self.brands[name.lower()]
+
+        if values.get('price', 0) < 0:
+            raise RowError('price must not be negative')
+        if values.get('stock_quantity', 0) < 0:
+            raise RowError('stock_quantity must not be negative')
+        return values
+
+    def _import_products(self, rows):
+        skus = [str(row.get('sku') or '').strip() for _, row in rows]
+        existing = {product.sku: product for product in Product.all_objects.filter(
+            sku__in=[sku for sku in skus if sku in self.product_ids]
+        )}
+        new, updates, fields = [], [], set()
+        now = timezone.now()
+        for line, row in rows:
+            try:
+                sku = self._claim_sku(row.get('sku'))
+                values = self._product_values(row)
+                product = existing.get(sku)
+                if product is None:
+                    missing = [field for field in REQUIRED_PRODUCT_FIELDS
+                               if field not in values and f'{field}_id' not in values]
+                    if missing:
+                        raise RowError(f'{", ".join(missing)} required for a new product')
+            except RowError as e:
+                self._error(line, row, str(e))
+                continue
+
+            if product is None:
+                values.setdefault('description', '')
+                new.append(Product(sku=sku, **values))
+                continue
+            # a moved product leaves the listings it was in
+            self.tags.update(self._product_tags(product))
+            for field, value in values.items():
+                setattr(product, field, value)
+            product.updated_on = now
+            updates.append(product)
+            fields.update(field.removesuffix('_id') if field.endswith('_id') else field for field in values)
+
+        Product.all_objects.bulk_create(new, batch_size=self.chunk_size)
+        if updates and fields:
+            Product.all_objects.bulk_update(updates, [*fields, 'updated_on'], batch_size=self.chunk_size)
+        for product in [*new, *updates]:
+            self.product_ids[product.sku] = product.pk
+            self.tags.update(self._product_tags(product))
+            self.indexed_products.add(product.pk)
+        self.report.created['product'] += len(new)
+        self.report.updated['product'] += len(updates)
+
+    def _attribute_value_ids(self, attributes):
+        """``[(attribute id, value id)]``, creating the attributes and values that don't exist yet"""
+        ids = []
+        for name, value in attributes:
+            if not name or not value:
+                raise RowError('attributes need a name and a value')
+            attribute_id = self.attributes.get(name.lower())
+            if attribute_id is None:
+                attribute_id = ProductAttribute.all_objects.create(name=name).pk
+                self.attributes[name.lower()] = attribute_id
+            value_id = self.attribute_values.get((attribute_id, value.lower()))
+            if value_id is None:
+                value_id = ProductAttributeValue.all_objects.create(attribute_id=attribute_id, value=value).pk
+                self.attribute_values[(attribute_id, value.lower())] = value_id
+            ids.append((attribute_id, value_id))
+        return ids
+
+    def _import_variants(self, rows):
+        new, updates, variant_attributes = [], [], []
+        now = timezone.now()
+        existing = {variant.sku: variant for variant in ProductVariant.all_objects.filter(
+            sku__in=[str(row.get('sku') or '').strip() for _, row in rows if
+                     str(row.get('sku') or '').strip() in self.variants]
+        )}
+        for line, row in rows:
+            try:
+                product_id = self._product_id(row)
+                sku = self._claim_sku(row.get('sku'))
+                price = _decimal(row['price'], 'price') if _provided(row.get('price')) else None
+                stock = _integer(row['stock_quantity'], 'stock_quantity') \
+                    if _provided(row.get('stock_quantity')) else None
+                if stock is not None and stock < 0:
+                    raise RowError('stock_quantity must not be negative')
+                attribute_ids = self._attribute_value_ids(_attributes(row.get('attributes')))
+                variant = existing.get(sku)
+                if variant is not None and variant.product_id != product_id:
+                    raise RowError(f'Variant {sku} belongs to another product')
+            except RowError as e:
+                self._error(line, row, str(e))
+                continue
+
+            if variant is None:
+                variant = ProductVariant(product_id=product_id, sku=sku, price=price, stock_quantity=stock or 0)
+                new.append(variant)
+            else:
+                if price is not None:
+                    variant.price = price
+                if stock is not None:
+                    variant.stock_quantity = stock
+                variant.updated_on = now
+                updates.append(variant)
+            variant_attributes.extend(
+                ProductVariantAttribute(variant=variant, attribute_id=attribute_id, value_id=value_id)
+                for attribute_id, value_id in attribute_ids
+            )
+            self.tags.add(f'product:{product_id}')
+
+        ProductVariant.all_objects.bulk_create(new, batch_size=self.chunk_size)
+        ProductVariant.all_objects.bulk_update(updates, ['price', 'stock_quantity', 'updated_on'],
+                                               batch_size=self.chunk_size)
+        ProductVariantAttribute.all_objects.bulk_create(
+            variant_attributes, batch_size=self.chunk_size, update_conflicts=True,
+            unique_fields=['variant', 'attribute'], update_fields=['value'],
+        )
+        for variant in [*new, *updates]:
+            self.variants[variant.sku] = (variant.pk, variant.product_id)
+        self.report.created['variant'] += len(new)
+        self.report.updated['variant'] += len(updates)
+
+    def _import_images(self, rows):
+        images = []
+        primaries = {}
+        for line, row in rows:
+            try:
+                product_id = self._product_id(row)
+                url, source_key = (str(row.get(field) or '').strip() for field in ('url', 'source_key'))
+                if bool(url) == bool(source_key):
+                    raise RowError('an image needs either a url or a source_key')
+                if url and not url.startswith(('http://', 'https://')):
+                    raise RowError(f'url {url!r} must be http(s)')
+                is_primary = _boolean(row['is_primary'], 'is_primary') if _provided(row.get('is_primary')) else False
+                sort_order = _integer(row['sort_order'], 'sort_order') if _provided(row.get('sort_order')) else 0
+            except RowError as e:
+                self._error(line, row, str(e))
+                continue
+
+            image = ProductImage(
+                product_id=product_id, file_id=str(uuid.uuid4()), alt_text=str(row.get('alt_text') or ''),
+                original_filename=os.path.basename(url or source_key)[:255], sort_order=sort_order,
+            )
+            if url:
+                # a hosted image, served as is in every size
+                for size in ('thumbnail', 'medium', 'large', 'original'):
+                    setattr(image, f'{size}_url', url)
+            else:
+                image.source_key, image.processing_status = source_key, 'pending'
+            if is_primary:
+                # the last primary of a product wins
+                primaries[product_id] = image
+            images.append(image)
+            self.tags.add(f'product:{product_id}')
+
+        # inserted as secondary images, then switched (a product has a single primary image)
+        ProductImage.all_objects.bulk_create(images, batch_size=self.chunk_size)
+        if primaries:
+            ProductImage.all_objects.filter(product_id__in=primaries, is_primary=True).update(is_primary=False)
+            ProductImage.all_objects.filter(pk__in=[image.pk for image in primaries.values()]).update(is_primary=True)
+            for image in primaries.values():
+                image.is_primary = True
+        pending = [image for image in images if image.processing_status == 'pending']
+        if pending:
+            transaction.on_commit(lambda: [enqueue_image_processing(image) for image in pending])
+        self.report.created['image'] += len(images)
+
+    def _finish(self):
+        """One cache invalidation and search index update for the whole import"""
+        invalidate_cache_tags(*self.tags, source='bulk_import')
+        product_ids = list(self.indexed_products)
+        for start in range(0, len(product_ids), 1000):
+            update_product_search_index(Product.all_objects.filter(pk__in=product_ids[start:start + 1000]))
+
+
+def import_catalog(file, file_format, chunk_size=500, dry_run=False):
+    """Import a CSV/JSONL catalog file object, returns the ImportReport"""
+    return CatalogImporter(chunk_size=chunk_size, dry_run=dry_run).run(iter_rows(file, file_format))
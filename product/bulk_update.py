@@ -0,0 +1,273 @@
+"""
+Bulk product updates.
+
+A BulkProductUpdate selects products with ``filters`` and applies ``changes`` to them
+in chunks of primary keys, one set-based UPDATE per chunk, so the prices of a whole
+category change without loading or saving a single model:
+
+    filters: category, sub_category, brand, product_ids, min_price, max_price,
+             is_featured, is_popular, is_best_seller
+    changes: {'price': {'mode': 'percent', 'value': '-10'},      # percent, amount or set
+              'stock': {'mode': 'adjust', 'value': 5},           # adjust or set
+              'flags': {'is_featured': True}}
+
+Prices and stock never go below zero. Stock changes are recorded as StockMovements
+referencing the update. The cached payloads of the updated products (and the
+listings of their categories and brands) are invalidated once, when the run ends.
+"""
+import math
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import DecimalField, F, IntegerField, Value
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+
+from product.helpers import filter_products
+from product.models import BulkProductUpdate, Product, StockMovement
+from utils.cache import invalidate_cache_tags
+
+FILTER_FIELDS = ['category', 'sub_category', 'brand', 'min_price', 'max_price']
+FLAG_FIELDS = ['is_featured', 'is_popular', 'is_best_seller']
+PRICE_MODES = ['percent', 'amount', 'set']
+STOCK_MODES = ['adjust', 'set']
+PREVIEW_SAMPLE_SIZE = 5
+
+
+class BulkUpdateError(Exception):
+    pass
+
+
+def _decimal(value, name):
+    try:
+        value = Decimal(str(value))
+    except InvalidOperation:
+        raise BulkUpdateError(f'{name} must be a number')
+    if not value.is_finite():
+        raise BulkUpdateError(f'{name} must be a number')
+    return value
+
+
+def validate_filters(filters):
+    """``filters`` with the unknown keys rejected, json serializable"""
+    unknown = set(filters) - {*FILTER_FIELDS, *FLAG_FIELDS, 'product_ids'}
+    if unknown:
+        raise BulkUpdateError(f'Unknown filters: {", ".join(sorted(unknown))}')
+    if not filters:
+        # a bulk update of the whole catalog has to be asked for explicitly
+        raise BulkUpdateError('At least one filter is required')
+    cleaned = {}
+    for field in FILTER_FIELDS:
+        if filters.get(field) not in (None, ''):
+            cleaned[field] = str(filters[field])
+    for field in ('min_price', 'max_price'):
+        if field in cleaned:
+            cleaned[field] = str(_decimal(cleaned[field], field))
+    for flag in FLAG_FIELDS:
+        if filters.get(flag):
+            cleaned[flag] = True
+    if filters.get('product_ids'):
+        if not isinstance(filters['product_ids'], list):
+            raise BulkUpdateError('product_ids must be a list')
+        cleaned['product_ids'] = [str(product_id) for product_id in filters['product_ids']]
+    return cleaned
+
+
+def validate_changes(changes):
+    """``changes`` checked and normalized, json serializable"""
+    unknown = set(changes) - {'price', 'stock', 'flags'}
+    if unknown:
+        raise BulkUpdateError(f'Unknown changes: {", ".join(sorted(unknown))}')
+    for change in ('price', 'stock', 'flags'):
+        if changes.get(change) and not isinstance(changes[change], dict):
+            raise BulkUpdateError(f'{change} must be an object')
+    cleaned = {}
+    if changes.get('price'):
+        price = changes['price']
+        if price.get('mode') not in PRICE_MODES:
+            raise BulkUpdateError(f'price mode must be one of {", ".join(PRICE_MODES)}')
+        value = _decimal(price.get('value'), 'price value')
+        if price['mode'] == 'percent' and value <= -100:
+            raise BulkUpdateError('A price cannot drop by 100% or more')
+        if price['mode'] == 'set' and value < 0:
+            raise BulkUpdateError('price must not be negative')
+        cleaned['price'] = {'mode': price['mode'], 'value': str(value)}
+    if changes.get('stock'):
+        stock = changes['stock']
+        if stock.get('mode') not in STOCK_MODES:
+            raise BulkUpdateError(f'stock mode must be one of {", ".join(STOCK_MODES)}')
+        try:
+            value = int(stock.get('value'))
+        except (TypeError, ValueError):
+            raise BulkUpdateError('stock value must be a whole number')
+        if stock['mode'] == 'set' and value < 0:
+            raise BulkUpdateError('stock must not be negative')
+        cleaned['stock'] = {'mode': stock['mode'], 'value': value}
+    if changes.get('flags'):
+        unknown = set(changes['flags']) - set(FLAG_FIELDS)
+        if unknown:
+            raise BulkUpdateError(f'Unknown flags: {", ".join(sorted(unknown))}')
+        cleaned['flags'] = {flag: bool(value) for flag, value in changes['flags'].items()}
+    if not cleaned:
+        raise BulkUpdateError('Nothing to change')
+    return cleaned
+
+
+def bulk_update_queryset(filters):
+    queryset = Product.objects.all()
+    if filters.get('product_ids'):
+        queryset = queryset.filter(pk__in=filters['product_ids'])
+    return filter_products(
+        queryset, category_id=filters.get('category'), sub_category_id=filters.get('sub_category'),
+        brand_id=filters.get('brand'), min_price=filters.get('min_price'), max_price=filters.get('max_price'),
+        is_featured=filters.get('is_featured'), is_popular=filters.get('is_popular'),
+        is_best_seller=filters.get('is_best_seller'),
+    )
+
+
+def update_expressions(changes):
+    """field -> the expression computing its new value, for QuerySet.update()/annotate()"""
+    expressions = {}
+    price = changes.get('price')
+    if price:
+        value = Decimal(price['value'])
+        if price['mode'] == 'percent':
+            new_price = Round(F('price') * Value(1 + value / 100), 2)
+        elif price['mode'] == 'amount':
+            new_price = F('price') + Value(value)
+        else:
+            new_price = Value(value)
+        expressions['price'] = Greatest(new_price, Value(Decimal('0')),
+                                        output_field=DecimalField(max_digits=10, decimal_places=2))
+    stock = changes.get('stock')
+    if stock:
+        new_stock = F('stock_quantity') + Value(stock['value']) if stock['mode'] == 'adjust' else Value(stock['value'])
+        expressions['stock_quantity'] = Greatest(new_stock, Value(0), output_field=IntegerField())
+    for flag, value in changes.get('flags', {}).items():
+        expressions[flag] = Value(value)
+    return expressions
+
+
+def preview_bulk_update(filters, changes, chunk_size=1000):
+    """Counts and a sample of the new values, nothing is written"""
+    queryset = bulk_update_queryset(filters)
+    matched = queryset.count()
+    expressions = update_expressions(changes)
+    fields = list(expressions)
+    sample = queryset.order_by('pk').annotate(
+        **{f'new_{field}': expression for field, expression in expressions.items()}
+    ).values('id', 'sku', *fields, *(f'new_{field}' for field in fields))[:PREVIEW_SAMPLE_SIZE]
+    return {
+        'matched': matched,
+        'chunks': math.ceil(matched / chunk_size),
+        'sample': [{key: str(value) if isinstance(value, Decimal) else value for key, value in row.items()}
+                   for row in sample],
+    }
+
+
+def start_bulk_update(job):
+    """Validate and save an unsaved ``job``, returns its preview for a dry run
+
+    A dry run is previewed right away and recorded as completed; a real one is queued
+    once the transaction commits and None is returned.
+    """
+    job.filters, job.changes = validate_filters(job.filters), validate_changes(job.changes)
+    if not job.dry_run:
+        job.save()
+        from product.tasks import apply_bulk_product_update
+        transaction.on_commit(lambda: apply_bulk_product_update.delay(str(job.pk)))
+        return None
+
+    preview = preview_bulk_update(job.filters, job.changes, job.chunk_size)
+    job.matched_count, job.chunks_total = preview['matched'], preview['chunks']
+    job.update_status, job.finished_at = 'completed', timezone.now()
+    job.save()
+    return preview
+
+
+def _cache_tags(product_ids):
+    tags = {'products:all', *(f'product:{product_id}' for product_id in product_ids)}
+    scopes = Product.all_objects.filter(pk__in=product_ids).values_list(
+        'sub_category_id', 'sub_category__category_id', 'brand_id').distinct()
+    for sub_category_id, category_id, brand_id in scopes:
+        tags.update([f'products:sub_category:{sub_category_id}', f'products:category:{category_id}'])
+        if brand_id:
+            tags.add(f'products:brand:{brand_id}')
+    return tags
+
+
+def _apply_chunk(job, product_ids, expressions):
+    """One UPDATE for the chunk, plus the stock movements; returns the number of updated products"""
+    products = Product.all_objects.filter(pk__in=product_ids)
+    previous_stock = {}
+    if 'stock_quantity' in expressions:
+        previous_stock = dict(products.select_for_update().values_list('pk', 'stock_quantity'))
+    updated = products.update(**expressions, updated_on=timezone.now())
+    if previous_stock:
+        movements = []
+        for product_id, new_stock in products.values_list('pk', 'stock_quantity'):
+            previous = previous_stock[product_id]
+            if new_stock != previous:
+                movements.append(StockMovement(
+                    product_id=product_id, movement_type='adjustment', quantity=new_stock - previous,
+                    previous_stock=previous, new_stock=new_stock, reference_id=str(job.pk),
+                    notes='Bulk product update', created_by=job.created_by,
+                ))
+        StockMovement.objects.bulk_create(movements)
+    return updated
+
+
+def run_bulk_update(job):
+    """Apply ``job`` chunk by chunk, resuming after ``last_product_id``"""
+    queryset = bulk_update_queryset(job.filters)
+    expressions = update_expressions(job.changes)
+    if job.last_product_id is None:
+        job.matched_count = queryset.count()
+        job.chunks_total = math.ceil(job.matched_count / job.chunk_size)
+    job.update_status, job.started_at, job.error = 'running', job.started_at or timezone.now(), None
+    job.save(update_fields=['matched_count', 'chunks_total', 'update_status', 'started_at', 'error', 'updated_on'])
+
+    tags = set()
+    try:
+        while True:
+            chunk = queryset.order_by('pk')
+            if job.last_product_id:
+                chunk = chunk.filter(pk__gt=job.last_product_id)
+            product_ids = list(chunk.values_list('pk', flat=True)[:job.chunk_size])
+            if not product_ids:
+                break
+            with transaction.atomic():
+                updated = _apply_chunk(job, product_ids, expressions)
+                job.chunks_done += 1
+                job.updated_count += updated
+                job.last_product_id = product_ids[-1]
+                job.save(update_fields=['chunks_done', 'updated_count', 'last_product_id', 'updated_on'])
+            tags.update(_cache_tags(product_ids))
+    except Exception as e:
+        job.update_status, job.error = 'failed', str(e)
+        job.save(update_fields=['update_status', 'error', 'updated_on'])
+        raise
+    finally:
+        # the chunks written so far, in one go
+        invalidate_cache_tags(*tags, source='bulk_update')
+
+    job.update_status, job.finished_at = 'completed', timezone.now()
+    job.save(update_fields=['update_status', 'finished_at', 'updated_on'])
+    return job
+
+
+def bulk_update_payload(job):
+    return {
+        'id': str(job.pk),
+        'status': job.update_status,
+        'dry_run': job.dry_run,
+        'filters': job.filters,
+        'changes': job.changes,
+        'matched': job.matched_count,
+        'updated': job.updated_count,
+        'chunks_done': job.chunks_done,
+        'chunks_total': job.chunks_total,
+        'error': job.error,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
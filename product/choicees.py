@@ -79,6 +79,21 @@ MOVEMENT_TYPE = (
     ('adjustment', 'Adjustment'),
     ('damaged', 'Damaged'),
     ('lost', 'Lost'),
+    ('reservation', 'Reservation'),
+    ('release', 'Reservation Release'),
+)
+
+IMAGE_PROCESSING_STATUS = (
+    ('pending', 'Pending'),
+    ('processing', 'Processing'),
+    ('ready', 'Ready'),
+    ('failed', 'Failed'),
+)
+
+RESERVATION_STATUS = (
+    ('reserved', 'Reserved'),
+    ('committed', 'Committed'),
+    ('released', 'Released'),
 )
 
 RECOMMENDATION_TYPE = (
@@ -87,4 +102,11 @@ RECOMMENDATION_TYPE = (
     ('recently_viewed', 'Recently Viewed'),
     ('trending', 'Trending'),
     ('personalized', 'Personalized'),
-)
\ No newline at end of file
+)
+
+BULK_UPDATE_STATUS = (
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('completed', 'Completed'),
+    ('failed', 'Failed'),
+)
@@ -0,0 +1,264 @@
+"""
+Flash sale engine.
+
+When a sale starts ``sync_flash_sales`` (celery beat) loads its items into redis:
+
+- ``flash_sale:items`` hash, product id -> json of the sale item (prices, limit, end)
+- ``flash_sale:remaining:<item id>`` the quantity left of the items with a stock_limit
+
+Buying claims quantity with one Lua script that checks and decrements the remaining
+quantity atomically, so thousands of buyers on the same item never touch its row and
+can never oversell it. The claimed quantities accumulate in the ``flash_sale:sold``
+hash and are reconciled into FlashSaleItem.sold_quantity in batches; the quantities of
+a reconcile that died are given back to the hash by a later run (see
+utils.cache.recover_redis_hashes).
+
+Sale prices are read from an in-process copy of the items hash, refreshed every few
+seconds, so overlaying them on product payloads costs no query at all.
+
+Without redis (local memory cache in dev/tests) the sale items are read from the
+database and claims are guarded UPDATEs of sold_quantity.
+"""
+import json
+import logging
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from oumraa import settings
+from product.models import FlashSale, FlashSaleItem
+from utils.cache import drop_redis_hash, get_redis_client, restore_redis_hash, take_redis_hash
+
+logger = logging.getLogger(__name__)
+
+ITEMS_KEY = 'flash_sale:items'
+SOLD_KEY = 'flash_sale:sold'
+LOADED_SALES_KEY = 'flash_sale:loaded'
+REMAINING_KEY = 'flash_sale:remaining:{}'
+DB_ITEMS_CACHE_KEY = 'flash_sale:db_items'
+
+# KEYS[1] remaining quantity, KEYS[2] sold hash; ARGV[1] item id, ARGV[2] quantity
+CLAIM_SCRIPT = """
+local remaining = tonumber(redis.call('GET', KEYS[1]) or '-1')
+local quantity = tonumber(ARGV[2])
+if remaining < quantity then
+    return -1
+end
+redis.call('DECRBY', KEYS[1], quantity)
+redis.call('HINCRBY', KEYS[2], ARGV[1], quantity)
+return remaining - quantity
+"""
+
+_sale_items = {'items': {}, 'expires': 0}
+
+
+def sale_item_entry(item, flash_sale):
+    return {
+        'item_id': str(item.pk),
+        'flash_sale_id': str(flash_sale.pk),
+        'product_id': str(item.product_id),
+        'sale_price': str(item.sale_price),
+        'original_price': str(item.original_price),
+        'stock_limit': item.stock_limit,
+        'ends_at': flash_sale.end_time.isoformat(),
+    }
+
+
+def _running_sales(now=None):
+    now = now or timezone.now()
+    return FlashSale.objects.active().filter(start_time__lte=now, end_time__gt=now)
+
+
+def load_flash_sale(flash_sale):
+    """Publish the items of ``flash_sale`` to redis"""
+    redis = get_redis_client()
+    items = list(flash_sale.items.active())
+    pipe = redis.pipeline()
+    for item in items:
+        pipe.hset(ITEMS_KEY, str(item.product_id), json.dumps(sale_item_entry(item, flash_sale)))
+        if item.stock_limit is not None:
+            # NX: a reload must not reset what was claimed since the last reconcile
+            pipe.set(REMAINING_KEY.format(item.pk), max(item.stock_limit - item.sold_quantity, 0), nx=True)
+    pipe.sadd(LOADED_SALES_KEY, str(flash_sale.pk))
+    pipe.execute()
+    return len(items)
+
+
+def unload_flash_sale(flash_sale_id):
+    """Take an ended sale out of redis, its claims must have been reconciled"""
+    redis = get_redis_client()
+    items = list(FlashSaleItem.all_objects.filter(flash_sale_id=flash_sale_id).values_list('pk', 'product_id'))
+    entries = redis.hmget(ITEMS_KEY, [str(product_id) for _, product_id in items]) if items else []
+    pipe = redis.pipeline()
+    for (item_id, product_id), entry in zip(items, entries):
+        # a later sale of the same product may have replaced the entry
+        if entry and json.loads(entry)['item_id'] == str(item_id):
+            pipe.hdel(ITEMS_KEY, str(product_id))
+        pipe.delete(REMAINING_KEY.format(item_id))
+    pipe.srem(LOADED_SALES_KEY, str(flash_sale_id))
+    pipe.execute()
+
+
+def sync_flash_sales():
+    """Load the sales that started, reconcile the claims and unload the sales that ended"""
+    redis = get_redis_client()
+    if redis is None:
+        return
+    loaded = {member.decode() if isinstance(member, bytes) else member
+              for member in redis.smembers(LOADED_SALES_KEY)}
+    running = {str(sale.pk): sale for sale in _running_sales()}
+
+    for sale_id in running.keys() - loaded:
+        count = load_flash_sale(running[sale_id])
+        logger.info('Loaded flash sale %s with %s items', sale_id, count)
+
+    reconcile_flash_sale_sold()
+    for sale_id in loaded - running.keys():
+        unload_flash_sale(sale_id)
+        logger.info('Unloaded flash sale %s', sale_id)
+
+
+def get_sale_items():
+    """Product id -> sale item of the running sales
+
+    Read from an in-process copy of the redis hash refreshed every few seconds; without
+    redis from the database, cached for as long.
+    """
+    interval = getattr(settings, 'FLASH_SALE_REFRESH_INTERVAL', 5)
+    redis = get_redis_client()
+    if redis is None:
+        items = cache.get(DB_ITEMS_CACHE_KEY)
+        if items is None:
+            items = FlashSaleItem.objects.active().select_related('flash_sale').filter(
+                flash_sale__in=_running_sales()
+            )
+            items = {str(item.product_id): sale_item_entry(item, item.flash_sale) for item in items}
+            cache.set(DB_ITEMS_CACHE_KEY, items, interval)
+    else:
+        now = time.monotonic()
+        if now >= _sale_items['expires']:
+            _sale_items['items'] = {
+                (product_id.decode() if isinstance(product_id, bytes) else product_id): json.loads(entry)
+                for product_id, entry in redis.hgetall(ITEMS_KEY).items()
+            }
+            _sale_items['expires'] = now + interval
+        items = _sale_items['items']
+
+    current = timezone.now()
+    return {product_id: entry for product_id, entry in items.items() if parse_datetime(entry['ends_at']) > current}
+
+
+def get_sale_item(product_id):
+    return get_sale_items().get(str(product_id))
+
+
+def overlay_sale_price(data, sale_items=None):
+    """Set ``flash_sale`` on a serialized product (a dict with ``id``)
+
+    Works on cached payloads too, the overlay is always the current one.
+    """
+    entry = (get_sale_items() if sale_items is None else sale_items).get(str(data['id']))
+    data['flash_sale'] = {
+        'sale_price': entry['sale_price'],
+        'original_price': entry['original_price'],
+        'ends_at': entry['ends_at'],
+    } if entry else None
+    return data
+
+
+def overlay_sale_prices(products):
+    sale_items = get_sale_items()
+    return [overlay_sale_price(data, sale_items) for data in products]
+
+
+def claim_sale_quantity(entry, quantity):
+    """Take ``quantity`` of a sale item, False when not enough is left
+
+    Claims are not transactional: release them when the purchase does not go through.
+    """
+    if entry['stock_limit'] is None:
+        _add_sold(entry, quantity)
+        return True
+
+    redis = get_redis_client()
+    if redis is None:
+        return bool(FlashSaleItem.all_objects.filter(
+            pk=entry['item_id'], sold_quantity__lte=F('stock_limit') - quantity
+        ).update(sold_quantity=F('sold_quantity') + quantity))
+
+    # register_script runs it with EVALSHA, the script body is only sent once
+    claim = redis.register_script(CLAIM_SCRIPT)
+    return claim(keys=[REMAINING_KEY.format(entry['item_id']), SOLD_KEY], args=[entry['item_id'], quantity]) >= 0
+
+
+def release_sale_quantity(entry, quantity):
+    redis = get_redis_client()
+    if redis is None:
+        FlashSaleItem.all_objects.filter(pk=entry['item_id']).update(sold_quantity=F('sold_quantity') - quantity)
+        return
+
+    pipe = redis.pipeline()
+    if entry['stock_limit'] is not None:
+        pipe.incrby(REMAINING_KEY.format(entry['item_id']), quantity)
+    pipe.hincrby(SOLD_KEY, entry['item_id'], -quantity)
+    pipe.execute()
+
+
+def release_failed_claims(claims):
+    """Give back the ``(entry, quantity)`` claims of a purchase whose transaction rolled back
+
+    The claims of the database fallback were rolled back with it already.
+    """
+    if get_redis_client() is None:
+        return
+    for entry, quantity in claims:
+        release_sale_quantity(entry, quantity)
+
+
+def release_order_sale_claims(claims):
+    """Give back the ``(flash sale item, quantity)`` claims of a cancelled order
+
+    Sales that ended are out of redis already, only their sold quantity goes down.
+    """
+    now = timezone.now()
+    for item, quantity in claims:
+        if item.flash_sale.end_time > now:
+            release_sale_quantity(sale_item_entry(item, item.flash_sale), quantity)
+        else:
+            FlashSaleItem.all_objects.filter(pk=item.pk).update(sold_quantity=F('sold_quantity') - quantity)
+
+
+def _add_sold(entry, quantity):
+    redis = get_redis_client()
+    if redis is None:
+        FlashSaleItem.all_objects.filter(pk=entry['item_id']).update(sold_quantity=F('sold_quantity') + quantity)
+    else:
+        redis.hincrby(SOLD_KEY, entry['item_id'], quantity)
+
+
+def reconcile_flash_sale_sold(batch_size=500):
+    """Add the claimed quantities to FlashSaleItem.sold_quantity, one UPDATE per batch of items"""
+    redis = get_redis_client()
+    if redis is None:
+        return 0
+
+    flushing_key, sold = take_redis_hash(redis, SOLD_KEY)
+    sold = {item_id: quantity for item_id, quantity in sold.items() if quantity}
+    item_ids = list(sold)
+    try:
+        with transaction.atomic():
+            for start in range(0, len(item_ids), batch_size):
+                batch = item_ids[start:start + batch_size]
+                FlashSaleItem.all_objects.filter(pk__in=batch).update(sold_quantity=F('sold_quantity') + Case(
+                    *(When(pk=item_id, then=Value(sold[item_id])) for item_id in batch),
+                    default=Value(0), output_field=IntegerField(),
+                ))
+    except Exception:
+        restore_redis_hash(redis, SOLD_KEY, flushing_key, sold)
+        raise
+    drop_redis_hash(redis, SOLD_KEY, flushing_key)
+    return len(item_ids)
@@ -0,0 +1,75 @@
+from django.db.models import Prefetch
+
+from product.models import Product, ProductImage, ProductVariant
+
+
+def primary_image_prefetch(lookup='images'):
+    """Prefetch the primary image into ``prefetched_primary_images`` (read by Product.primary_image)"""
+    return Prefetch(lookup, queryset=ProductImage.objects.filter(is_primary=True).order_by('id'),
+                    to_attr='prefetched_primary_images')
+
+
+def product_listing_queryset(queryset=None):
+    """Products with everything the listing serializers read attached up front
+
+    The primary image and the active variants are prefetched (Product.primary_image
+    and Product.active_variants use them), the category and the rating summary are
+    joined, so a listing runs the same number of queries whatever its size.
+    """
+    if queryset is None:
+        queryset = Product.active_objects.all()
+    return queryset.select_related('sub_category__category', 'rating_summary').prefetch_related(
+        primary_image_prefetch(),
+        Prefetch('variants', queryset=ProductVariant.objects.filter(status='active'),
+                 to_attr='prefetched_active_variants'),
+    )
+
+
+def filter_products(queryset, product_id=None, category_id=None, sub_category_id=None, is_featured=None,
+                    is_best_seller=None, is_popular=None, min_price=None, max_price=None, brand_id=None):
+    """Apply the product listing query params (GetProductView, product search) to ``queryset``"""
+    if product_id:
+        queryset = queryset.filter(id=product_id)
+    if category_id:
+        queryset = queryset.filter(sub_category__category=category_id)
+    if sub_category_id:
+        queryset = queryset.filter(sub_category=sub_category_id)
+    if is_featured:
+        queryset = queryset.filter(is_featured=True)
+    if is_best_seller:
+        queryset = queryset.filter(is_best_seller=True)
+    if is_popular:
+        queryset = queryset.filter(is_popular=True)
+    if min_price:
+        queryset = queryset.filter(price__gte=min_price)
+    if max_price:
+        queryset = queryset.filter(price__lte=max_price)
+    if brand_id:
+        queryset = queryset.filter(brand_id=brand_id)
+    return queryset
+
+
+def product_listing_cache_tags(products, category_id=None, sub_category_id=None, brand_id=None):
+    """Cache tags for a cached product listing
+
+    Every product rendered in the payload is tagged, plus the scope the listing was
+    filtered on so that a newly created/moved product invalidates it as well.
+    ``products`` must be already evaluated with ``sub_category`` selected.
+    """
+    tags = {'products'}
+    for product in products:
+        tags.update([
+            f'product:{product.pk}',
+            f'sub_category:{product.sub_category_id}',
+            f'category:{product.sub_category.category_id}',
+        ])
+
+    if category_id:
+        tags.add(f'products:category:{category_id}')
+    if sub_category_id:
+        tags.add(f'products:sub_category:{sub_category_id}')
+    if brand_id:
+        tags.add(f'products:brand:{brand_id}')
+    if not (category_id or sub_category_id or brand_id):
+        tags.add('products:all')
+    return tags
@@ -0,0 +1,223 @@
+"""
+Asynchronous product image ingestion.
+
+The upload request only stores the file as it was sent (``upload_image_source``) and
+creates a ProductImage in the ``pending`` state, the ``process_product_image`` task
+then generates and uploads the size variants and marks the image ``ready`` (or
+``failed`` once its retries are exhausted). Clients poll the image status until it is
+ready.
+
+Uploads are deduplicated by the sha256 of the file: an ImageContent indexes every
+distinct upload, the images of the same content share its source and variants (the
+first one to be processed generates them, the others copy its fields) and the stored
+files are deleted with the last image referencing them.
+"""
+import hashlib
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from oumraa.space_manager import DigitalOceanSpacesManager
+from product.models import ImageContent, ProductImage, ReviewMedia
+from product.storage_gc import queue_storage_deletion
+from utils.cache import invalidate_cache_tags
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FIELDS = [f'{size}_{kind}' for size in ('thumbnail', 'medium', 'large', 'original') for kind in ('url', 'key')]
+PROCESSED_FIELDS = [*VARIANT_FIELDS, 'format_variants', 'original_width', 'original_height']
+
+
+class ImageProcessingError(Exception):
+    pass
+
+
+def content_hash(image_file):
+    digest = hashlib.sha256()
+    image_file.seek(0)
+    for chunk in iter(lambda: image_file.read(1024 * 1024), b''):
+        digest.update(chunk)
+    image_file.seek(0)
+    return digest.hexdigest()
+
+
+def upload_image_source(image_file, manager=None):
+    """Store the uploaded file, to be called outside of any transaction (it is a network upload)
+
+    A file already uploaded once is not stored again, the source of its ImageContent is
+    returned instead.
+    """
+    source = {
+        'content_hash': content_hash(image_file),
+        'original_filename': image_file.name,
+        'file_size_bytes': image_file.size,
+    }
+    content = ImageContent.all_objects.filter(content_hash=source['content_hash']).first()
+    if content:
+        return {**source, 'success': True, 'file_id': content.file_id, 'source_key': content.source_key,
+                'created': False}
+
+    manager = manager or DigitalOceanSpacesManager()
+    result = manager.upload_source(image_file)
+    if not result['success']:
+        raise ImageProcessingError(result['error'])
+    try:
+        ImageContent.all_objects.create(content_hash=source['content_hash'], file_id=result['file_id'],
+                                        source_key=result['source_key'])
+    except IntegrityError:
+        # the same file was uploaded concurrently, keep the other copy
+        queue_storage_deletion([result['source_key']])
+        content = ImageContent.all_objects.get(content_hash=source['content_hash'])
+        return {**source, 'success': True, 'file_id': content.file_id, 'source_key': content.source_key,
+                'created': False}
+    return {**source, **result, 'created': True}
+
+
+def discard_image_sources(sources):
+    """Undo ``upload_image_source`` when no image could be created from the sources"""
+    keys = [
+        source['source_key'] for source in sources
+        if source['created'] and ImageContent.all_objects.filter(
+            content_hash=source['content_hash'], reference_count=0
+        ).delete()[0]
+    ]
+    queue_storage_deletion(keys)
+
+
+def create_pending_image(product, source, alt_text='', is_primary=False, sort_order=0):
+    """ProductImage of an uploaded ``source``, its variants are generated once the transaction commits
+
+    The image is ready right away when an image of the same content already is.
+    """
+    ImageContent.all_objects.filter(content_hash=source['content_hash']).update(
+        reference_count=F('reference_count') + 1
+    )
+    image = ProductImage(
+        product=product, file_id=source['file_id'], source_key=source['source_key'],
+        content_hash=source['content_hash'], original_filename=source['original_filename'],
+        file_size_bytes=source['file_size_bytes'], alt_text=alt_text, sort_order=sort_order,
+        processing_status='pending',
+    )
+    processed = _processed_duplicate(image)
+    if processed:
+        for field in PROCESSED_FIELDS:
+            setattr(image, field, getattr(processed, field))
+        image.processing_status = 'ready'
+    image.save()
+    # inserted as a secondary image, a product has a single primary one
+    if is_primary:
+        image.make_primary()
+    if not processed:
+        transaction.on_commit(lambda: enqueue_image_processing(image))
+    return image
+
+
+def _processed_duplicate(image):
+    return ProductImage.all_objects.filter(
+        content_hash=image.content_hash, processing_status='ready'
+    ).exclude(content_hash='').exclude(pk=image.pk).first()
+
+
+def enqueue_image_processing(image):
+    from product.tasks import process_product_image
+    process_product_image.delay(str(image.pk))
+
+
+def process_image(image_id):
+    """Generate the size variants of a pending image, raises ImageProcessingError on failure"""
+    image = ProductImage.all_objects.select_related('product__sub_category').get(pk=image_id)
+    if image.is_ready:
+        return image
+
+    processed = _processed_duplicate(image)
+    if processed:
+        return _mark_ready(image, {field: getattr(processed, field) for field in PROCESSED_FIELDS})
+
+    ProductImage.all_objects.filter(pk=image.pk).update(processing_status='processing')
+    manager = DigitalOceanSpacesManager()
+    try:
+        source = manager.download(image.source_key, name=image.original_filename)
+    except Exception as e:
+        raise ImageProcessingError(f'Could not download {image.source_key}: {e}')
+
+    if not image.content_hash:
+        # a direct upload, only hashed now that its file is downloaded
+        _attach_content(image, content_hash(source))
+        processed = _processed_duplicate(image)
+        if processed:
+            return _mark_ready(image, {field: getattr(processed, field) for field in PROCESSED_FIELDS})
+
+    result = manager.process_and_upload_image(source, file_id=image.file_id)
+    if not result['success']:
+        raise ImageProcessingError(result['error'])
+
+    fields = {field: result['results'][field] for field in VARIANT_FIELDS}
+    fields['format_variants'] = result['results']['formats']
+    fields['original_width'], fields['original_height'] = result['original_size']
+    return _mark_ready(image, fields)
+
+
+def _attach_content(image, digest):
+    """Index the source of ``image`` under its hash, or switch it to the copy already indexed"""
+    staged_key = image.source_key
+    with transaction.atomic():
+        content, created = ImageContent.all_objects.get_or_create(
+            content_hash=digest, defaults={'file_id': image.file_id, 'source_key': image.source_key}
+        )
+        ImageContent.all_objects.filter(pk=content.pk).update(reference_count=F('reference_count') + 1)
+        image.content_hash, image.file_id, image.source_key = digest, content.file_id, content.source_key
+        image.save(update_fields=['content_hash', 'file_id', 'source_key', 'updated_on'])
+        if not created:
+            queue_storage_deletion([staged_key])
+
+
+def _mark_ready(image, fields):
+    for field, value in fields.items():
+        setattr(image, field, value)
+    image.processing_status = 'ready'
+    image.processing_error = None
+    image.save(update_fields=[*fields, 'processing_status', 'processing_error', 'updated_on'])
+    invalidate_cache_tags(*image.product.cache_tags, source='product_image')
+    return image
+
+
+def mark_image_failed(image_id, error):
+    logger.error('Processing of product image %s failed: %s', image_id, error)
+    ProductImage.all_objects.filter(pk=image_id).update(processing_status='failed', processing_error=str(error))
+
+
+def retry_image_processing(image):
+    """Queue a failed image again"""
+    ProductImage.all_objects.filter(pk=image.pk).update(processing_status='pending', processing_error=None)
+    image.processing_status, image.processing_error = 'pending', None
+    enqueue_image_processing(image)
+
+
+def process_review_media(media_id):
+    """Generate the display sizes of a directly uploaded review image"""
+    media = ReviewMedia.objects.get(pk=media_id)
+    if media.processing_status == 'ready':
+        return media
+
+    manager = DigitalOceanSpacesManager()
+    try:
+        source = manager.download(media.file_key)
+    except Exception as e:
+        raise ImageProcessingError(f'Could not download {media.file_key}: {e}')
+
+    result = manager.process_and_upload_image(source, folder='reviews', formats=[])
+    if not result['success']:
+        raise ImageProcessingError(result['error'])
+
+    media.file_url = result['results']['large_url']
+    media.thumbnail_url = result['results']['thumbnail_url']
+    media.variant_keys = [result['results'][f'{size}_key'] for size in ('thumbnail', 'medium', 'large', 'original')]
+    media.processing_status = 'ready'
+    media.save(update_fields=['file_url', 'thumbnail_url', 'variant_keys', 'processing_status'])
+    return media
+
+
+def mark_review_media_failed(media_id, error):
+    logger.error('Processing of review media %s failed: %s', media_id, error)
+    ReviewMedia.objects.filter(pk=media_id).update(processing_status='failed')
@@ -0,0 +1,168 @@
+"""
+Stock reservations.
+
+``reserve_stock`` takes the ordered quantities off ``stock_quantity`` with conditional
+updates (``UPDATE ... SET stock_quantity = stock_quantity - n WHERE stock_quantity >= n``),
+so two checkouts can never sell the same unit. The lines are updated in a fixed order
+(product, then variant) so concurrent multi-line reservations lock their rows in the
+same order and cannot deadlock.
+
+Every change of stock is recorded in the StockMovement ledger with the stock before and
+after it. Reservations that are neither committed nor released before they expire are
+put back by the ``release_expired_stock_reservations`` task, except the ones of pending
+orders: those are released by cancelling the order (web.checkout.expire_unpaid_orders).
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from oumraa import settings
+from product.models import Order, Product, ProductVariant, StockMovement, StockReservation
+from utils.cache import invalidate_cache_tags
+
+
+class InsufficientStock(Exception):
+
+    def __init__(self, product_id, variant_id, requested, available):
+        self.product_id = product_id
+        self.variant_id = variant_id
+        self.requested = requested
+        self.available = available
+        super().__init__(f'Only {available} items available in stock')
+
+
+def _stock_queryset(product_id, variant_id):
+    if variant_id:
+        return ProductVariant.all_objects.filter(pk=variant_id, product_id=product_id)
+    return Product.all_objects.filter(pk=product_id)
+
+
+def _lock_order(key):
+    product_id, variant_id = key
+    return str(product_id), str(variant_id or '')
+
+
+def _invalidate_products(product_ids):
+    # only the product pages, a reservation must not flush every cached listing
+    invalidate_cache_tags(*(f'product:{product_id}' for product_id in product_ids), source='inventory')
+
+
+def _change_stock(product_id, variant_id, delta, guard=True):
+    """Apply ``delta`` to the stock and return ``(previous_stock, new_stock)``
+
+    With ``guard`` a negative delta only applies when enough stock is left, ``None`` is
+    returned otherwise. Must run in a transaction: the updated row stays locked until
+    it ends, so reading it back returns the stock this update produced.
+    """
+    queryset = _stock_queryset(product_id, variant_id)
+    target = queryset.filter(stock_quantity__gte=-delta) if guard and delta < 0 else queryset
+    if not target.update(stock_quantity=F('stock_quantity') + delta):
+        return None
+    new_stock = queryset.values_list('stock_quantity', flat=True).get()
+    return new_stock - delta, new_stock
+
+
+def reserve_stock(lines, reference_id, user=None, timeout=None):
+    """Reserve ``lines``, an iterable of ``(product_id, variant_id, quantity)``, for ``reference_id``
+
+    All or nothing: raises InsufficientStock and reserves nothing when a line cannot be
+    served. Products that do not track inventory are not reserved, products allowing
+    backorders are reserved even past zero.
+    """
+    to_pk = Product._meta.pk.to_python
+    quantities = defaultdict(int)
+    for product_id, variant_id, quantity in lines:
+        quantities[(to_pk(product_id), to_pk(variant_id) if variant_id else None)] += quantity
+
+    products = Product.all_objects.in_bulk({product_id for product_id, _ in quantities})
+    timeout = timeout or getattr(settings, 'STOCK_RESERVATION_TIMEOUT', 15 * 60)
+    expires_at = timezone.now() + timedelta(seconds=timeout)
+
+    reservations, movements = [], []
+    with transaction.atomic():
+        for key in sorted(quantities, key=_lock_order):
+            (product_id, variant_id), quantity = key, quantities[key]
+            product = products.get(product_id)
+            if product is None:
+                raise Product.DoesNotExist(f'Product {product_id} does not exist')
+            if not product.track_inventory:
+                continue
+
+            stock = _change_stock(product_id, variant_id, -quantity, guard=not product.allow_backorder)
+            if stock is None:
+                available = _stock_queryset(product_id, variant_id).values_list('stock_quantity', flat=True).first()
+                raise InsufficientStock(product_id, variant_id, quantity, available or 0)
+
+            reservations.append(StockReservation(
+                product_id=product_id, product_variant_id=variant_id, quantity=quantity,
+                reference_id=reference_id, expires_at=expires_at, user=user,
+            ))
+            movements.append(StockMovement(
+                product_id=product_id, product_variant_id=variant_id, movement_type='reservation',
+                quantity=-quantity, previous_stock=stock[0], new_stock=stock[1], reference_id=reference_id,
+                created_by=user,
+            ))
+
+        StockReservation.objects.bulk_create(reservations)
+        StockMovement.objects.bulk_create(movements)
+        transaction.on_commit(lambda: _invalidate_products({r.product_id for r in reservations}))
+    return reservations
+
+
+def commit_reservations(reference_id):
+    """Close the open reservations of ``reference_id``, their stock is sold"""
+    return StockReservation.objects.filter(reference_id=reference_id, reservation_status='reserved').update(
+        reservation_status='committed'
+    )
+
+
+def release_reservations(reservations, notes=None):
+    """Put the stock of the still open ``reservations`` (a queryset) back, returns how many were released
+
+    Rows locked by a concurrent release are skipped, that release puts them back.
+    """
+    movements, product_ids = [], set()
+    with transaction.atomic():
+        open_reservations = list(
+            reservations.filter(reservation_status='reserved')
+            .select_for_update(skip_locked=True)
+            .order_by('product_id', 'product_variant_id')
+        )
+        for reservation in open_reservations:
+            previous_stock, new_stock = _change_stock(
+                reservation.product_id, reservation.product_variant_id, reservation.quantity
+            )
+            movements.append(StockMovement(
+                product_id=reservation.product_id, product_variant_id=reservation.product_variant_id,
+                movement_type='release', quantity=reservation.quantity, previous_stock=previous_stock,
+                new_stock=new_stock, reference_id=reservation.reference_id, notes=notes,
+            ))
+            product_ids.add(reservation.product_id)
+
+        StockReservation.objects.filter(pk__in=[r.pk for r in open_reservations]).update(
+            reservation_status='released'
+        )
+        StockMovement.objects.bulk_create(movements)
+        transaction.on_commit(lambda: _invalidate_products(product_ids))
+    return len(open_reservations)
+
+
+def release_reference(reference_id, notes=None):
+    return release_reservations(StockReservation.objects.filter(reference_id=reference_id), notes)
+
+
+def release_expired_reservations(batch_size=500):
+    expired = StockReservation.objects.filter(reservation_status='reserved', expires_at__lte=timezone.now()).exclude(
+        # a pending order gives back its stock when it's cancelled, not before
+        reference_id__in=Order.all_objects.filter(order_status='pending').values('order_number')
+    )
+    released = 0
+    while True:
+        batch = expired.order_by('expires_at').values_list('pk', flat=True)[:batch_size]
+        count = release_reservations(StockReservation.objects.filter(pk__in=list(batch)), notes='Reservation expired')
+        released += count
+        if count < batch_size:
+            return released
@@ -0,0 +1,65 @@
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageDraw
+
+from oumraa.space_manager import DigitalOceanSpacesManager, LocalStorageClient
+from utils.profiling import percentile
+
+
+def sample_image(width, height):
+    """A JPEG photo stand-in, gradients and shapes so it compresses like a real picture"""
+    img = Image.merge('RGB', [
+        Image.linear_gradient('L').resize((width, height)),
+        Image.radial_gradient('L').resize((width, height)),
+        Image.linear_gradient('L').rotate(90).resize((width, height)),
+    ])
+    draw = ImageDraw.Draw(img)
+    for i in range(0, width, max(width // 40, 1)):
+        draw.ellipse((i, i % height, i + width // 10, i % height + height // 10), outline=(i % 255, 80, 160), width=5)
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=92)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Measure the variant generation of an uploaded image against a throwaway local storage directory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', default='4000x3000', help='Source image size (default: 4000x3000)')
+        parser.add_argument('--workers', default='1,8', help='Comma separated thread pool sizes (default: 1,8)')
+        parser.add_argument('--iterations', type=int, default=20, help='Images per pool size (default: 20)')
+
+    def handle(self, *args, **options):
+        try:
+            width, height = (int(value) for value in options['size'].lower().split('x'))
+            pool_sizes = [int(workers) for workers in options['workers'].split(',')]
+        except ValueError:
+            raise CommandError('--size must look like 4000x3000 and --workers be a comma separated list of numbers')
+
+        source = sample_image(width, height)
+        self.stdout.write(f'{len(source) / 1024:.0f} KB {width}x{height} JPEG source')
+        self.stdout.write(f'{"workers":>8} {"runs":>6} {"p50 ms":>8} {"p95 ms":>8} {"max ms":>8}')
+        with tempfile.TemporaryDirectory() as root:
+            client = LocalStorageClient(root, 'http://localhost/spaces')
+            for workers in pool_sizes:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    manager = DigitalOceanSpacesManager(client=client, executor=executor)
+                    timings = self.benchmark(manager, source, options['iterations'])
+                self.stdout.write(f'{workers:>8} {len(timings):>6} {percentile(timings, 50):>8.2f} '
+                                  f'{percentile(timings, 95):>8.2f} {max(timings):>8.2f}')
+
+    def benchmark(self, manager, source, iterations):
+        timings = []
+        for _ in range(iterations):
+            image_file = BytesIO(source)
+            image_file.name = 'benchmark.jpg'
+            start = time.perf_counter()
+            result = manager.process_and_upload_image(image_file, folder='benchmark')
+            timings.append((time.perf_counter() - start) * 1000)
+            if not result['success']:
+                raise CommandError(result['error'])
+        return timings
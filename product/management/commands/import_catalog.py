@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from product.bulk_import import detect_format, import_catalog
+
+
+class Command(BaseCommand):
+    help = 'Import products, variants and images from a CSV or JSONL file (see product.bulk_import)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='File format (default: from the extension)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows written per transaction (default: 500)')
+        parser.add_argument('--dry-run', action='store_true', help='Validate everything, write nothing')
+        parser.add_argument('--max-errors', type=int, default=50, help='Errors to print (default: 50)')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or detect_format(options['path'])
+        if file_format is None:
+            raise CommandError('Cannot tell the file format from the extension, use --format')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        try:
+            with open(options['path'], 'rb') as file:
+                report = import_catalog(file, file_format, chunk_size=options['chunk_size'],
+                                        dry_run=options['dry_run'])
+        except OSError as e:
+            raise CommandError(str(e))
+
+        prefix = 'Dry run: ' if report.dry_run else ''
+        self.stdout.write(f'{prefix}{report.rows} rows')
+        for row_type, created in report.created.items():
+            self.stdout.write(f'  {row_type}: {created} created, {report.updated[row_type]} updated')
+
+        for line, sku, message in report.errors[:options['max_errors']]:
+            self.stderr.write(f'  line {line} {sku}: {message}')
+        if len(report.errors) > options['max_errors']:
+            self.stderr.write(f'  ... {len(report.errors) - options["max_errors"]} more errors')
+
+        style = self.style.SUCCESS if report.ok else self.style.WARNING
+        self.stdout.write(style(f'{prefix}{len(report.errors)} rows skipped'))
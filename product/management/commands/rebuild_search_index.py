@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from product.search import rebuild_product_search_index
+from web.search import rebuild_blog_search_index
+
+SEARCH_INDEXES = {
+    'product': rebuild_product_search_index,
+    'blog': rebuild_blog_search_index,
+}
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full text search indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('indexes', nargs='*', help=f'Indexes to rebuild ({", ".join(SEARCH_INDEXES)}), all by default')
+
+    def handle(self, *args, **options):
+        names = options['indexes'] or list(SEARCH_INDEXES)
+        unknown = set(names) - set(SEARCH_INDEXES)
+        if unknown:
+            raise CommandError(f'Unknown search index: {", ".join(sorted(unknown))}')
+
+        for name in names:
+            SEARCH_INDEXES[name]()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt the {name} search index'))
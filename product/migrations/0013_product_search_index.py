@@ -0,0 +1,40 @@
+from django.db import migrations
+
+from utils.search import SearchIndex
+
+PRODUCT_SEARCH_FIELDS = [
+    ('name', 'A'),
+    ('sku', 'A'),
+    ('brand', 'B'),
+    ('sub_category', 'C'),
+    ('short_description', 'D'),
+]
+
+
+def create_product_search_index(apps, schema_editor):
+    index = SearchIndex('product_search', apps.get_model('product', 'Product'), PRODUCT_SEARCH_FIELDS)
+    index.create()
+
+    products = apps.get_model('product', 'Product').objects.select_related('brand', 'sub_category')
+    index.update_many((product.pk, {
+        'name': product.name,
+        'sku': product.sku,
+        'brand': product.brand.name if product.brand_id else '',
+        'sub_category': product.sub_category.name,
+        'short_description': product.short_description,
+    }) for product in products.iterator(chunk_size=1000))
+
+
+def drop_product_search_index(apps, schema_editor):
+    SearchIndex('product_search', apps.get_model('product', 'Product'), PRODUCT_SEARCH_FIELDS).drop()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0012_product_rating_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_product_search_index, drop_product_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-16 22:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0014_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='return',
+            name='return_number',
+            field=models.CharField(blank=True, max_length=50, unique=True),
+        ),
+    ]
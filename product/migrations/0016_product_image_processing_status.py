@@ -0,0 +1,68 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0015_return_number_blank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='processing_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='source_key',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='large_key',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='large_url',
+            field=models.URLField(blank=True, max_length=1000),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='medium_key',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='medium_url',
+            field=models.URLField(blank=True, max_length=1000),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='original_key',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='original_url',
+            field=models.URLField(blank=True, max_length=1000),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='thumbnail_key',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='thumbnail_url',
+            field=models.URLField(blank=True, max_length=1000),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0016_product_image_processing_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='format_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:13
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0017_product_image_format_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageContent',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('inactive', 'Inactive'), ('deleted', 'Deleted'), ('draft', 'Draft'), ('pending', 'Pending')], db_index=True, default='active', help_text='Status of the record', max_length=10)),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('file_id', models.CharField(max_length=100)),
+                ('source_key', models.CharField(max_length=500)),
+                ('reference_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'image_contents',
+            },
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
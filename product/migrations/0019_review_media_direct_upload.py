@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0018_image_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reviewmedia',
+            name='file_key',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='reviewmedia',
+            name='file_url',
+            field=models.URLField(blank=True, max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='reviewmedia',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='reviewmedia',
+            name='thumbnail_url',
+            field=models.URLField(blank=True, max_length=1000),
+        ),
+        migrations.AlterField(
+            model_name='reviewmedia',
+            name='file',
+            field=models.FileField(blank=True, upload_to='reviews/media/'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:31
+
+from django.db import migrations, models
+
+
+def keep_one_primary_image(apps, schema_editor):
+    """Products with several primary images keep the first one (by sort order)"""
+    ProductImage = apps.get_model('product', 'ProductImage')
+    duplicated = ProductImage.objects.filter(is_primary=True).values('product').annotate(
+        primaries=models.Count('id')).filter(primaries__gt=1).values_list('product', flat=True)
+    for product_id in duplicated:
+        primaries = ProductImage.objects.filter(product_id=product_id, is_primary=True).order_by('sort_order',
+                                                                                                  'created_at')
+        ProductImage.objects.filter(pk__in=list(primaries.values_list('pk', flat=True)[1:])).update(is_primary=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0020_storage_deletion'),
+    ]
+
+    operations = [
+        migrations.RunPython(keep_one_primary_image, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productimage',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_primary', True)), fields=('product',), name='unique_primary_image_per_product'),
+        ),
+    ]
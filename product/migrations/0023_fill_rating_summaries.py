@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:51
+
+from django.db import migrations
+
+
+def fill_rating_summaries(apps, schema_editor):
+    """The summaries of the reviews written before 0012, the F() deltas of new reviews start from them"""
+    from product.ratings import rebuild_rating_summaries
+    rebuild_rating_summaries(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0022_bulk_product_update'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_rating_summaries, migrations.RunPython.noop),
+    ]
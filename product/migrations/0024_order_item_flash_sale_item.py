@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0023_fill_rating_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='flash_sale_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_items', to='product.flashsaleitem'),
+        ),
+    ]
@@ -1,11 +1,14 @@
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q, Case, When, Value, Subquery
+from django.db.models.functions import Cast
+from django.utils import timezone
 
 from account.models import User
-from oumraa.space_manager import DigitalOceanSpacesManager
 from product.choicees import *
+from utils.cache import invalidate_cache_tags
 from utils.models import ModelMixin, TaxRate
-from django.core.cache import cache
+from utils.sequences import DailySequence
 
 
 # Create your models here.
@@ -25,13 +28,19 @@ class Category(ModelMixin):
             models.Index(fields=['parent'])
         ]
 
+    @property
+    def cache_tags(self):
+        """Tags of the cached payloads that render this category"""
+        return ['categories', f'category:{self.pk}']
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        cache.clear()
+        invalidate_cache_tags(*self.cache_tags, source='category')
 
     def delete(self, *args, **kwargs):
+        tags = self.cache_tags
         super().delete(*args, **kwargs)
-        cache.clear()
+        invalidate_cache_tags(*tags, source='category')
 
 
 class SubCategory(ModelMixin):
@@ -48,13 +57,25 @@ class SubCategory(ModelMixin):
             models.Index(fields=['category'])
         ]
 
+    @property
+    def cache_tags(self):
+        """Tags of the cached payloads that render this sub category"""
+        return [f'sub_category:{self.pk}', f'category:{self.category_id}']
+
     def save(self, *args, **kwargs):
+        # the products index the name only, the other edits don't touch the search index
+        renamed = not self._state.adding and SubCategory.all_objects.filter(pk=self.pk).exclude(name=self.name).exists()
         super().save(*args, **kwargs)
-        cache.clear()
+        invalidate_cache_tags(*self.cache_tags, source='sub_category')
+
+        if renamed:
+            from product.search import update_product_search_index
+            update_product_search_index(self.products.all())
 
     def delete(self, *args, **kwargs):
+        tags = self.cache_tags
         super().delete(*args, **kwargs)
-        cache.clear()
+        invalidate_cache_tags(*tags, source='sub_category')
 
 
 class Brand(ModelMixin):
@@ -68,13 +89,25 @@ class Brand(ModelMixin):
             models.Index(fields=['name'])
         ]
 
+    @property
+    def cache_tags(self):
+        """Tags of the cached payloads that render this brand"""
+        return ['brands', f'brand:{self.pk}']
+
     def save(self, *args, **kwargs):
+        # the products index the name only, the other edits don't touch the search index
+        renamed = not self._state.adding and Brand.all_objects.filter(pk=self.pk).exclude(name=self.name).exists()
         super().save(*args, **kwargs)
-        cache.clear()
+        invalidate_cache_tags(*self.cache_tags, source='brand')
+
+        if renamed:
+            from product.search import update_product_search_index
+            update_product_search_index(self.products.all())
 
     def delete(self, *args, **kwargs):
+        tags = self.cache_tags
         super().delete(*args, **kwargs)
-        cache.clear()
+        invalidate_cache_tags(*tags, source='brand')
 
 
 class Product(ModelMixin):
@@ -101,6 +134,8 @@ class Product(ModelMixin):
     is_popular = models.BooleanField(default=False)
     is_best_seller = models.BooleanField(default=False)
 
+    SEARCH_FIELDS = {'name', 'sku', 'brand', 'brand_id', 'sub_category', 'sub_category_id', 'short_description'}
+
     class Meta:
         db_table = 'products'
         indexes = [
@@ -109,26 +144,67 @@ class Product(ModelMixin):
             models.Index(fields=['brand']),
             models.Index(fields=['is_featured']),
             models.Index(fields=['price']),
+            # keyset pagination orders on (field, id)
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['created_at', 'id']),
         ]
 
+    @property
+    def cache_tags(self):
+        """Tags of the cached payloads that contain this product or could start to contain it"""
+        tags = [
+            f'product:{self.pk}', 'products:all',
+            f'products:sub_category:{self.sub_category_id}',
+            f'products:category:{self.sub_category.category_id}',
+        ]
+        if self.brand_id:
+            tags.append(f'products:brand:{self.brand_id}')
+        return tags
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        cache.clear()
+        invalidate_cache_tags(*self.cache_tags, source='product')
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(update_fields) & self.SEARCH_FIELDS:
+            from product.search import update_product_search_index
+            update_product_search_index([self])
 
     def delete(self, *args, **kwargs):
-        super().delete(*args, **kwargs)
-        cache.clear()
+        from product.search import product_search_index
+
+        pk, tags = self.pk, self.cache_tags
+        result = super().delete(*args, **kwargs)
+        invalidate_cache_tags(*tags, source='product')
+        product_search_index.remove(pk)
+        return result
 
     @property
     def primary_image(self):
         """Get primary product image"""
+        if hasattr(self, 'prefetched_primary_images'):
+            return self.prefetched_primary_images[0] if self.prefetched_primary_images else None
         return self.images.filter(is_primary=True).first()
 
+    @property
+    def active_variants(self):
+        """Active variants, from product_listing_queryset's prefetch when available"""
+        if hasattr(self, 'prefetched_active_variants'):
+            return self.prefetched_active_variants
+        return list(self.variants.filter(status='active'))
+
     @property
     def primary_image_url(self):
         """Get primary image URL (medium size)"""
         primary = self.primary_image
-        return primary.medium_url if primary else '/static/public/images/no-image.png'
+        # an image still being processed has no variants yet
+        return primary.medium_url if primary and primary.medium_url else '/static/public/images/no-image.png'
+
+    @property
+    def primary_image_sources(self):
+        """Medium size primary image URL per format (avif, webp, jpeg), for product cards"""
+        primary = self.primary_image
+        return primary.get_format_urls('medium') if primary and primary.medium_url else None
 
     @property
     def category_name(self):
@@ -153,16 +229,59 @@ class Product(ModelMixin):
         return [getattr(img, size_attr) for img in self.images.all()]
 
 
+SRCSET_WIDTHS = [('thumbnail', 300), ('medium', 600), ('large', 1200)]
+
+
+class ImageContent(ModelMixin):
+    """An uploaded image file, shared by every ProductImage with the same content
+
+    The images of a content share its file_id, so its stored source and variants too;
+    they are deleted with the last image referencing it.
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    file_id = models.CharField(max_length=100)
+    source_key = models.CharField(max_length=500)
+    reference_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'image_contents'
+
+    def __str__(self):
+        return f"{self.content_hash} ({self.reference_count} references)"
+
+
+class StorageDeletion(ModelMixin):
+    """A stored object waiting to be deleted from the bucket, see product.storage_gc"""
+    key = models.CharField(max_length=500)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'storage_deletions'
+
+    def __str__(self):
+        return self.key
+
+
 class ProductImage(ModelMixin):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    thumbnail_url = models.URLField(max_length=1000)
-    medium_url = models.URLField(max_length=1000)
-    large_url = models.URLField(max_length=1000)
-    original_url = models.URLField(max_length=1000)
-    thumbnail_key = models.CharField(max_length=500)
-    medium_key = models.CharField(max_length=500)
-    large_key = models.CharField(max_length=500)
-    original_key = models.CharField(max_length=500)
+    # the size variants are filled in by the process_product_image task
+    thumbnail_url = models.URLField(max_length=1000, blank=True)
+    medium_url = models.URLField(max_length=1000, blank=True)
+    large_url = models.URLField(max_length=1000, blank=True)
+    original_url = models.URLField(max_length=1000, blank=True)
+    thumbnail_key = models.CharField(max_length=500, blank=True)
+    medium_key = models.CharField(max_length=500, blank=True)
+    large_key = models.CharField(max_length=500, blank=True)
+    original_key = models.CharField(max_length=500, blank=True)
+    source_key = models.CharField(max_length=500, blank=True)
+    processing_status = models.CharField(max_length=20, choices=IMAGE_PROCESSING_STATUS, default='ready')
+    processing_error = models.TextField(null=True, blank=True)
+    # the webp/avif copies of the srcset sizes, {'webp': {'medium': {'key': ..., 'url': ...}, ...}, ...}
+    format_variants = models.JSONField(default=dict, blank=True)
+    # sha256 of the uploaded file, see ImageContent
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
     file_id = models.CharField(max_length=100, db_index=True)
     original_filename = models.CharField(max_length=255)
     alt_text = models.CharField(max_length=255, blank=True)
@@ -179,6 +298,10 @@ class ProductImage(ModelMixin):
             models.Index(fields=['product', 'sort_order']),
             models.Index(fields=['file_id'])
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['product'], condition=Q(is_primary=True),
+                                    name='unique_primary_image_per_product'),
+        ]
 
     def __str__(self):
         return f"Image for {self.product.name} ({'Primary' if self.is_primary else 'Secondary'})"
@@ -193,9 +316,29 @@ class ProductImage(ModelMixin):
         """Generate srcset for responsive images"""
         return f"{self.thumbnail_url} 300w, {self.medium_url} 600w, {self.large_url} 1200w"
 
+    @property
+    def format_srcsets(self):
+        """srcset of every stored format, smallest first, for <picture> sources"""
+        srcsets = {}
+        for image_format in ('avif', 'webp'):
+            variants = self.format_variants.get(image_format)
+            if variants:
+                srcsets[image_format] = ', '.join(
+                    f"{variants[size]['url']} {width}w" for size, width in SRCSET_WIDTHS if size in variants
+                )
+        srcsets['jpeg'] = self.responsive_srcset
+        return srcsets
+
+    def get_format_urls(self, size):
+        """URL of ``size`` in every stored format, smallest first"""
+        urls = {image_format: self.format_variants[image_format][size]['url'] for image_format in ('avif', 'webp')
+                if size in self.format_variants.get(image_format, {})}
+        urls['jpeg'] = getattr(self, f'{size}_url')
+        return urls
+
     def get_size_variants(self):
         """Get all size variants as dictionary"""
-        return {
+        variants = {
             'thumbnail': {
                 'url': self.thumbnail_url,
                 'width': 300,
@@ -221,41 +364,75 @@ class ProductImage(ModelMixin):
                 'use': 'Full resolution, download'
             }
         }
+        for size in ('thumbnail', 'medium', 'large'):
+            variants[size]['formats'] = self.get_format_urls(size)
+        return variants
 
-    def delete(self, *args, **kwargs):
-        """Override delete to clean up DO Spaces storage"""
-        keys_to_delete = [
+    @property
+    def is_ready(self):
+        return self.processing_status == 'ready'
+
+    @property
+    def storage_keys(self):
+        return [
             self.thumbnail_key,
             self.medium_key,
             self.large_key,
-            self.original_key
+            self.original_key,
+            self.source_key,
+            *(variant['key'] for variants in self.format_variants.values() for variant in variants.values()),
         ]
 
-        # Delete from Digital Ocean Spaces
-        do_manager = DigitalOceanSpacesManager()
-        do_manager.delete_image_variants(keys_to_delete)
-        super().delete(*args, **kwargs)
-
     def make_primary(self):
         """Make this image the primary image for the product"""
-        ProductImage.objects.filter(product=self.product).update(is_primary=False)
+        ProductImage.switch_primary(self.product_id, self.pk)
         self.is_primary = True
-        self.save(update_fields=['is_primary'])
 
     @classmethod
-    def reorder_images(cls, product, image_order_list):
-        """Reorder images for a product
+    def switch_primary(cls, product_id, image_id):
+        """Move the primary flag of the product to ``image_id``, returns False if it isn't an image of it"""
+        with transaction.atomic():
+            switched = cls._switch_primary(product_id, image_id)
+        invalidate_cache_tags(f'product:{product_id}', source='product_image')
+        return switched
+
+    @classmethod
+    def _switch_primary(cls, product_id, image_id):
+        # the product row lock serializes the switches, only one primary passes the unique constraint
+        list(Product.all_objects.select_for_update().filter(pk=product_id).values_list('pk'))
+        image = cls.all_objects.filter(product_id=product_id, pk=image_id)
+        if not image.exists():
+            return False
+        cls.all_objects.filter(product_id=product_id, is_primary=True).exclude(pk=image_id).update(is_primary=False)
+        image.update(is_primary=True)
+        return True
+
+    @classmethod
+    def promote_next_primary(cls, product_id):
+        """Make the first image of a product that lost its primary image the primary one, in one UPDATE"""
+        first = cls.objects.filter(product_id=product_id).order_by('sort_order', 'created_at').values('pk')[:1]
+        return bool(cls.all_objects.filter(pk=Subquery(first)).update(is_primary=True))
+
+    @classmethod
+    def reorder_images(cls, product, image_order_list, primary_image_id=None):
+        """Reorder images for a product in one UPDATE
         Args:
             product: Product instance
             image_order_list: List of {'id': image_id, 'sort_order': order}
+            primary_image_id: image to make primary in the same transaction
+        Returns the number of images reordered, the images of other products are ignored.
         """
-        for item in image_order_list:
-            try:
-                image = cls.objects.get(id=item['id'], product=product)
-                image.sort_order = item['sort_order']
-                image.save(update_fields=['sort_order'])
-            except cls.DoesNotExist:
-                continue
+        orders = {str(item['id']): int(item['sort_order']) for item in image_order_list}
+        with transaction.atomic():
+            reordered = cls.all_objects.filter(product=product, pk__in=list(orders)).update(
+                sort_order=Case(*(When(pk=pk, then=Value(order)) for pk, order in orders.items()),
+                                default=F('sort_order')),
+                updated_on=timezone.now(),
+            )
+            if primary_image_id and not cls._switch_primary(product.pk, primary_image_id):
+                raise cls.DoesNotExist(f'Image {primary_image_id} is not an image of product {product.pk}')
+        invalidate_cache_tags(f'product:{product.pk}', source='product_image')
+        return reordered
 
 
 class ProductAttribute(ModelMixin):
@@ -396,6 +573,13 @@ class Order(ModelMixin):
             models.Index(fields=['payment_status']),
         ]
 
+    @staticmethod
+    def generate_order_number():
+        return order_numbers.next()
+
+
+order_numbers = DailySequence('order', 'ORD', Order, 'order_number', width=6)
+
 
 class OrderItem(ModelMixin):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
@@ -406,6 +590,9 @@ class OrderItem(ModelMixin):
     quantity = models.IntegerField(validators=[MinValueValidator(1)])
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # the flash sale the line was bought in, its claimed quantity goes back when the order is cancelled
+    flash_sale_item = models.ForeignKey('FlashSaleItem', on_delete=models.SET_NULL, null=True, blank=True,
+                                        related_name='order_items')
 
     class Meta:
         db_table = 'order_items'
@@ -483,6 +670,122 @@ class Review(ModelMixin):
             models.Index(fields=['rating']),
         ]
 
+    @property
+    def counts_towards_rating(self):
+        """Whether this review is part of the product rating summary"""
+        return self.is_approved and self.status != 'deleted'
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                # locked, a concurrent edit of the review would apply its delta to the same previous rating
+                previous = Review.all_objects.select_for_update().filter(pk=self.pk).only(
+                    'product_id', 'rating', 'is_verified_purchase', 'is_approved', 'status'
+                ).first()
+            super().save(*args, **kwargs)
+
+            counted_before = previous is not None and previous.counts_towards_rating
+            if counted_before:
+                ProductRatingSummary.apply_review(previous, -1)
+            if self.counts_towards_rating:
+                ProductRatingSummary.apply_review(self, 1)
+
+        if counted_before or self.counts_towards_rating:
+            invalidate_cache_tags(f'product:{self.product_id}', source='review')
+
+    def delete(self, *args, **kwargs):
+        counted = self.counts_towards_rating
+        with transaction.atomic():
+            if counted:
+                ProductRatingSummary.apply_review(self, -1)
+            result = super().delete(*args, **kwargs)
+
+        if counted:
+            invalidate_cache_tags(f'product:{self.product_id}', source='review')
+        return result
+
+
+class ProductRatingSummary(models.Model):
+    """Read model of the approved reviews of a product
+
+    Kept current incrementally by Review.save()/delete(), rebuild it in bulk with
+    ``python manage.py rebuild_rating_summaries``.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='rating_summary')
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+    total_reviews = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    verified_count = models.PositiveIntegerField(default=0)
+    average_rating = models.FloatField(default=0)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'product_rating_summaries'
+
+    def __str__(self):
+        return f"{self.product_id}: {self.average_rating} ({self.total_reviews})"
+
+    @classmethod
+    def apply_review(cls, review, sign):
+        """Add (sign=1) or remove (sign=-1) one review with atomic F() updates"""
+        cls.objects.get_or_create(product_id=review.product_id)
+        summary = cls.objects.filter(product_id=review.product_id)
+        summary.update(**{
+            f'rating_{review.rating}_count': F(f'rating_{review.rating}_count') + sign,
+            'total_reviews': F('total_reviews') + sign,
+            'rating_sum': F('rating_sum') + sign * review.rating,
+            'verified_count': F('verified_count') + (sign if review.is_verified_purchase else 0),
+        })
+        # the average has to see the updated counters, hence the second statement
+        summary.update(average_rating=Case(
+            When(total_reviews=0, then=Value(0.0)),
+            default=Cast('rating_sum', models.FloatField()) / F('total_reviews'),
+            output_field=models.FloatField(),
+        ))
+
+    def to_dict(self):
+        """Payload of the ``rating_summary`` serializer fields"""
+        if not self.total_reviews:
+            return self.empty_dict()
+
+        return {
+            'average_rating': round(self.average_rating, 1),
+            'total_reviews': self.total_reviews,
+            'rating_distribution': self.rating_distribution,
+            'percentage_distribution': {
+                rating: round((count / self.total_reviews) * 100, 1)
+                for rating, count in self.rating_distribution.items()
+            },
+            'verified_purchases': self.verified_count,
+        }
+
+    @property
+    def rating_distribution(self):
+        return {str(i): getattr(self, f'rating_{i}_count') for i in range(1, 6)}
+
+    @staticmethod
+    def empty_dict():
+        return {
+            'average_rating': 0,
+            'total_reviews': 0,
+            'rating_distribution': {str(i): 0 for i in range(1, 6)},
+            'percentage_distribution': {str(i): 0 for i in range(1, 6)}
+        }
+
+    @classmethod
+    def for_product(cls, product):
+        """Rating summary payload of ``product``, select_related('rating_summary') to avoid a query"""
+        try:
+            return product.rating_summary.to_dict()
+        except cls.DoesNotExist:
+            return cls.empty_dict()
+
 
 class ReviewMedia(models.Model):
     REVIEW_MEDIA_TYPES = (
@@ -494,7 +797,13 @@ class ReviewMedia(models.Model):
         Review, on_delete=models.CASCADE, related_name='media'
     )
     media_type = models.CharField(max_length=10, choices=REVIEW_MEDIA_TYPES)
-    file = models.FileField(upload_to='reviews/media/')
+    file = models.FileField(upload_to='reviews/media/', blank=True)
+    # direct uploads are stored in the bucket instead of ``file``
+    file_key = models.CharField(max_length=500, blank=True)
+    file_url = models.URLField(max_length=1000, blank=True)
+    thumbnail_url = models.URLField(max_length=1000, blank=True)
+    variant_keys = models.JSONField(default=list, blank=True)
+    processing_status = models.CharField(max_length=20, choices=IMAGE_PROCESSING_STATUS, default='ready')
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -526,7 +835,7 @@ class ProductView(ModelMixin):
 class Return(ModelMixin):
     order_item = models.ForeignKey(OrderItem, on_delete=models.CASCADE, related_name='returns')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    return_number = models.CharField(max_length=50, unique=True)
+    return_number = models.CharField(max_length=50, unique=True, blank=True)
     reason = models.CharField(max_length=20, choices=RETURN_REASON)
     description = models.TextField()
     quantity = models.IntegerField(validators=[MinValueValidator(1)])
@@ -545,6 +854,15 @@ class Return(ModelMixin):
             models.Index(fields=['status']),
         ]
 
+    def save(self, *args, **kwargs):
+        if self.return_number:
+            super().save(*args, **kwargs)
+        else:
+            return_numbers.save_numbered(self, lambda: super(Return, self).save(*args, **kwargs))
+
+
+return_numbers = DailySequence('return', 'RET', Return, 'return_number')
+
 
 class StockMovement(ModelMixin):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
@@ -566,6 +884,60 @@ class StockMovement(ModelMixin):
         ]
 
 
+class StockReservation(ModelMixin):
+    """Stock held for a checkout, see product.inventory
+
+    The stock is taken off ``stock_quantity`` when reserved, committing only closes the
+    reservation while releasing it (explicitly or once ``expires_at`` passed) puts the
+    quantity back.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_reservations')
+    product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, null=True, blank=True)
+    quantity = models.PositiveIntegerField()
+    reference_id = models.CharField(max_length=255)
+    reservation_status = models.CharField(max_length=20, choices=RESERVATION_STATUS, default='reserved')
+    expires_at = models.DateTimeField()
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        db_table = 'stock_reservations'
+        indexes = [
+            models.Index(fields=['reference_id']),
+            models.Index(fields=['reservation_status', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.reference_id}: {self.quantity} x {self.product_variant_id or self.product_id}"
+
+
+class BulkProductUpdate(ModelMixin):
+    """Price, stock and flag changes applied to a filtered set of products, see product.bulk_update
+
+    Kept as the audit trail of the change; the progress fields are updated after every
+    chunk and ``last_product_id`` lets a failed run resume where it stopped.
+    """
+    created_by = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True)
+    filters = models.JSONField(default=dict, blank=True)
+    changes = models.JSONField(default=dict)
+    dry_run = models.BooleanField(default=False)
+    update_status = models.CharField(max_length=20, choices=BULK_UPDATE_STATUS, default='pending')
+    chunk_size = models.PositiveIntegerField(default=1000)
+    matched_count = models.PositiveIntegerField(default=0)
+    updated_count = models.PositiveIntegerField(default=0)
+    chunks_total = models.PositiveIntegerField(default=0)
+    chunks_done = models.PositiveIntegerField(default=0)
+    last_product_id = models.UUIDField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'bulk_product_updates'
+
+    def __str__(self):
+        return f"Bulk update {self.pk} ({self.update_status})"
+
+
 class FlashSale(ModelMixin):
     name = models.CharField(max_length=255)
     description = models.TextField(null=True, blank=True)
@@ -630,7 +1002,11 @@ class ProductFAQ(ModelMixin):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        cache.clear()
+        invalidate_cache_tags('faqs', source='faq')
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+        invalidate_cache_tags('faqs', source='faq')
 
 
 class ProductTax(ModelMixin):
@@ -665,10 +1041,16 @@ class Banner(ModelMixin):
     def __str__(self):
         return self.title
 
+    @property
+    def cache_tags(self):
+        """Tags of the cached payloads that render this banner"""
+        return ['banners', f'banner:{self.pk}']
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        cache.clear()
+        invalidate_cache_tags(*self.cache_tags, source='banner')
 
     def delete(self, *args, **kwargs):
+        tags = self.cache_tags
         super().delete(*args, **kwargs)
-        cache.clear()
\ No newline at end of file
+        invalidate_cache_tags(*tags, source='banner')
\ No newline at end of file
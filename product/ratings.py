@@ -0,0 +1,65 @@
+"""
+Bulk rebuild of the product rating summaries.
+
+Review.save()/delete() keep ProductRatingSummary current with F() deltas, this
+recomputes every summary from the approved reviews. It's shared by the
+rebuild_rating_summaries command and the migration that fills the summaries in.
+"""
+from django.apps import apps as global_apps
+from django.db.models import Count, Q, Sum
+
+SUMMARY_FIELDS = ['rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count',
+                  'total_reviews', 'rating_sum', 'verified_count', 'average_rating', 'updated_on']
+
+
+def rebuild_rating_summaries(batch_size=1000, apps=global_apps):
+    """Recompute the summary of every product, returns the number of summaries written
+
+    ``apps`` is the app registry of a migration when run from one.
+    """
+    Product = apps.get_model('product', 'Product')
+    Review = apps.get_model('product', 'Review')
+    ProductRatingSummary = apps.get_model('product', 'ProductRatingSummary')
+
+    # the managers of the historical models don't hide the deleted rows
+    reviews = Review._base_manager.filter(is_approved=True).exclude(status='deleted')
+    aggregates = {
+        row['product_id']: row for row in reviews.order_by().values('product_id').annotate(
+            total=Count('id'),
+            rating_total=Sum('rating'),
+            verified=Count('id', filter=Q(is_verified_purchase=True)),
+            **{f'rating_{i}': Count('id', filter=Q(rating=i)) for i in range(1, 6)},
+        )
+    }
+
+    rebuilt = 0
+    batch = []
+    for product_id in Product._base_manager.values_list('id', flat=True).iterator(chunk_size=batch_size):
+        batch.append(_build_summary(ProductRatingSummary, product_id, aggregates.get(product_id)))
+        if len(batch) >= batch_size:
+            rebuilt += _upsert(ProductRatingSummary, batch)
+            batch = []
+    if batch:
+        rebuilt += _upsert(ProductRatingSummary, batch)
+    return rebuilt
+
+
+def _build_summary(summary_model, product_id, row):
+    if row is None:
+        return summary_model(product_id=product_id)
+
+    return summary_model(
+        product_id=product_id,
+        total_reviews=row['total'],
+        rating_sum=row['rating_total'] or 0,
+        verified_count=row['verified'],
+        average_rating=(row['rating_total'] or 0) / row['total'],
+        **{f'rating_{i}_count': row[f'rating_{i}'] for i in range(1, 6)},
+    )
+
+
+def _upsert(summary_model, summaries):
+    summary_model.objects.bulk_create(
+        summaries, update_conflicts=True, unique_fields=['product'], update_fields=SUMMARY_FIELDS,
+    )
+    return len(summaries)
@@ -1,6 +1,7 @@
 from import_export import resources
 
 from product.models import *
+from utils.cache import defer_cache_invalidation
 
 EXCLUDE_FOR_API = ('date_created', 'date_updated')
 
@@ -32,6 +33,11 @@ class ProductResource(resources.ModelResource):
         import_id_fields = ('id',)
         exclude = EXCLUDE_FOR_API
 
+    def import_data(self, *args, **kwargs):
+        # one invalidation for the file instead of one per saved row
+        with defer_cache_invalidation():
+            return super().import_data(*args, **kwargs)
+
 
 class ProductImageResource(resources.ModelResource):
     class Meta:
@@ -159,6 +165,34 @@ class StockMovementResource(resources.ModelResource):
         exclude = EXCLUDE_FOR_API
 
 
+class ImageContentResource(resources.ModelResource):
+    class Meta:
+        model = ImageContent
+        import_id_fields = ('id',)
+        exclude = EXCLUDE_FOR_API
+
+
+class StorageDeletionResource(resources.ModelResource):
+    class Meta:
+        model = StorageDeletion
+        import_id_fields = ('id',)
+        exclude = EXCLUDE_FOR_API
+
+
+class BulkProductUpdateResource(resources.ModelResource):
+    class Meta:
+        model = BulkProductUpdate
+        import_id_fields = ('id',)
+        exclude = EXCLUDE_FOR_API
+
+
+class StockReservationResource(resources.ModelResource):
+    class Meta:
+        model = StockReservation
+        import_id_fields = ('id',)
+        exclude = EXCLUDE_FOR_API
+
+
 class FlashSaleResource(resources.ModelResource):
     class Meta:
         model = FlashSale
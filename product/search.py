@@ -0,0 +1,39 @@
+from product.models import Product
+from utils.search import SearchIndex
+
+PRODUCT_SEARCH_FIELDS = [
+    ('name', 'A'),
+    ('sku', 'A'),
+    ('brand', 'B'),
+    ('sub_category', 'C'),
+    ('short_description', 'D'),
+]
+
+product_search_index = SearchIndex('product_search', Product, PRODUCT_SEARCH_FIELDS)
+
+
+def product_search_document(product):
+    return {
+        'name': product.name,
+        'sku': product.sku,
+        'brand': product.brand.name if product.brand_id else '',
+        'sub_category': product.sub_category.name,
+        'short_description': product.short_description,
+    }
+
+
+def update_product_search_index(products):
+    """(Re)index ``products``, a queryset or a list of products"""
+    if hasattr(products, 'select_related'):
+        products = products.select_related('brand', 'sub_category')
+    product_search_index.update_many((product.pk, product_search_document(product)) for product in products)
+
+
+def rebuild_product_search_index():
+    products = Product.all_objects.select_related('brand', 'sub_category').iterator(chunk_size=1000)
+    product_search_index.rebuild((product.pk, product_search_document(product)) for product in products)
+
+
+def search_products(queryset, query):
+    """Filter ``queryset`` to the products matching ``query``, best matches first"""
+    return product_search_index.search(queryset, query)
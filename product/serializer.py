@@ -1,6 +1,5 @@
 import json
 
-from django.db.models import Avg
 from rest_framework import serializers
 
 from product.models import *
@@ -68,36 +67,7 @@ class ListWishlistSerializer(serializers.ModelSerializer):
 
     def get_rating_summary(self, obj):
         """Get comprehensive rating summary"""
-        reviews = obj.product.reviews.filter(is_approved=True)
-
-        if not reviews.exists():
-            return {
-                'average_rating': 0,
-                'total_reviews': 0,
-                'rating_distribution': {str(i): 0 for i in range(1, 6)},
-                'percentage_distribution': {str(i): 0 for i in range(1, 6)}
-            }
-
-        rating_counts = {}
-        total_reviews = reviews.count()
-
-        for i in range(1, 6):
-            count = reviews.filter(rating=i).count()
-            rating_counts[str(i)] = count
-
-        percentage_distribution = {}
-        for rating, count in rating_counts.items():
-            percentage_distribution[rating] = round((count / total_reviews) * 100, 1) if total_reviews > 0 else 0
-
-        avg_rating = reviews.aggregate(avg=Avg('rating'))['avg'] or 0
-
-        return {
-            'average_rating': round(avg_rating, 1),
-            'total_reviews': total_reviews,
-            'rating_distribution': rating_counts,
-            'percentage_distribution': percentage_distribution,
-            'verified_purchases': reviews.filter(is_verified_purchase=True).count()
-        }
+        return ProductRatingSummary.for_product(obj.product)
 
     class Meta:
         model = Wishlist
@@ -141,7 +111,29 @@ class CreateWishlistSerializer(serializers.ModelSerializer):
 class ReviewMediaSerializer(serializers.ModelSerializer):
     class Meta:
         model = ReviewMedia
-        fields = ['id', 'media_type', 'file']
+        fields = ['id', 'media_type', 'file', 'file_url', 'thumbnail_url', 'processing_status']
+
+
+class StartUploadSerializer(serializers.Serializer):
+    purpose = serializers.ChoiceField(choices=['product_image', 'review_media'])
+    target_id = serializers.UUIDField()
+    filename = serializers.CharField(max_length=255)
+    content_type = serializers.CharField(max_length=100)
+    size = serializers.IntegerField(min_value=1)
+
+
+class CompleteUploadSerializer(serializers.Serializer):
+    token = serializers.CharField()
+    alt_text = serializers.CharField(max_length=255, required=False, default='', allow_blank=True)
+    is_primary = serializers.BooleanField(required=False, default=False)
+    sort_order = serializers.IntegerField(required=False, allow_null=True, default=None)
+
+
+class BulkProductUpdateSerializer(serializers.Serializer):
+    filters = serializers.DictField()
+    changes = serializers.DictField()
+    dry_run = serializers.BooleanField(required=False, default=False)
+    chunk_size = serializers.IntegerField(required=False, default=1000, min_value=1, max_value=10000)
 
 
 class CreateReviewSerializer(serializers.ModelSerializer):
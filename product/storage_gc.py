@@ -0,0 +1,110 @@
+"""
+Storage garbage collection.
+
+Deleting an image (one by one, with a queryset or through a cascade from its product)
+only records its stored keys in the StorageDeletion outbox, in the same transaction
+as the rows; ``drain_storage_deletions`` (celery beat) deletes them from the bucket
+in batches of up to 1000 keys per delete_objects call. Keys that fail are retried
+with a growing delay.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from oumraa.space_manager import DELETE_BATCH_SIZE, DigitalOceanSpacesManager
+from product.models import ImageContent, ProductImage, ReviewMedia, StorageDeletion
+
+logger = logging.getLogger(__name__)
+
+# a drain owns the keys it picked for that long, a crashed one leaves them to the next
+CLAIM_TIMEOUT = timedelta(minutes=10)
+MAX_RETRY_DELAY = timedelta(hours=6)
+
+
+def queue_storage_deletion(keys):
+    """Record ``keys`` for deletion, with the current transaction"""
+    keys = [key for key in dict.fromkeys(keys) if key]
+    StorageDeletion.all_objects.bulk_create([StorageDeletion(key=key) for key in keys])
+    return len(keys)
+
+
+@receiver(post_delete, sender=ProductImage)
+def release_product_image_files(sender, instance, **kwargs):
+    """Queue the files of a deleted image, once no other image shares them"""
+    if instance.content_hash:
+        content = ImageContent.all_objects.select_for_update().filter(content_hash=instance.content_hash).first()
+        if content is None:
+            return
+        if content.reference_count > 1:
+            content.reference_count -= 1
+            content.save(update_fields=['reference_count', 'updated_on'])
+            return
+        content.delete()
+    queue_storage_deletion(instance.storage_keys)
+
+
+@receiver(post_delete, sender=ReviewMedia)
+def release_review_media_files(sender, instance, **kwargs):
+    queue_storage_deletion([instance.file_key, *instance.variant_keys])
+
+
+def drain_storage_deletions(batch_size=DELETE_BATCH_SIZE, max_batches=None):
+    """Delete the queued keys from the bucket
+
+    Returns ``{'deleted': ..., 'failed': ..., 'batches': ...}``.
+    """
+    manager = DigitalOceanSpacesManager()
+    stats = {'deleted': 0, 'failed': 0, 'batches': 0}
+    while max_batches is None or stats['batches'] < max_batches:
+        batch = _claim_batch(batch_size)
+        if not batch:
+            break
+        stats['batches'] += 1
+
+        failed = manager.delete_objects([deletion.key for deletion in batch])
+        done = [deletion.pk for deletion in batch if deletion.key not in failed]
+        StorageDeletion.all_objects.filter(pk__in=done).delete()
+        stats['deleted'] += len(done)
+
+        now = timezone.now()
+        for deletion in batch:
+            if deletion.key not in failed:
+                continue
+            deletion.attempts += 1
+            deletion.last_error = failed[deletion.key]
+            deletion.next_attempt_at = now + min(timedelta(minutes=2 ** deletion.attempts), MAX_RETRY_DELAY)
+        retried = [deletion for deletion in batch if deletion.key in failed]
+        StorageDeletion.all_objects.bulk_update(retried, ['attempts', 'last_error', 'next_attempt_at'])
+        stats['failed'] += len(retried)
+        if len(batch) < batch_size:
+            break
+
+    if stats['batches']:
+        logger.info('Storage GC deleted %(deleted)s keys, %(failed)s failed, in %(batches)s batches', stats)
+    return stats
+
+
+def _claim_batch(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(StorageDeletion.all_objects.select_for_update(skip_locked=True).filter(
+            next_attempt_at__lte=now
+        ).order_by('next_attempt_at')[:batch_size])
+        StorageDeletion.all_objects.filter(pk__in=[deletion.pk for deletion in batch]).update(
+            next_attempt_at=now + CLAIM_TIMEOUT
+        )
+    return batch
+
+
+def pending_storage_deletions():
+    """Queue metrics: ``{'pending': ..., 'retrying': ..., 'max_attempts': ...}``"""
+    metrics = StorageDeletion.all_objects.aggregate(
+        pending=Count('pk'), retrying=Count('pk', filter=Q(attempts__gt=0)), max_attempts=Max('attempts'),
+    )
+    metrics['max_attempts'] = metrics['max_attempts'] or 0
+    return metrics
@@ -0,0 +1,61 @@
+from celery import shared_task
+
+from product.bulk_update import run_bulk_update
+from product.flash_sales import sync_flash_sales
+from product.images import mark_image_failed, mark_review_media_failed, process_image, process_review_media
+from product.inventory import release_expired_reservations
+from product.models import BulkProductUpdate, ProductImage, ReviewMedia
+from product.storage_gc import drain_storage_deletions
+
+
+@shared_task
+def release_expired_stock_reservations():
+    return release_expired_reservations()
+
+
+@shared_task
+def sync_flash_sales_task():
+    sync_flash_sales()
+
+
+@shared_task
+def drain_storage_deletions_task():
+    return drain_storage_deletions()
+
+
+@shared_task(bind=True, max_retries=3)
+def process_product_image(self, image_id):
+    """Generate the size variants of an uploaded image, retried with a growing delay"""
+    try:
+        process_image(image_id)
+    except ProductImage.DoesNotExist:
+        # deleted while it was queued
+        return
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            mark_image_failed(image_id, e)
+            return
+        raise self.retry(exc=e, countdown=30 * 2 ** self.request.retries)
+
+
+@shared_task(bind=True, max_retries=3)
+def process_review_media_task(self, media_id):
+    """Generate the display sizes of a directly uploaded review image"""
+    try:
+        process_review_media(media_id)
+    except ReviewMedia.DoesNotExist:
+        return
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            mark_review_media_failed(media_id, e)
+            return
+        raise self.retry(exc=e, countdown=30 * 2 ** self.request.retries)
+
+
+@shared_task
+def apply_bulk_product_update(job_id):
+    """Run a queued bulk product update, see product.bulk_update"""
+    job = BulkProductUpdate.objects.filter(pk=job_id, dry_run=False).exclude(update_status='completed').first()
+    if job is None:
+        return
+    run_bulk_update(job)
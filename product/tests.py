@@ -1,3 +1,772 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from importlib import import_module
+from decimal import ROUND_HALF_UP, Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from uuid import uuid4
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from oumraa.space_manager import DigitalOceanSpacesManager, LocalStorageClient
+from product.bulk_import import import_catalog
+from product.bulk_update import run_bulk_update
+from product.images import create_pending_image, mark_image_failed, process_image, process_review_media, \
+    upload_image_source
+from product.search import search_products
+from product.uploads import start_upload
+from product.storage_gc import drain_storage_deletions, pending_storage_deletions, queue_storage_deletion
+from product.inventory import InsufficientStock, commit_reservations, release_expired_reservations, \
+    release_reference, reserve_stock
+from product.flash_sales import REMAINING_KEY, SOLD_KEY, claim_sale_quantity, load_flash_sale, \
+    reconcile_flash_sale_sold, sale_item_entry
+from product.models import BulkProductUpdate, Category, SubCategory, FlashSale, FlashSaleItem, Product, ImageContent, \
+    ProductImage, ProductRatingSummary, ProductVariant, Review, ReviewMedia, StorageDeletion, StockMovement, StockReservation
+from utils.cache import take_redis_hash
+from utils.testing import LOCMEM_CACHES, QueryCountTestMixin, fake_redis, requires_redis, seed_dataset
+
+
+class ProductQueryCountTests(QueryCountTestMixin, TestCase):
+    urlconf = 'product.urls'
+    url_prefix = '/api/product/'
+    query_counts = {
+        'api-root': 0,
+        'bulk-update-products': 3,
+        'bulk-update-status': 1,
+        'complete-direct-upload': 9,
+        'delete-product-image': 6,
+        'order-items-detail': 2,
+        'order-items-get-order-items': 1,
+        'order-items-list': 3,
+        'product-image-status': 1,
+        'reorder-product-images': 4,
+        'review-product-detail': 1,
+        'review-product-get-order-items': 1,
+        'review-product-list': 2,
+        'set-primary-image': 7,
+        'start-direct-upload': 1,
+        'upload-product-image': 10,
+        'wishlist-detail': 2,
+        'wishlist-list': 3,
+    }
+    requests = {
+        'delete-product-image': {'method': 'delete'},
+        'set-primary-image': {'method': 'post'},
+        'bulk-update-products': {'method': 'post', 'staff': True, 'data': {
+            'filters': {'min_price': '100'}, 'changes': {'flags': {'is_featured': True}}, 'dry_run': True,
+        }},
+        'bulk-update-status': {'staff': True},
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.review = Review.objects.create(user=cls.seed.user, product=cls.seed.products[0], rating=5, comment='Mine')
+        cls.job = BulkProductUpdate.objects.create(created_by=cls.seed.user, filters={'min_price': '100'},
+                                                   changes={'flags': {'is_featured': True}})
+
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.manager = DigitalOceanSpacesManager(client=LocalStorageClient(self.root.name, 'http://localhost/spaces'))
+        for module in ('product.uploads', 'product.images', 'product.storage_gc'):
+            patcher = mock.patch(f'{module}.DigitalOceanSpacesManager', lambda: self.manager)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_url_kwargs(self, name, params):
+        product_id = str(self.seed.products[0].pk)
+        image_id = str(self.seed.products[0].images.first().pk)
+        return {
+            'wishlist-detail': {'id': str(self.seed.wishlist.pk)},
+            'order-items-detail': {'id': str(self.seed.wishlist.pk)},
+            'review-product-detail': {'id': str(self.review.pk)},
+            'upload-product-image': {'product_id': product_id},
+            'reorder-product-images': {'product_id': product_id},
+            'product-image-status': {'image_id': image_id},
+            'delete-product-image': {'image_id': image_id},
+            'set-primary-image': {'image_id': image_id},
+            'bulk-update-status': {'job_id': str(self.job.pk)},
+        }.get(name) or super().get_url_kwargs(name, params)
+
+    def get_request(self, name):
+        product = self.seed.products[0]
+        if name == 'upload-product-image':
+            buffer = BytesIO()
+            Image.new('RGB', (640, 480)).save(buffer, format='JPEG')
+            image = SimpleUploadedFile('upload.jpg', buffer.getvalue(), content_type='image/jpeg')
+            return {'method': 'post', 'data': {'image': image}, 'format': 'multipart'}
+        if name == 'reorder-product-images':
+            return {'method': 'post', 'data': {'images': [str(product.images.first().pk)]}}
+        upload = {'purpose': 'product_image', 'target_id': str(product.pk), 'filename': 'photo.jpg',
+                  'content_type': 'image/jpeg', 'size': 1000}
+        if name == 'start-direct-upload':
+            return {'method': 'post', 'data': upload}
+        if name == 'complete-direct-upload':
+            staged = start_upload(self.seed.user, **upload)
+            path = os.path.join(self.root.name, staged['upload_url'].split('/spaces/', 1)[1])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'image')
+            return {'method': 'post', 'data': {'token': staged['token']}}
+        return super().get_request(name)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StockReservationTests(TransactionTestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Category')
+        sub_category = SubCategory.objects.create(name='Sub Category', category=category)
+        self.product = Product.objects.create(name='Product', sub_category=sub_category, sku='STOCK-1',
+                                              price=Decimal(100), stock_quantity=10)
+        self.other = Product.objects.create(name='Other', sub_category=sub_category, sku='STOCK-2',
+                                            price=Decimal(100), stock_quantity=1)
+
+    def stock(self, product):
+        return Product.all_objects.values_list('stock_quantity', flat=True).get(pk=product.pk)
+
+    def test_reserve_and_release(self):
+        reserve_stock([(self.product.pk, None, 3), (self.product.pk, None, 1)], 'order-1')
+        self.assertEqual(self.stock(self.product), 6)
+
+        self.assertEqual(release_reference('order-1'), 1)
+        self.assertEqual(release_reference('order-1'), 0)
+        self.assertEqual(self.stock(self.product), 10)
+        self.assertEqual(
+            list(self.product.stock_movements.order_by('created_at').values_list(
+                'movement_type', 'quantity', 'previous_stock', 'new_stock')),
+            [('reservation', -4, 10, 6), ('release', 4, 6, 10)]
+        )
+
+    def test_reservation_is_all_or_nothing(self):
+        with self.assertRaises(InsufficientStock):
+            reserve_stock([(self.product.pk, None, 2), (self.other.pk, None, 2)], 'order-1')
+        self.assertEqual(self.stock(self.product), 10)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_expired_reservations_are_released(self):
+        reserve_stock([(self.product.pk, None, 2)], 'order-1')
+        reserve_stock([(self.product.pk, None, 3)], 'order-2')
+        commit_reservations('order-2')
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(release_expired_reservations(), 1)
+        self.assertEqual(self.stock(self.product), 7)
+
+    def test_concurrent_reservations_do_not_oversell(self):
+        results = []
+        start = threading.Barrier(25)
+
+        def reserve(index):
+            start.wait()
+            try:
+                while True:
+                    try:
+                        reserve_stock([(self.product.pk, None, 1)], f'order-{index}')
+                        results.append(True)
+                    except InsufficientStock:
+                        results.append(False)
+                    except OperationalError:
+                        # the in-memory sqlite test database reports a busy table instead of waiting for it
+                        continue
+                    break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reserve, args=(i,)) for i in range(25)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 10)
+        self.assertEqual(self.stock(self.product), 0)
+        self.assertEqual(StockReservation.objects.count(), 10)
+        self.assertEqual(
+            sorted(self.product.stock_movements.values_list('previous_stock', flat=True)), list(range(1, 11))
+        )
+
+
+class InMemorySpacesManager:
+    """DigitalOceanSpacesManager keeping the sources in a dict"""
+    sources = {}
+
+    def download(self, key, name=None):
+        buffer = BytesIO(self.sources[key])
+        buffer.name = name
+        return buffer
+
+    def process_and_upload_image(self, image_file, folder='products', file_id=None):
+        size = Image.open(image_file).size
+        return {'success': True, 'file_id': file_id, 'original_size': size, 'results': {
+            'formats': {'webp': {'medium': {'key': f'medium/{file_id}.webp', 'url': f'medium/{file_id}.webp'}}},
+            **{f'{variant}_{kind}': f'{variant}/{file_id}.jpg'
+               for variant in ('thumbnail', 'medium', 'large', 'original') for kind in ('url', 'key')},
+        }}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductImageProcessingTests(TestCase):
+
+    def setUp(self):
+        self.seed = seed_dataset(products=1, reviews_per_product=0)
+        self.image = ProductImage.objects.create(
+            product=self.seed.products[0], file_id='upload', source_key='products/sources/upload.png',
+            original_filename='upload.png', processing_status='pending',
+        )
+        buffer = BytesIO()
+        Image.new('RGB', (800, 400)).save(buffer, format='PNG')
+        InMemorySpacesManager.sources = {self.image.source_key: buffer.getvalue()}
+        self.client = APIClient()
+        self.client.force_authenticate(self.seed.user)
+
+    def test_process_image(self):
+        with mock.patch('product.images.DigitalOceanSpacesManager', InMemorySpacesManager):
+            process_image(self.image.pk)
+
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.processing_status, 'ready')
+        self.assertEqual((self.image.original_width, self.image.original_height), (800, 400))
+        self.assertEqual(self.image.medium_url, 'medium/upload.jpg')
+        self.assertEqual(self.image.get_format_urls('medium'), {'webp': 'medium/upload.webp', 'jpeg': 'medium/upload.jpg'})
+
+    def test_status_and_retry(self):
+        url = f'/api/product/images/{self.image.pk}/status/'
+        response = self.client.get(url)
+        self.assertEqual(response.data['processing_status'], 'pending')
+        self.assertNotIn('urls', response.data)
+        self.assertEqual(self.client.post(url).status_code, 400)
+
+        mark_image_failed(self.image.pk, 'Upload failed')
+        with mock.patch('product.images.enqueue_image_processing') as enqueue:
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['processing_status'], 'pending')
+        enqueue.assert_called_once()
+
+
+class SpacesManagerTests(TestCase):
+
+    def test_process_and_upload_image(self):
+        buffer = BytesIO()
+        Image.new('RGBA', (2000, 1000)).save(buffer, format='PNG')
+        buffer.seek(0)
+        buffer.name = 'upload.png'
+
+        with tempfile.TemporaryDirectory() as root:
+            manager = DigitalOceanSpacesManager(client=LocalStorageClient(root, 'http://localhost/spaces'))
+            result = manager.process_and_upload_image(buffer, file_id='upload')
+
+            self.assertTrue(result['success'], result.get('error'))
+            self.assertEqual(result['original_size'], (2000, 1000))
+            self.assertEqual(
+                {size: result['results'][f'{size}_size'] for size in ('large', 'medium', 'thumbnail')},
+                {'large': (1200, 600), 'medium': (600, 300), 'thumbnail': (300, 150)}
+            )
+            self.assertEqual(result['results']['medium_url'], 'http://localhost/spaces/local/products/upload_medium.jpg')
+            webp = result['results']['formats']['webp']
+            self.assertEqual(set(webp), {'thumbnail', 'medium', 'large'})
+            self.assertEqual(Image.open(manager.client.path(manager.bucket_name, webp['medium']['key'])).format, 'WEBP')
+
+            image = ProductImage(medium_url=result['results']['medium_url'], format_variants=result['results']['formats'])
+            self.assertEqual(list(image.get_format_urls('medium'))[-2:], ['webp', 'jpeg'])
+            self.assertIn(f"{webp['large']['url']} 1200w", image.format_srcsets['webp'])
+            path = manager.client.path(manager.bucket_name, result['results']['thumbnail_key'])
+            self.assertEqual(Image.open(path).size, (300, 150))
+
+            manager.delete_image_variants([result['results'][f'{size}_key'] for size in ('thumbnail', 'original')])
+            self.assertFalse(os.path.exists(path))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ImageDeduplicationTests(TestCase):
+
+    def setUp(self):
+        self.seed = seed_dataset(products=2, reviews_per_product=0)
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.manager = DigitalOceanSpacesManager(client=LocalStorageClient(self.root.name, 'http://localhost/spaces'))
+        for module in ('product.images', 'product.storage_gc'):
+            patcher = mock.patch(f'{module}.DigitalOceanSpacesManager', lambda: self.manager)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        buffer = BytesIO()
+        Image.new('RGB', (800, 400), (200, 30, 30)).save(buffer, format='JPEG')
+        self.content = buffer.getvalue()
+
+    def upload(self, product):
+        image_file = BytesIO(self.content)
+        image_file.name, image_file.size = 'upload.jpg', len(self.content)
+        return create_pending_image(product, upload_image_source(image_file, manager=self.manager))
+
+    def exists(self, key):
+        return os.path.exists(self.manager.client.path(self.manager.bucket_name, key))
+
+    def test_duplicate_uploads_share_the_stored_files(self):
+        first = self.upload(self.seed.products[0])
+        self.assertEqual(first.processing_status, 'pending')
+        first = process_image(first.pk)
+
+        second = self.upload(self.seed.products[1])
+        self.assertEqual(second.processing_status, 'ready')
+        self.assertEqual((second.file_id, second.medium_key), (first.file_id, first.medium_key))
+        self.assertEqual(ImageContent.objects.get().reference_count, 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.root.name, 'local', 'products', 'sources'))), 1)
+
+        first.delete()
+        self.assertFalse(StorageDeletion.objects.exists())
+        self.assertEqual(ImageContent.objects.get().reference_count, 1)
+
+        # a cascade from the product releases the files too
+        keys = {key for image in self.seed.products[1].images.all() for key in image.storage_keys if key}
+        self.seed.products[1].delete()
+        self.assertTrue(self.exists(second.medium_key))
+        self.assertEqual(drain_storage_deletions()['deleted'], len(keys))
+        self.assertFalse(self.exists(second.medium_key))
+        self.assertFalse(self.exists(second.source_key))
+        self.assertFalse(ImageContent.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DirectUploadTests(TestCase):
+
+    def setUp(self):
+        self.seed = seed_dataset(products=1, reviews_per_product=0)
+        self.product = self.seed.products[0]
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.manager = DigitalOceanSpacesManager(client=LocalStorageClient(self.root.name, 'http://localhost/spaces'))
+        for module in ('product.uploads', 'product.images', 'product.storage_gc'):
+            patcher = mock.patch(f'{module}.DigitalOceanSpacesManager', lambda: self.manager)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(self.seed.user)
+
+    def start(self, purpose, target_id, content_type='image/jpeg'):
+        response = self.client.post('/api/product/uploads/', {
+            'purpose': purpose, 'target_id': str(target_id), 'filename': 'photo.jpg',
+            'content_type': content_type, 'size': 1000,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def put(self, upload):
+        """What the client does with the presigned url"""
+        buffer = BytesIO()
+        Image.new('RGB', (640, 480), (10, 120, 200)).save(buffer, format='JPEG')
+        path = os.path.join(self.root.name, upload['upload_url'].split('/spaces/', 1)[1])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(buffer.getvalue())
+
+    def complete(self, upload, **data):
+        return self.client.post('/api/product/uploads/complete/', {'token': upload['token'], **data}, format='json')
+
+    def test_product_image_upload(self):
+        upload = self.start('product_image', self.product.pk)
+        self.assertEqual(self.complete(upload).data['error'], 'The file was not uploaded')
+
+        self.put(upload)
+        response = self.complete(upload, alt_text='Front')
+        self.assertEqual(response.status_code, 202, response.data)
+        self.assertEqual(response.data['processing_status'], 'pending')
+        # completing twice does not create a second image
+        self.assertEqual(self.complete(upload).data['id'], response.data['id'])
+
+        image = process_image(response.data['id'])
+        self.assertEqual((image.original_width, image.original_height), (640, 480))
+        self.assertEqual(ImageContent.objects.get().content_hash, image.content_hash)
+
+        # the same photo uploaded again is switched to the stored copy
+        upload = self.start('product_image', self.product.pk)
+        self.put(upload)
+        duplicate = process_image(self.complete(upload).data['id'])
+        self.assertEqual((duplicate.file_id, duplicate.medium_key), (image.file_id, image.medium_key))
+        self.assertEqual(ImageContent.objects.get().reference_count, 2)
+        drain_storage_deletions()
+        self.assertEqual(len(os.listdir(os.path.join(self.root.name, 'local', 'products', 'sources'))), 1)
+
+    def test_review_media_upload(self):
+        review = Review.objects.create(user=self.seed.user, product=self.product, rating=5, comment='Nice')
+        upload = self.start('review_media', review.pk, content_type='video/mp4')
+        self.put(upload)
+        response = self.complete(upload)
+        self.assertEqual(response.status_code, 202, response.data)
+        self.assertEqual((response.data['media_type'], response.data['processing_status']), ('video', 'ready'))
+        self.assertTrue(response.data['file_url'].startswith('http://localhost/spaces/local/reviews/sources/'))
+
+        upload = self.start('review_media', review.pk)
+        self.put(upload)
+        media = ReviewMedia.objects.get(pk=self.complete(upload).data['id'])
+        self.assertEqual(media.processing_status, 'pending')
+        self.assertEqual(process_review_media(media.pk).processing_status, 'ready')
+
+        self.assertEqual(self.client.post('/api/product/uploads/complete/', {'token': 'forged'}, format='json')
+                         .status_code, 400)
+
+
+class StorageGarbageCollectionTests(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.manager = DigitalOceanSpacesManager(client=LocalStorageClient(self.root.name, 'http://localhost/spaces'))
+        patcher = mock.patch('product.storage_gc.DigitalOceanSpacesManager', lambda: self.manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_drain_in_batches_and_retry_failures(self):
+        keys = [f'products/{i}.jpg' for i in range(5)]
+        for key in keys:
+            self.manager.client.upload_fileobj(BytesIO(b'x'), self.manager.bucket_name, key)
+        queue_storage_deletion(keys + [''])
+
+        delete_objects = self.manager.delete_objects
+
+        def denied_first_key(batch):
+            failed = delete_objects([key for key in batch if key != keys[0]])
+            if keys[0] in batch:
+                failed[keys[0]] = 'AccessDenied'
+            return failed
+
+        with mock.patch.object(self.manager, 'delete_objects', denied_first_key):
+            stats = drain_storage_deletions(batch_size=2)
+
+        self.assertEqual(stats, {'deleted': 4, 'failed': 1, 'batches': 3})
+        failed = StorageDeletion.objects.get()
+        self.assertEqual((failed.key, failed.attempts, failed.last_error), (keys[0], 1, 'AccessDenied'))
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        self.assertEqual(pending_storage_deletions(), {'pending': 1, 'retrying': 1, 'max_attempts': 1})
+
+        # not due yet
+        self.assertEqual(drain_storage_deletions()['batches'], 0)
+        StorageDeletion.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(drain_storage_deletions()['deleted'], 1)
+        self.assertFalse(os.listdir(os.path.join(self.root.name, 'local', 'products')))
+
+
+CATALOG_CSV = """type,sku,product_sku,name,sub_category,brand,price,stock_quantity,attributes,url,is_primary
+product,IMP-1,,Imported Shirt,Seed Sub Category,Seed Brand,499,20,,,
+product,SEED-0,,,,,149.50,,,,
+variant,IMP-1-RED,IMP-1,,,,519,5,Color=Red|Size=M,,
+image,,IMP-1,,,,,,,https://cdn.example.com/shirt.jpg,true
+product,IMP-1,,Duplicate,Seed Sub Category,,10,,,,
+variant,IMP-2-RED,MISSING,,,,10,1,,,
+product,IMP-3,,Bad Price,Seed Sub Category,,abc,,,,
+"""
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogImportTests(TestCase):
+
+    def setUp(self):
+        self.data = seed_dataset(products=2, reviews_per_product=0)
+
+    def test_csv_import_creates_updates_and_reports_bad_rows(self):
+        with mock.patch('product.bulk_import.invalidate_cache_tags') as invalidate:
+            report = import_catalog(StringIO(CATALOG_CSV), 'csv', chunk_size=3)
+
+        self.assertEqual(report.created, {'product': 1, 'variant': 1, 'image': 1})
+        self.assertEqual(report.updated, {'product': 1, 'variant': 0, 'image': 0})
+        self.assertEqual([(line, sku) for line, sku, _ in report.errors], [(6, 'IMP-1'), (7, 'IMP-2-RED'), (8, 'IMP-3')])
+        invalidate.assert_called_once()
+
+        product = Product.objects.get(sku='IMP-1')
+        self.assertEqual((product.price, product.stock_quantity, product.brand.name), (499, 20, 'Seed Brand'))
+        self.assertEqual(Product.objects.get(sku='SEED-0').price, Decimal('149.50'))
+        variant = ProductVariant.objects.get(sku='IMP-1-RED')
+        self.assertEqual(variant.product, product)
+        self.assertEqual(sorted((a.attribute.name, a.value.value) for a in variant.attributes.all()),
+                         [('Color', 'Red'), ('Size', 'M')])
+        image = product.images.get()
+        self.assertTrue(image.is_primary)
+        self.assertEqual(image.medium_url, 'https://cdn.example.com/shirt.jpg')
+
+    def test_jsonl_rows_update_existing_variants(self):
+        rows = StringIO(
+            '{"type": "variant", "product_sku": "SEED-1", "sku": "SEED-1-BLUE", "price": 10, '
+            '"attributes": {"Color": "Blue"}}\n'
+            'not json\n'
+            '{"type": "variant", "product_sku": "SEED-1", "sku": "SEED-1-BLUE", "stock_quantity": 3}\n'
+        )
+        report = import_catalog(rows, 'jsonl')
+        self.assertEqual((report.created['variant'], [line for line, _, _ in report.errors]), (1, [2, 3]))
+
+        report = import_catalog(StringIO('{"type": "variant", "product_sku": "SEED-1", "sku": "SEED-1-BLUE", '
+                                         '"stock_quantity": 3, "attributes": {"color": "Green"}}\n'), 'jsonl')
+        self.assertEqual(report.updated['variant'], 1)
+        variant = ProductVariant.objects.get(sku='SEED-1-BLUE')
+        self.assertEqual((variant.price, variant.stock_quantity), (10, 3))
+        self.assertEqual([a.value.value for a in variant.attributes.all()], ['Green'])
+
+    def test_dry_run_writes_nothing(self):
+        report = import_catalog(StringIO(CATALOG_CSV), 'csv', dry_run=True)
+        self.assertEqual(report.created['product'], 1)
+        self.assertFalse(Product.objects.filter(sku='IMP-1').exists())
+        self.assertEqual(Product.objects.get(sku='SEED-0').price, 100)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RatingSummaryTests(TestCase):
+
+    def setUp(self):
+        self.seed = seed_dataset(products=2, reviews_per_product=3)
+
+    def summaries(self):
+        return {summary.pk: summary.to_dict() for summary in ProductRatingSummary.objects.all()}
+
+    def test_migration_fills_the_summaries_in(self):
+        expected = self.summaries()
+        self.assertEqual(sum(summary.total_reviews for summary in ProductRatingSummary.objects.all()), 6)
+        ProductRatingSummary.objects.all().delete()
+
+        migration = import_module('product.migrations.0023_fill_rating_summaries')
+        migration.fill_rating_summaries(django_apps, None)
+        self.assertEqual(self.summaries(), expected)
+
+    def test_edits_move_the_rating_between_counts(self):
+        review = self.seed.products[0].reviews.first()
+        old_rating = review.rating
+        review.rating = old_rating % 5 + 1
+        review.save()
+        edited = self.summaries()
+
+        call_command('rebuild_rating_summaries', stdout=StringIO())
+        self.assertEqual(self.summaries(), edited)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductSearchIndexTests(TestCase):
+
+    def setUp(self):
+        self.seed = seed_dataset(products=2, reviews_per_product=0)
+        self.brand = self.seed.products[0].brand
+        self.sub_category = self.seed.products[0].sub_category
+
+    def search(self, query):
+        return sorted(search_products(Product.objects.all(), query).values_list('sku', flat=True))
+
+    def test_renaming_a_brand_or_sub_category_reindexes_its_products(self):
+        self.brand.name = 'Himalayan Harvest'
+        self.brand.save()
+        self.sub_category.name = 'Walnuts'
+        self.sub_category.save()
+        self.assertEqual(self.search('himalayan walnuts'), ['SEED-0', 'SEED-1'])
+
+    def test_other_edits_leave_the_index_alone(self):
+        with mock.patch('product.search.update_product_search_index') as update:
+            self.brand.description = 'New description'
+            self.brand.save()
+            self.sub_category.sort_order = 3
+            self.sub_category.save()
+        update.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductImageOrderingTests(TestCase):
+
+    def setUp(self):
+        self.seed = seed_dataset(products=1, reviews_per_product=0)
+        self.product = self.seed.products[0]
+        self.primary = self.product.images.get()
+        for i in range(1, 6):
+            ProductImage.objects.create(product=self.product, file_id=f'extra-{i}', original_filename=f'{i}.jpg',
+                                        sort_order=i)
+        self.client = APIClient()
+        self.client.force_authenticate(self.seed.user)
+
+    def test_reorder_and_switch_primary_in_one_transaction(self):
+        images = list(self.product.images.order_by('-sort_order').values_list('pk', flat=True))
+        url = f'/api/product/{self.product.pk}/images/order/'
+        data = {'images': [str(pk) for pk in images], 'primary_image_id': str(images[0])}
+        with mock.patch('product.models.invalidate_cache_tags') as invalidate, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['reordered'], 6)
+        invalidate.assert_called_once_with(f'product:{self.product.pk}', source='product_image')
+
+        self.assertEqual(list(self.product.images.order_by('sort_order').values_list('pk', flat=True)), images)
+        self.assertEqual(list(self.product.images.filter(is_primary=True).values_list('pk', flat=True)), [images[0]])
+        # product, savepoint, reorder UPDATE, lock, check, unset, set, release, whatever the number of images
+        self.assertEqual(len(queries), 8)
+
+        response = self.client.post(url, {'images': [str(images[0])], 'primary_image_id': str(uuid4())},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.product.images.get(is_primary=True).pk, images[0])
+
+    def test_single_primary_image_per_product(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProductImage.objects.create(product=self.product, file_id='second', original_filename='x.jpg',
+                                        is_primary=True)
+
+        other = self.product.images.get(file_id='extra-3')
+        other.make_primary()
+        self.assertEqual(self.product.images.get(is_primary=True), other)
+
+    def test_deleting_the_primary_image_promotes_the_next_one(self):
+        response = self.client.delete(f'/api/product/images/{self.primary.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.product.images.get(is_primary=True).file_id, 'extra-1')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BulkProductUpdateTests(TestCase):
+
+    def setUp(self):
+        self.seed = seed_dataset(products=5, reviews_per_product=0)
+        Product.objects.filter(sku='SEED-4').update(stock_quantity=2)
+        self.staff = self.seed.user.__class__.objects.create_user(username='staff', email='staff@example.com',
+                                                                  is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.sub_category = self.seed.products[0].sub_category_id
+
+    def post(self, data):
+        return self.client.post('/api/product/bulk-update/', data, format='json')
+
+    def test_dry_run_previews_without_writing(self):
+        prices = dict(Product.objects.values_list('sku', 'price'))
+        response = self.post({'filters': {'sub_category': str(self.sub_category)},
+                              'changes': {'price': {'mode': 'percent', 'value': -10}}, 'dry_run': True,
+                              'chunk_size': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['matched'], response.data['preview']['chunks']), (5, 3))
+        sample = response.data['preview']['sample'][0]
+        self.assertEqual(Decimal(sample['new_price']), round(Decimal(sample['price']) * Decimal('0.9'), 2))
+        self.assertEqual(dict(Product.objects.values_list('sku', 'price')), prices)
+        self.assertEqual(BulkProductUpdate.objects.get().update_status, 'completed')
+
+    def test_percent_price_change_in_chunks_invalidates_once(self):
+        prices = dict(Product.objects.values_list('pk', 'price'))
+        job = BulkProductUpdate.objects.create(created_by=self.staff, chunk_size=2,
+                                               filters={'sub_category': str(self.sub_category)},
+                                               changes={'price': {'mode': 'percent', 'value': '12.5'},
+                                                        'flags': {'is_featured': True}})
+        with mock.patch('product.bulk_update.invalidate_cache_tags') as invalidate:
+            run_bulk_update(job)
+
+        job.refresh_from_db()
+        self.assertEqual((job.update_status, job.matched_count, job.updated_count, job.chunks_done),
+                         ('completed', 5, 5, 3))
+        for pk, price, is_featured in Product.objects.values_list('pk', 'price', 'is_featured'):
+            # the database rounds half up
+            self.assertEqual(price, (prices[pk] * Decimal('1.125')).quantize(Decimal('0.01'), ROUND_HALF_UP))
+            self.assertTrue(is_featured)
+        invalidate.assert_called_once()
+        tags = invalidate.call_args.args
+        self.assertIn(f'products:sub_category:{self.sub_category}', tags)
+        self.assertIn(f'product:{self.seed.products[0].pk}', tags)
+
+    def test_stock_adjustment_clamps_and_records_movements(self):
+        job = BulkProductUpdate.objects.create(created_by=self.staff, filters={'brand': str(self.seed.products[0].brand_id)},
+                                               changes={'stock': {'mode': 'adjust', 'value': -5}})
+        run_bulk_update(job)
+
+        self.assertEqual(Product.objects.get(sku='SEED-4').stock_quantity, 0)
+        movement = StockMovement.objects.get(product__sku='SEED-4')
+        self.assertEqual((movement.quantity, movement.reference_id), (-2, str(job.pk)))
+
+    def test_resumes_after_the_last_chunk(self):
+        first, *rest = Product.objects.order_by('pk')
+        job = BulkProductUpdate.objects.create(created_by=self.staff, last_product_id=first.pk, chunks_done=1,
+                                               filters={'sub_category': str(self.sub_category)},
+                                               changes={'price': {'mode': 'set', 'value': '1'}})
+        run_bulk_update(job)
+        self.assertEqual(Product.objects.get(pk=first.pk).price, first.price)
+        self.assertEqual({product.price for product in Product.objects.exclude(pk=first.pk)}, {1})
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post({'filters': {}, 'changes': {'flags': {'is_featured': True}}}).status_code, 400)
+        self.assertEqual(self.post({'filters': {'brand': 'x'}, 'changes': {'price': {'mode': 'double'}}}).status_code,
+                         400)
+        self.client.force_authenticate(self.seed.user)
+        self.assertEqual(self.post({'filters': {'brand': 'x'}, 'changes': {'flags': {'is_featured': True}}}).status_code,
+                         403)
+
+    def test_queues_the_update(self):
+        with mock.patch('product.tasks.apply_bulk_product_update.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.post({'filters': {'product_ids': [str(self.seed.products[0].pk)]},
+                                  'changes': {'flags': {'is_popular': True}}})
+        self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with(response.data['id'])
+        status = self.client.get(f'/api/product/bulk-update/{response.data["id"]}/')
+        self.assertEqual(status.data['status'], 'pending')
+
+
+@requires_redis
+@override_settings(CACHES=LOCMEM_CACHES)
+class FlashSaleRedisTests(TestCase):
+
+    def setUp(self):
+        product = seed_dataset(products=1, reviews_per_product=0).products[0]
+        now = timezone.now()
+        self.sale = FlashSale.objects.create(name='Sale', start_time=now - timedelta(hours=1),
+                                             end_time=now + timedelta(hours=1))
+        self.item = FlashSaleItem.objects.create(flash_sale=self.sale, product=product, original_price=product.price,
+                                                 sale_price=Decimal('50.00'), stock_limit=3)
+        self.redis = fake_redis()
+        patcher = mock.patch('product.flash_sales.get_redis_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        load_flash_sale(self.sale)
+        self.entry = sale_item_entry(self.item, self.sale)
+
+    def sold(self):
+        return FlashSaleItem.all_objects.values_list('sold_quantity', flat=True).get(pk=self.item.pk)
+
+    def test_claims_stop_at_the_stock_limit(self):
+        self.assertTrue(claim_sale_quantity(self.entry, 2))
+        self.assertFalse(claim_sale_quantity(self.entry, 2))
+        self.assertTrue(claim_sale_quantity(self.entry, 1))
+        # sold out
+        self.assertFalse(claim_sale_quantity(self.entry, 1))
+        self.assertEqual(int(self.redis.get(REMAINING_KEY.format(self.item.pk))), 0)
+
+        self.assertEqual(reconcile_flash_sale_sold(), 1)
+        self.assertEqual(self.sold(), 3)
+
+    def test_concurrent_claims_never_oversell(self):
+        results = []
+
+        def claim():
+            results.append(claim_sale_quantity(self.entry, 1))
+
+        threads = [threading.Thread(target=claim) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 3)
+        reconcile_flash_sale_sold()
+        self.assertEqual(self.sold(), 3)
+
+    def test_quantities_left_by_a_dead_reconcile_are_recovered(self):
+        claim_sale_quantity(self.entry, 2)
+        # a reconcile that died after detaching the sold hash
+        take_redis_hash(self.redis, SOLD_KEY)
+        self.assertEqual(reconcile_flash_sale_sold(), 0)
+
+        claim_sale_quantity(self.entry, 1)
+        with mock.patch('oumraa.settings.REDIS_FLUSH_TIMEOUT', 0, create=True), \
+                self.assertLogs('utils.cache', 'WARNING'):
+            self.assertEqual(reconcile_flash_sale_sold(), 1)
+        self.assertEqual(self.sold(), 3)
+        self.assertEqual(self.redis.keys(f'{SOLD_KEY}:flushing:*'), [])
@@ -0,0 +1,149 @@
+"""
+Direct uploads to the bucket.
+
+``start_upload`` returns a presigned PUT url for a staged key together with a signed
+token describing the upload. The client PUTs the file straight to the bucket, then
+hands the token to ``complete_upload``, which checks the staged object and queues
+its processing (the same pipeline as the multipart uploads, see product.images).
+The files never go through the app servers and the token carries all the state, so
+any number of uploads can be in flight per product.
+"""
+import mimetypes
+import os
+import uuid
+
+from django.core import signing
+from django.db import transaction
+
+from oumraa import settings
+from oumraa.space_manager import DigitalOceanSpacesManager
+from product.images import create_pending_image
+from product.models import Product, Review, ReviewMedia
+from product.storage_gc import queue_storage_deletion
+
+UPLOAD_TOKEN_SALT = 'product.uploads'
+
+IMAGE_CONTENT_TYPES = ['image/jpeg', 'image/png', 'image/webp']
+VIDEO_CONTENT_TYPES = ['video/mp4', 'video/quicktime', 'video/webm']
+
+# purpose -> (staging folder, allowed content types, max size in bytes)
+UPLOAD_PURPOSES = {
+    'product_image': ('products/sources', IMAGE_CONTENT_TYPES, 10 * 1024 * 1024),
+    'review_media': ('reviews/sources', IMAGE_CONTENT_TYPES + VIDEO_CONTENT_TYPES, 50 * 1024 * 1024),
+}
+
+
+class UploadError(Exception):
+    pass
+
+
+def upload_expiry():
+    return getattr(settings, 'DIRECT_UPLOAD_EXPIRES', 900)
+
+
+def get_upload_target(user, purpose, target_id):
+    """The product or review the upload is for, the reviews must belong to ``user``"""
+    try:
+        if purpose == 'product_image':
+            return Product.objects.get(pk=target_id)
+        return Review.objects.get(pk=target_id, user=user)
+    except (Product.DoesNotExist, Review.DoesNotExist):
+        raise UploadError(f'{purpose} target {target_id} not found')
+
+
+def start_upload(user, purpose, target_id, filename, content_type, size):
+    """Presigned PUT url and token of a new staged upload"""
+    folder, content_types, max_size = UPLOAD_PURPOSES[purpose]
+    if content_type not in content_types:
+        raise UploadError(f'Invalid format, use one of {", ".join(content_types)}')
+    if size > max_size:
+        raise UploadError(f'File too large. Maximum {max_size // (1024 * 1024)}MB allowed.')
+    get_upload_target(user, purpose, target_id)
+
+    file_id = str(uuid.uuid4())
+    extension = os.path.splitext(filename)[1].lower() or mimetypes.guess_extension(content_type) or ''
+    key = f'{folder}/{file_id}{extension}'
+    url = DigitalOceanSpacesManager().get_signed_upload_url(key, expires_in=upload_expiry(), content_type=content_type)
+    if url is None:
+        raise UploadError('Could not sign the upload')
+
+    token = signing.dumps({
+        'user': str(user.pk), 'purpose': purpose, 'target': str(target_id), 'key': key, 'file_id': file_id,
+        'filename': filename, 'content_type': content_type,
+    }, salt=UPLOAD_TOKEN_SALT)
+    return {
+        'token': token,
+        'upload_url': url,
+        'method': 'PUT',
+        'headers': {'Content-Type': content_type},
+        'expires_in': upload_expiry(),
+    }
+
+
+def read_upload_token(user, token):
+    try:
+        # the upload may complete a little after the url expired
+        upload = signing.loads(token, salt=UPLOAD_TOKEN_SALT, max_age=upload_expiry() * 2)
+    except signing.BadSignature:
+        raise UploadError('Invalid or expired upload token')
+    if upload['user'] != str(user.pk):
+        raise UploadError('Invalid or expired upload token')
+    return upload
+
+
+def complete_upload(user, token, alt_text='', is_primary=False, sort_order=None):
+    """Record the staged object of ``token`` and queue its processing
+
+    Returns the pending ProductImage or ReviewMedia.
+    """
+    upload = read_upload_token(user, token)
+    target = get_upload_target(user, upload['purpose'], upload['target'])
+    manager = DigitalOceanSpacesManager()
+    max_size = UPLOAD_PURPOSES[upload['purpose']][2]
+
+    size = manager.object_size(upload['key'])
+    if size is None:
+        raise UploadError('The file was not uploaded')
+    if size > max_size:
+        queue_storage_deletion([upload['key']])
+        raise UploadError(f'File too large. Maximum {max_size // (1024 * 1024)}MB allowed.')
+
+    if upload['purpose'] == 'product_image':
+        return _complete_product_image(target, upload, size, alt_text, is_primary, sort_order)
+    return _complete_review_media(target, upload, manager)
+
+
+def _complete_product_image(product, upload, size, alt_text, is_primary, sort_order):
+    # hashed and deduplicated by the processing task, once the file is downloaded
+    source = {
+        'content_hash': '', 'file_id': upload['file_id'], 'source_key': upload['key'],
+        'original_filename': upload['filename'], 'file_size_bytes': size,
+    }
+    with transaction.atomic():
+        existing = product.images.filter(file_id=upload['file_id']).first()
+        if existing:
+            # the upload was completed already
+            return existing
+        image = create_pending_image(
+            product, source, alt_text=alt_text, is_primary=is_primary,
+            sort_order=product.images.count() if sort_order is None else sort_order,
+        )
+        if not image.is_primary and not product.images.filter(is_primary=True).exists():
+            image.make_primary()
+    return image
+
+
+def _complete_review_media(review, upload, manager):
+    media = ReviewMedia.objects.filter(review=review, file_key=upload['key']).first()
+    if media:
+        return media
+
+    is_image = upload['content_type'].startswith('image/')
+    media = ReviewMedia.objects.create(
+        review=review, media_type='image' if is_image else 'video', file_key=upload['key'],
+        file_url=manager.object_url(upload['key']), processing_status='pending' if is_image else 'ready',
+    )
+    if is_image:
+        from product.tasks import process_review_media_task
+        transaction.on_commit(lambda: process_review_media_task.delay(media.pk))
+    return media
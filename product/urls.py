@@ -11,4 +11,13 @@ router.register(r'review-product', ReviewProductViewSet, basename='review-produc
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('<str:product_id>/images/', upload_product_image, name='upload-product-image'),
+    path('<str:product_id>/images/order/', reorder_product_images, name='reorder-product-images'),
+    path('images/<str:image_id>/', delete_product_image, name='delete-product-image'),
+    path('images/<str:image_id>/primary/', set_primary_image, name='set-primary-image'),
+    path('images/<str:image_id>/status/', product_image_status, name='product-image-status'),
+    path('bulk-update/', bulk_update_products, name='bulk-update-products'),
+    path('bulk-update/<str:job_id>/', bulk_update_status, name='bulk-update-status'),
+    path('uploads/', start_direct_upload, name='start-direct-upload'),
+    path('uploads/complete/', complete_direct_upload, name='complete-direct-upload'),
 ]
\ No newline at end of file
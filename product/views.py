@@ -1,21 +1,32 @@
+from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.urls import reverse
 from django.views.generic import ListView
 from rest_framework import status, permissions, generics
-from rest_framework.decorators import permission_classes, api_view, action
+from rest_framework.decorators import permission_classes, api_view, action, parser_classes
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from product.bulk_update import BulkUpdateError, bulk_update_payload, start_bulk_update
+from product.helpers import primary_image_prefetch
+from product.images import ImageProcessingError, create_pending_image, discard_image_sources, \
+    retry_image_processing, upload_image_source
 from product.serializer import *
+from product.uploads import UploadError, complete_upload, start_upload
 from utils.base_viewset import BaseViewSetSetup
+from utils.cache import invalidate_cache_tags
 
 
 # Create your views here.
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser, FormParser])
 def upload_product_image(request, product_id):
-    """Upload and process product image"""
+    """Upload a product image, its size variants are generated in the background"""
     try:
         # Verify product exists and user has permission
         product = Product.objects.get(id=product_id)
@@ -43,83 +54,139 @@ def upload_product_image(request, product_id):
         return Response({'error': 'Invalid image format. Use JPEG, PNG or WebP.'},
                         status=status.HTTP_400_BAD_REQUEST)
 
-    # Process and upload image
-    do_manager = DigitalOceanSpacesManager()
-    result = do_manager.process_and_upload_image(image_file)
-
-    if not result['success']:
-        return Response({'error': result['error']}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    # Store the original only, the variants are generated by the process_product_image task
+    try:
+        source = upload_image_source(image_file)
+    except ImageProcessingError as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     # Create database record
     try:
-        product_image = ProductImage.objects.create(
-            product=product,
-            file_id=result['file_id'],
-            original_filename=result['original_filename'],
-            original_width=result['original_size'][0],
-            original_height=result['original_size'][1],
-
-            # URLs from CDN
-            thumbnail_url=result['results']['thumbnail_url'],
-            medium_url=result['results']['medium_url'],
-            large_url=result['results']['large_url'],
-            original_url=result['results']['original_url'],
-
-            # Storage keys
-            thumbnail_key=result['results']['thumbnail_key'],
-            medium_key=result['results']['medium_key'],
-            large_key=result['results']['large_key'],
-            original_key=result['results']['original_key'],
-
-            # Form data
-            alt_text=request.data.get('alt_text', ''),
-            is_primary=request.data.get('is_primary', False),
-            sort_order=request.data.get('sort_order',
-                                        product.images.count())  # Auto-increment sort order
-        )
+        with transaction.atomic():
+            product_image = create_pending_image(
+                product, source,
+                alt_text=request.data.get('alt_text', ''),
+                is_primary=request.data.get('is_primary', False),
+                sort_order=request.data.get('sort_order', product.images.count())  # Auto-increment sort order
+            )
 
-        # Handle primary image logic
-        if product_image.is_primary:
-            product_image.make_primary()
-        elif not product.images.filter(is_primary=True).exists():
             # Make this primary if no primary image exists
-            product_image.make_primary()
-
-        # Return success response
-        return Response({
-            'id': str(product_image.id),
-            'file_id': product_image.file_id,
-            'urls': {
-                'thumbnail': product_image.thumbnail_url,
-                'medium': product_image.medium_url,
-                'large': product_image.large_url,
-                'original': product_image.original_url,
-            },
-            'metadata': {
-                'original_filename': product_image.original_filename,
-                'width': product_image.original_width,
-                'height': product_image.original_height,
-                'is_primary': product_image.is_primary,
-                'alt_text': product_image.alt_text,
-            },
-            'responsive_srcset': product_image.responsive_srcset,
-            'created_at': product_image.created_at.isoformat()
-        }, status=status.HTTP_201_CREATED)
+            if not product_image.is_primary and not product.images.filter(is_primary=True).exists():
+                product_image.make_primary()
 
     except Exception as e:
-        # If database creation fails, clean up uploaded files
-        keys_to_delete = [
-            result['results']['thumbnail_key'],
-            result['results']['medium_key'],
-            result['results']['large_key'],
-            result['results']['original_key']
-        ]
-        do_manager.delete_image_variants(keys_to_delete)
+        # If database creation fails, clean up the uploaded file
+        discard_image_sources([source])
 
         return Response({
             'error': f'Failed to save image metadata: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    return Response(image_status_payload(product_image), status=status.HTTP_202_ACCEPTED)
+
+
+def image_status_payload(image):
+    payload = {
+        'id': str(image.id),
+        'file_id': image.file_id,
+        'processing_status': image.processing_status,
+        'processing_error': image.processing_error,
+        'status_url': reverse('product-image-status', kwargs={'image_id': str(image.id)}),
+        'metadata': {
+            'original_filename': image.original_filename,
+            'width': image.original_width,
+            'height': image.original_height,
+            'is_primary': image.is_primary,
+            'alt_text': image.alt_text,
+        },
+        'created_at': image.created_at.isoformat()
+    }
+    if image.is_ready:
+        payload['urls'] = {
+            'thumbnail': image.thumbnail_url,
+            'medium': image.medium_url,
+            'large': image.large_url,
+            'original': image.original_url,
+        }
+        payload['responsive_srcset'] = image.responsive_srcset
+        payload['format_srcsets'] = image.format_srcsets
+    return payload
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def start_direct_upload(request):
+    """Presigned url to PUT a product image or review media straight to the bucket"""
+    serializer = StartUploadSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    try:
+        upload = start_upload(request.user, **serializer.validated_data)
+    except UploadError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(upload, status=status.HTTP_201_CREATED)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def complete_direct_upload(request):
+    """Confirm a direct upload, its processing is queued"""
+    serializer = CompleteUploadSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    try:
+        uploaded = complete_upload(request.user, **serializer.validated_data)
+    except UploadError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if isinstance(uploaded, ProductImage):
+        return Response(image_status_payload(uploaded), status=status.HTTP_202_ACCEPTED)
+    return Response(ReviewMediaSerializer(uploaded).data, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def bulk_update_products(request):
+    """Change the prices, stock or flags of the filtered products, a dry run only previews it"""
+    serializer = BulkProductUpdateSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    job = BulkProductUpdate(created_by=request.user, **serializer.validated_data)
+    try:
+        preview = start_bulk_update(job)
+    except BulkUpdateError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if preview is not None:
+        return Response({**bulk_update_payload(job), 'preview': preview})
+    return Response(bulk_update_payload(job), status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def bulk_update_status(request, job_id):
+    """Progress of a bulk product update"""
+    job = BulkProductUpdate.objects.filter(pk=job_id).first()
+    if job is None:
+        return Response({'error': 'Bulk update not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(bulk_update_payload(job))
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def product_image_status(request, image_id):
+    """Poll the processing of an uploaded image, POST queues a failed one again"""
+    try:
+        image = ProductImage.objects.get(id=image_id)
+    except ProductImage.DoesNotExist:
+        return Response({'error': 'Image not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'POST':
+        if image.processing_status != 'failed':
+            return Response({'error': f'Image is {image.processing_status}, only failed images can be retried'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        retry_image_processing(image)
+        return Response(image_status_payload(image), status=status.HTTP_202_ACCEPTED)
+
+    return Response(image_status_payload(image))
+
 
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
@@ -132,17 +199,14 @@ def delete_product_image(request, image_id):
         # if hasattr(image.product, 'vendor') and image.product.vendor != request.user:
         #     return Response({'error': 'Permission denied'}, status=403)
 
-        # If deleting primary image, make another image primary
-        if image.is_primary:
-            next_image = ProductImage.objects.filter(
-                product=image.product
-            ).exclude(id=image.id).first()
-
-            if next_image:
-                next_image.make_primary()
+        with transaction.atomic():
+            # Delete (this will also queue the DO Spaces files for deletion)
+            image.delete()
 
-        # Delete (this will also clean up DO Spaces files)
-        image.delete()
+            # If deleting primary image, make another image primary
+            if image.is_primary:
+                ProductImage.promote_next_primary(image.product_id)
+        invalidate_cache_tags(f'product:{image.product_id}', source='product_image')
 
         return Response({
             'message': 'Image deleted successfully'
@@ -178,6 +242,7 @@ def get_product_images(request, product_id):
                     'height': img.original_height,
                 },
                 'responsive_srcset': img.responsive_srcset,
+                'format_srcsets': img.format_srcsets,
                 'created_at': img.created_at.isoformat()
             })
 
@@ -194,7 +259,12 @@ def get_product_images(request, product_id):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def reorder_product_images(request, product_id):
-    """Reorder product images"""
+    """Reorder product images
+
+    ``images`` is the full ordering as a list of image ids, or a list of
+    ``{'id': ..., 'sort_order': ...}``; ``primary_image_id`` optionally switches the
+    primary image in the same transaction.
+    """
     try:
         product = Product.objects.get(id=product_id)
         image_orders = request.data.get('images', [])
@@ -202,12 +272,18 @@ def reorder_product_images(request, product_id):
         if not image_orders:
             return Response({'error': 'No image order provided'}, status=400)
 
-        ProductImage.reorder_images(product, image_orders)
+        if all(isinstance(item, str) for item in image_orders):
+            image_orders = [{'id': image_id, 'sort_order': index} for index, image_id in enumerate(image_orders)]
+        reordered = ProductImage.reorder_images(product, image_orders, request.data.get('primary_image_id'))
 
-        return Response({'message': 'Images reordered successfully'})
+        return Response({'message': 'Images reordered successfully', 'reordered': reordered})
 
     except Product.DoesNotExist:
         return Response({'error': 'Product not found'}, status=404)
+    except ProductImage.DoesNotExist as e:
+        return Response({'error': str(e)}, status=400)
+    except (KeyError, TypeError, ValueError, ValidationError) as e:
+        return Response({'error': f'Invalid image order: {e}'}, status=400)
 
 
 @api_view(['POST'])
@@ -235,24 +311,28 @@ class AdminProductCreateAPIView(APIView):
 
     def post(self, request):
         """Create a new product with images"""
+        # Separate image files from other data
+        images = request.FILES.getlist('images', [])
+        image_metadata = self._parse_image_metadata(request.data)
+
+        # Remove image-related data from product data
+        product_data = request.data.copy()
+        self._clean_image_data_from_product_data(product_data)
+
+        # Validate product data
+        serializer = ProductCreateSerializer(data=product_data)
+        if not serializer.is_valid():
+            return Response({
+                'error': 'Validation failed',
+                'details': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Store the originals before the transaction opens, no row is locked while they upload.
+        # The size variants are generated by the process_product_image task
+        image_results, sources = self._upload_image_sources(images)
+
         try:
             with transaction.atomic():
-                # Separate image files from other data
-                images = request.FILES.getlist('images', [])
-                image_metadata = self._parse_image_metadata(request.data)
-
-                # Remove image-related data from product data
-                product_data = request.data.copy()
-                self._clean_image_data_from_product_data(product_data)
-
-                # Validate product data
-                serializer = ProductCreateSerializer(data=product_data)
-                if not serializer.is_valid():
-                    return Response({
-                        'error': 'Validation failed',
-                        'details': serializer.errors
-                    }, status=status.HTTP_400_BAD_REQUEST)
-
                 # Create product
                 product = self._create_product(serializer.validated_data)
 
@@ -260,30 +340,30 @@ class AdminProductCreateAPIView(APIView):
                 if serializer.validated_data.get('variants'):
                     self._create_product_variants(product, serializer.validated_data['variants'])
 
-                # Upload and create images
-                image_results = []
-                if images:
-                    image_results = self._process_product_images(product, images, image_metadata)
+                # Create the pending images
+                if sources:
+                    self._create_product_images(product, sources, image_metadata, image_results)
 
                 # Apply taxes
                 if serializer.validated_data.get('tax_rate_ids'):
                     self._apply_product_taxes(product, serializer.validated_data['tax_rate_ids'])
 
-                # Return success response
-                response_serializer = ProductResponseSerializer(product)
-                return Response({
-                    'message': 'Product created successfully',
-                    'product': response_serializer.data,
-                    'images_uploaded': len(image_results),
-                    'image_upload_results': image_results
-                }, status=status.HTTP_201_CREATED)
-
         except Exception as e:
+            discard_image_sources([source for _, source in sources])
             return Response({
                 'error': 'Product creation failed',
                 'details': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        # Return success response
+        response_serializer = ProductResponseSerializer(product)
+        return Response({
+            'message': 'Product created successfully',
+            'product': response_serializer.data,
+            'images_uploaded': len(sources),
+            'image_upload_results': image_results
+        }, status=status.HTTP_201_CREATED)
+
     def _parse_image_metadata(self, data):
         """Parse image metadata from form data"""
         metadata = []
@@ -383,16 +463,13 @@ class AdminProductCreateAPIView(APIView):
                     except (ProductAttribute.DoesNotExist, ProductAttributeValue.DoesNotExist):
                         continue
 
-    def _process_product_images(self, product, images, metadata):
-        """Process and upload product images"""
+    def _upload_image_sources(self, images):
+        """Upload the original of every valid image, returns the results and ``(index, source)`` pairs"""
         do_manager = DigitalOceanSpacesManager()
         upload_results = []
-        primary_set = False
+        sources = []
 
         for i, image_file in enumerate(images):
-            # Get metadata for this image
-            img_metadata = metadata[i] if i < len(metadata) else {}
-
             # Validate image
             if not self._validate_image_file(image_file):
                 upload_results.append({
@@ -403,78 +480,51 @@ class AdminProductCreateAPIView(APIView):
                 })
                 continue
 
-            # Upload image
-            upload_result = do_manager.process_and_upload_image(image_file)
-
-            if upload_result['success']:
-                # Determine if this should be primary
-                is_primary = img_metadata.get('is_primary', False)
-                if not primary_set and (is_primary or i == 0):
-                    is_primary = True
-                    primary_set = True
-                elif primary_set and is_primary:
-                    is_primary = False  # Only one primary image allowed
-
-                # Create database record
-                try:
-                    product_image = ProductImage.objects.create(
-                        product=product,
-                        file_id=upload_result['file_id'],
-                        original_filename=upload_result['original_filename'],
-                        original_width=upload_result['original_size'][0],
-                        original_height=upload_result['original_size'][1],
-                        thumbnail_url=upload_result['results']['thumbnail_url'],
-                        medium_url=upload_result['results']['medium_url'],
-                        large_url=upload_result['results']['large_url'],
-                        original_url=upload_result['results']['original_url'],
-                        thumbnail_key=upload_result['results']['thumbnail_key'],
-                        medium_key=upload_result['results']['medium_key'],
-                        large_key=upload_result['results']['large_key'],
-                        original_key=upload_result['results']['original_key'],
-                        alt_text=img_metadata.get('alt_text', ''),
-                        is_primary=is_primary,
-                        sort_order=img_metadata.get('sort_order', i)
-                    )
-
-                    upload_results.append({
-                        'index': i,
-                        'filename': image_file.name,
-                        'success': True,
-                        'image_id': str(product_image.id),
-                        'is_primary': is_primary,
-                        'urls': {
-                            'thumbnail': product_image.thumbnail_url,
-                            'medium': product_image.medium_url,
-                            'large': product_image.large_url,
-                            'original': product_image.original_url
-                        }
-                    })
-
-                except Exception as e:
-                    # Clean up uploaded files if database save fails
-                    keys_to_delete = [
-                        upload_result['results']['thumbnail_key'],
-                        upload_result['results']['medium_key'],
-                        upload_result['results']['large_key'],
-                        upload_result['results']['original_key']
-                    ]
-                    do_manager.delete_image_variants(keys_to_delete)
-
-                    upload_results.append({
-                        'index': i,
-                        'filename': image_file.name,
-                        'success': False,
-                        'error': f'Database save failed: {str(e)}'
-                    })
-            else:
+            try:
+                sources.append((i, upload_image_source(image_file, manager=do_manager)))
+            except ImageProcessingError as e:
                 upload_results.append({
                     'index': i,
                     'filename': image_file.name,
                     'success': False,
-                    'error': upload_result['error']
+                    'error': str(e)
                 })
 
-        return upload_results
+        return upload_results, sources
+
+    def _create_product_images(self, product, sources, metadata, upload_results):
+        """Create the pending images of the uploaded sources"""
+        primary_set = False
+
+        for i, source in sources:
+            # Get metadata for this image
+            img_metadata = metadata[i] if i < len(metadata) else {}
+
+            # Determine if this should be primary
+            is_primary = img_metadata.get('is_primary', False)
+            if not primary_set and (is_primary or i == 0):
+                is_primary = True
+                primary_set = True
+            elif primary_set and is_primary:
+                is_primary = False  # Only one primary image allowed
+
+            product_image = create_pending_image(
+                product, source,
+                alt_text=img_metadata.get('alt_text', ''),
+                is_primary=is_primary,
+                sort_order=img_metadata.get('sort_order', i)
+            )
+
+            upload_results.append({
+                'index': i,
+                'filename': source['original_filename'],
+                'success': True,
+                'image_id': str(product_image.id),
+                'is_primary': is_primary,
+                'processing_status': product_image.processing_status,
+            })
+
+        upload_results.sort(key=lambda result: result['index'])
 
     def _validate_image_file(self, image_file):
         """Validate uploaded image file"""
@@ -587,7 +637,8 @@ class WishListViewSet(BaseViewSetSetup):
     }
 
     def get_queryset(self):
-        return Wishlist.active_objects.filter(user=self.request.user)
+        return Wishlist.active_objects.filter(user=self.request.user).select_related(
+            'product__rating_summary').prefetch_related(primary_image_prefetch('product__images'))
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -610,7 +661,8 @@ class OrderItemViewSet(BaseViewSetSetup):
     }
 
     def get_queryset(self):
-        return Wishlist.active_objects.filter(user=self.request.user)
+        return Wishlist.active_objects.filter(user=self.request.user).select_related(
+            'product__rating_summary').prefetch_related(primary_image_prefetch('product__images'))
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -1,11 +1,137 @@
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import ValidationError
+
+from oumraa import settings
+from utils.pagination import KeysetPagination
 
 # Register your models here.
 
 EXCLUDE_FOR_API = ('date_created', 'date_updated')
 
+CURSOR_VAR = 'cursor'
+KEYSET_ORDERING = '-created_at'
+
+
+def estimated_row_count(model, using='default'):
+    """The planner's row estimate for the table of ``model``, None where the database keeps none"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)',
+                           [connection.ops.quote_name(table)])
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    # -1 on a table postgres never analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that doesn't count(*) the big tables
+
+    Tables under ADMIN_ESTIMATED_COUNT_THRESHOLD rows (by the planner's estimate) are
+    counted exactly. On bigger ones the changelist is counted up to the threshold, and
+    when there are more rows than that the table estimate is shown instead.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+        threshold = getattr(settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 100000)
+        estimate = estimated_row_count(queryset.model, queryset.db)
+        if estimate is None or estimate < threshold:
+            return super().count
+        capped = queryset.order_by()[:threshold].count()
+        return capped if capped < threshold else max(estimate, threshold)
+
+
+class KeysetChangeList(ChangeList):
+    """Changelist with a "show more" link that continues after the last row shown
+
+    The page links use OFFSET, which gets slower the deeper the page. When the list is
+    in the default newest first order, the last row of every page is also encoded in
+    a ``cursor`` param and the following rows are read with a keyset range instead.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        self.show_more_url = None
+        if self.cursor is not None:
+            # not a filter of the list
+            request.GET = request.GET.copy()
+            del request.GET[CURSOR_VAR]
+        super().__init__(request, *args, **kwargs)
+
+    def keyset_enabled(self, request):
+        # the editable lists need a queryset of the page
+        return not self.list_editable and ORDER_VAR not in self.params and \
+            self.get_ordering(request, self.queryset)[:1] == [KEYSET_ORDERING]
+
+    def get_results(self, request):
+        if not self.keyset_enabled(request):
+            return super().get_results(request)
+
+        pagination = KeysetPagination()
+        if self.cursor is None:
+            super().get_results(request)
+            page = list(self.result_list)
+            next_cursor = None
+            if len(page) == self.list_per_page and self.multi_page and not self.show_all:
+                last = page[-1]
+                next_cursor = pagination.encode_cursor(KEYSET_ORDERING, last.created_at.isoformat(), str(last.pk))
+        else:
+            try:
+                if pagination.decode_cursor(self.cursor)[0] != KEYSET_ORDERING:
+                    raise IncorrectLookupParameters
+                page, next_cursor = pagination.paginate(self.queryset, KEYSET_ORDERING, self.cursor,
+                                                        self.list_per_page)
+            except ValidationError:
+                raise IncorrectLookupParameters
+            self.result_count = self.model_admin.get_paginator(request, self.queryset, self.list_per_page).count
+            self.show_full_result_count = self.model_admin.show_full_result_count
+            self.full_result_count = None
+            self.show_admin_actions = True
+            # page numbers mean nothing past a cursor
+            self.can_show_all = False
+            self.multi_page = False
+            self.result_list = page
+
+        if next_cursor:
+            self.show_more_url = self.get_query_string({CURSOR_VAR: next_cursor})
+
 
 class CustomModelAdminMixin(object):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
     def __init__(self, model, admin_site):
         self.list_display = [field.name for field in model._meta.fields if field.name not in EXCLUDE_FOR_API]
-        super(CustomModelAdminMixin, self).__init__(model, admin_site)
\ No newline at end of file
+        if not self.list_select_related:
+            # one join per foreign key column instead of a query per row
+            self.list_select_related = [
+                field.name for field in model._meta.fields if field.is_relation and field.name in self.list_display
+            ] or self.list_select_related
+        super(CustomModelAdminMixin, self).__init__(model, admin_site)
+
+    def get_ordering(self, request):
+        # newest first unless the admin or the model say otherwise, the order "show more" can follow
+        if self.ordering or self.model._meta.ordering or not hasattr(self.model, 'created_at'):
+            return super().get_ordering(request)
+        return [KEYSET_ORDERING]
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class UtilsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'utils'
+
+    def ready(self):
+        from django.conf import settings
+
+        if 'utils.middleware.QueryBudgetMiddleware' in settings.MIDDLEWARE:
+            from utils.profiling import instrument_serializers
+            instrument_serializers()
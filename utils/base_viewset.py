@@ -2,6 +2,8 @@ import re
 
 from rest_framework import response, status, viewsets, permissions
 
+from utils.pagination import KeysetPagination
+
 
 class BaseViewSetSetup(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticated,)
@@ -75,10 +77,18 @@ class BaseViewSetSetup(viewsets.ModelViewSet):
         return response.Response(res, status=status.HTTP_201_CREATED)
 
     def list_action_paginated_response(self, queryset, serializer_context=None, serializer_class=None):
+        # paginate=0: no pagination, paginate=1: default (limit/offset) pagination,
+        # paginate=2: keyset pagination driven by the 'cursor', 'ordering' and 'page_size' params
         paginate = self.request.GET.get('paginate', '0')
-        if not re.match("^[0-1]$", paginate):
+        if not re.match("^[0-2]$", paginate):
             return response.Response({'detail': 'Invalid paginate value.'}, status=status.HTTP_400_BAD_REQUEST)
         ctx = serializer_context if serializer_context else {}
+        if paginate == '2':
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(queryset, self.request, view=self)
+            serializer = serializer_class(page, many=True, context=ctx) if serializer_class else \
+                self.get_serializer(page, many=True, context=ctx)
+            return paginator.get_paginated_response(serializer.data)
         if paginate == '1':
             page = self.paginate_queryset(queryset)
             if page is not None:
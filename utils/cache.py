@@ -0,0 +1,362 @@
+"""
+Tag based invalidation and read-through helpers for the shared Django cache.
+
+Every cached payload registers the entities it was built from as tags
+(``product:<id>``, ``category:<id>``, ``brands`` ...). Model writes invalidate
+only the keys registered under the tags they touch instead of flushing the
+whole cache database. Inside a transaction the invalidation waits for the commit,
+otherwise a concurrent rebuild could cache the rows as they were before it.
+
+``cached_read_through`` wraps the cache.get / rebuild / cache.set pattern with a
+per-key rebuild lock (only one worker rebuilds a missing payload) and a soft TTL
+(expired payloads are served stale while a single worker refreshes them).
+"""
+import contextvars
+import importlib
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import transaction
+
+from oumraa import settings
+from utils.profiling import record_cache_access
+
+logger = logging.getLogger(__name__)
+
+TAG_KEY_PREFIX = 'cache_tag'
+STATS_KEY_PREFIX = 'cache_invalidation'
+
+# source -> tags, collected while defer_cache_invalidation is active
+_deferred_tags = contextvars.ContextVar('deferred_cache_tags', default=None)
+
+
+def get_redis_client():
+    """Return the raw redis client behind the default cache, if there is one"""
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+# KEYS[1] hash, KEYS[2] flushing key, KEYS[3] detached set; ARGV[1] time. EXISTS and RENAME
+# in one step, of two overlapping flushes the second one finds nothing to take
+TAKE_HASH_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('ZADD', KEYS[3], ARGV[1], KEYS[2])
+return 1
+"""
+
+# KEYS[1] hash, KEYS[2] flushing key, KEYS[3] detached set: adds a detached hash back,
+# unless it was applied or recovered already
+RECOVER_HASH_SCRIPT = """
+if redis.call('ZREM', KEYS[3], KEYS[2]) == 0 then
+    return 0
+end
+local values = redis.call('HGETALL', KEYS[2])
+for i = 1, #values, 2 do
+    redis.call('HINCRBY', KEYS[1], values[i], values[i + 1])
+end
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+
+def _detached_key(key):
+    return f'{key}:flushing'
+
+
+def take_redis_hash(redis, key):
+    """Atomically detach the hash at ``key`` so new increments start a fresh one
+
+    Returns ``(flushing_key, values)``. Drop ``flushing_key`` with ``drop_redis_hash``
+    once the values are applied, or give them back with ``restore_redis_hash``. The
+    hashes a dead flush left detached are given back first, see ``recover_redis_hashes``.
+    """
+    recover_redis_hashes(redis, key)
+    flushing_key = f'{key}:flushing:{uuid.uuid4().hex}'
+    taken = redis.register_script(TAKE_HASH_SCRIPT)(keys=[key, flushing_key, _detached_key(key)], args=[time.time()])
+    if not taken:
+        return flushing_key, {}
+    return flushing_key, {
+        (field.decode() if isinstance(field, bytes) else field): int(value)
+        for field, value in redis.hgetall(flushing_key).items()
+    }
+
+
+def drop_redis_hash(redis, key, flushing_key):
+    """Forget a detached hash whose values were applied"""
+    pipe = redis.pipeline()
+    pipe.delete(flushing_key)
+    pipe.zrem(_detached_key(key), flushing_key)
+    pipe.execute()
+
+
+def restore_redis_hash(redis, key, flushing_key, values):
+    """Add the detached ``values`` back to ``key``, merging with the increments made since"""
+    pipe = redis.pipeline()
+    for field, value in values.items():
+        pipe.hincrby(key, field, value)
+    pipe.delete(flushing_key)
+    pipe.zrem(_detached_key(key), flushing_key)
+    pipe.execute()
+
+
+def recover_redis_hashes(redis, key, older_than=None):
+    """Give the hashes detached from ``key`` more than ``older_than`` seconds ago back to it
+
+    A flush that died between taking and applying its hash would lose those values. A
+    flush that died after its database commit but before dropping the hash has them
+    counted twice, the window is a single redis call.
+    """
+    if older_than is None:
+        older_than = getattr(settings, 'REDIS_FLUSH_TIMEOUT', 10 * 60)
+    detached = redis.zrangebyscore(_detached_key(key), '-inf', time.time() - older_than)
+    recover = redis.register_script(RECOVER_HASH_SCRIPT)
+    recovered = 0
+    for flushing_key in detached:
+        flushing_key = flushing_key.decode() if isinstance(flushing_key, bytes) else flushing_key
+        if recover(keys=[key, flushing_key, _detached_key(key)]):
+            logger.warning('Recovered %s, left detached by a flush that did not finish', flushing_key)
+            recovered += 1
+    return recovered
+
+
+def _tag_key(tag):
+    return f'{TAG_KEY_PREFIX}:{tag}'
+
+
+def _tag_timeout(timeout):
+    tag_timeout = getattr(settings, 'CACHE_TAG_TIMEOUT', 60 * 60 * 24)
+    if timeout is None:
+        return None
+    return max(timeout, tag_timeout)
+
+
+def tag_cache_key(key, tags, timeout=None):
+    """Register ``key`` under each tag so it can be invalidated later"""
+    tags = {str(tag) for tag in tags if tag}
+    if not tags:
+        return
+
+    tag_timeout = _tag_timeout(timeout)
+    redis = get_redis_client()
+    if redis is not None:
+        pipe = redis.pipeline(transaction=False)
+        for tag in tags:
+            tag_key = cache.make_key(_tag_key(tag))
+            pipe.sadd(tag_key, key)
+            if tag_timeout:
+                pipe.expire(tag_key, tag_timeout)
+        pipe.execute()
+        return
+
+    # Non redis backends (local memory in tests/dev) keep the key sets as plain values
+    for tag in tags:
+        keys = cache.get(_tag_key(tag)) or set()
+        keys.add(key)
+        cache.set(_tag_key(tag), keys, tag_timeout)
+
+
+def set_tagged_cache(key, value, timeout, tags):
+    """cache.set() that also records the entities the payload depends on"""
+    tag_cache_key(key, tags, timeout)
+    cache.set(key, value, timeout)
+
+
+def invalidate_cache_tags(*tags, source=None):
+    """Delete every cached key registered under any of ``tags``
+
+    Returns the number of keys that were invalidated, 0 when it waits for the
+    commit of the current transaction.
+    """
+    tags = {str(tag) for tag in tags if tag}
+    if not tags:
+        return 0
+
+    deferred = _deferred_tags.get()
+    if deferred is not None:
+        deferred.setdefault(source, set()).update(tags)
+        return 0
+
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _invalidate_tags(tags, source))
+        return 0
+    return _invalidate_tags(tags, source)
+
+
+def _invalidate_tags(tags, source):
+    keys = set()
+    redis = get_redis_client()
+    if redis is not None:
+        tag_keys = [cache.make_key(_tag_key(tag)) for tag in tags]
+        pipe = redis.pipeline()
+        for tag_key in tag_keys:
+            pipe.smembers(tag_key)
+        pipe.delete(*tag_keys)
+        results = pipe.execute()
+        for members in results[:-1]:
+            keys.update(member.decode() if isinstance(member, bytes) else member for member in members)
+    else:
+        for tag in tags:
+            keys.update(cache.get(_tag_key(tag)) or ())
+        cache.delete_many([_tag_key(tag) for tag in tags])
+
+    if keys:
+        cache.delete_many(list(keys))
+
+    _record_invalidation(source, tags, len(keys))
+    return len(keys)
+
+
+@contextmanager
+def defer_cache_invalidation():
+    """Collect the invalidations of the block and run them once when it exits
+
+    For bulk writes: every saved row would otherwise invalidate its tags one by one.
+    """
+    if _deferred_tags.get() is not None:
+        # already deferred by an outer block
+        yield
+        return
+
+    deferred = {}
+    token = _deferred_tags.set(deferred)
+    try:
+        yield
+    finally:
+        _deferred_tags.reset(token)
+        for source, tags in deferred.items():
+            invalidate_cache_tags(*tags, source=source)
+
+
+def _increment_counter(key, delta):
+    if cache.add(key, delta, None):
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, None)
+
+
+def _record_invalidation(source, tags, keys_count):
+    source = source or 'unknown'
+    logger.info('Cache invalidation from %s removed %s keys (tags: %s)', source, keys_count, ', '.join(sorted(tags)))
+    _increment_counter(f'{STATS_KEY_PREFIX}:writes:{source}', 1)
+    _increment_counter(f'{STATS_KEY_PREFIX}:keys:{source}', keys_count)
+    _increment_counter(f'{STATS_KEY_PREFIX}:keys:total', keys_count)
+
+
+def get_invalidation_stats(sources=()):
+    """Return invalidation counters, overall and for the given write sources
+
+    >>> get_invalidation_stats(['product'])
+    {'total_keys': 120, 'product': {'writes': 4, 'keys': 31}}
+    """
+    keys = [f'{STATS_KEY_PREFIX}:keys:total']
+    for source in sources:
+        keys.extend([f'{STATS_KEY_PREFIX}:writes:{source}', f'{STATS_KEY_PREFIX}:keys:{source}'])
+    values = cache.get_many(keys)
+
+    stats = {'total_keys': values.get(f'{STATS_KEY_PREFIX}:keys:total', 0)}
+    for source in sources:
+        stats[source] = {
+            'writes': values.get(f'{STATS_KEY_PREFIX}:writes:{source}', 0),
+            'keys': values.get(f'{STATS_KEY_PREFIX}:keys:{source}', 0),
+        }
+    return stats
+
+
+def _rebuild_lock_key(key):
+    return f'{key}:rebuild_lock'
+
+
+def _builder_path(builder):
+    return f'{builder.__module__}:{builder.__qualname__}'
+
+
+def resolve_cache_builder(path):
+    """Import a builder from the ``module:Qualified.name`` path used by background refreshes"""
+    module_path, qualname = path.split(':')
+    builder = importlib.import_module(module_path)
+    for attr in qualname.split('.'):
+        builder = getattr(builder, attr)
+    return builder
+
+
+def rebuild_cached_payload(key, builder, timeout, builder_kwargs=None):
+    """Build a payload and store it with its soft expiry and tags
+
+    ``builder(**builder_kwargs)`` must return a ``(payload, tags)`` tuple.
+    """
+    payload, tags = builder(**(builder_kwargs or {}))
+    stale_timeout = getattr(settings, 'CACHE_STALE_TIMEOUT', 300)
+    envelope = {'payload': payload, 'fresh_until': time.time() + timeout}
+    set_tagged_cache(key, envelope, timeout + stale_timeout, tags)
+    return payload
+
+
+def _refresh_stale(key, builder, timeout, builder_kwargs):
+    """Refresh a stale payload, in a celery worker when background refresh is enabled
+
+    Returns the fresh payload when it was rebuilt in this process, None otherwise.
+    """
+    if getattr(settings, 'CACHE_BACKGROUND_REFRESH', False):
+        from utils.tasks import refresh_cached_payload
+        try:
+            refresh_cached_payload.delay(key, _builder_path(builder), timeout, builder_kwargs)
+            return None
+        except Exception as e:
+            logger.warning('Background refresh of %s could not be queued: %s', key, e)
+
+    try:
+        return rebuild_cached_payload(key, builder, timeout, builder_kwargs)
+    finally:
+        cache.delete(_rebuild_lock_key(key))
+
+
+def cached_read_through(key, builder, timeout, builder_kwargs=None):
+    """Return the cached payload for ``key``, building it with ``builder`` when needed
+
+    - fresh hit: returned as is
+    - stale hit: returned as is, one worker (holding the rebuild lock) refreshes it
+    - miss: one worker rebuilds it, concurrent requests wait for that result
+      instead of all running the same queries
+
+    ``builder`` must be a module level function or a staticmethod so that it can be
+    resolved again by a celery worker; ``builder_kwargs`` must be json serializable.
+    """
+    lock_key = _rebuild_lock_key(key)
+    lock_timeout = getattr(settings, 'CACHE_REBUILD_LOCK_TIMEOUT', 30)
+
+    envelope = cache.get(key)
+    record_cache_access(envelope is not None)
+    if envelope is not None:
+        if envelope['fresh_until'] <= time.time() and cache.add(lock_key, 1, lock_timeout):
+            payload = _refresh_stale(key, builder, timeout, builder_kwargs)
+            if payload is not None:
+                return payload
+        return envelope['payload']
+
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            return rebuild_cached_payload(key, builder, timeout, builder_kwargs)
+        finally:
+            cache.delete(lock_key)
+
+    # Another worker is rebuilding this key, wait for its result
+    deadline = time.monotonic() + getattr(settings, 'CACHE_REBUILD_WAIT', 5)
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        envelope = cache.get(key)
+        if envelope is not None:
+            return envelope['payload']
+
+    logger.warning('Timed out waiting for the rebuild of %s, building it in this request', key)
+    return rebuild_cached_payload(key, builder, timeout, builder_kwargs)
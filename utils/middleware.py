@@ -0,0 +1,76 @@
+import json
+import logging
+
+from oumraa import settings
+from utils.profiling import QueryBudgetExceeded, collect_request_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetMiddleware:
+    """Measure every request and enforce the per view query budgets
+
+    The counters are returned in the ``Server-Timing`` header and logged as one json
+    line per request. Budgets are configured by url name (or view path):
+
+    QUERY_BUDGETS = {'get-product': 10, 'web.views.GetProductDetailView': 15}
+    QUERY_BUDGET_DEFAULT = None         # budget of the views not listed, None to disable
+    QUERY_BUDGET_ACTION = 'log'         # 'log' or 'raise'
+
+    The body of a streaming response is produced after the view returned, so it is
+    measured while the server consumes it: the json line is logged and the budget is
+    checked once the stream is exhausted (or closed). The Server-Timing header is sent
+    before the body and only covers the view. A streamed response is already being
+    sent when it goes over budget, so it is logged even when the action is 'raise'.
+    Async streams are not measured, their queries run in other threads.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect_request_metrics() as metrics:
+            response = self.get_response(request)
+
+        response['Server-Timing'] = metrics.server_timing()
+        if response.streaming and not response.is_async:
+            response.streaming_content = self.measure_stream(response.streaming_content, request, response, metrics)
+        else:
+            self.report(request, response, metrics)
+        return response
+
+    def measure_stream(self, content, request, response, metrics):
+        try:
+            with collect_request_metrics(metrics):
+                yield from content
+        finally:
+            self.report(request, response, metrics, streamed=True)
+
+    def report(self, request, response, metrics, streamed=False):
+        match = request.resolver_match
+        view_name = match.view_name if match else None
+        data = {
+            'method': request.method,
+            'path': request.path,
+            'view': view_name,
+            'status': response.status_code,
+            **metrics.as_dict(),
+        }
+        logger.info(json.dumps(data))
+
+        budget = self.get_budget(match)
+        if budget is not None and metrics.queries > budget:
+            message = f'{view_name or request.path} issued {metrics.queries} queries, budget is {budget}'
+            if not streamed and getattr(settings, 'QUERY_BUDGET_ACTION', 'log') == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+    @staticmethod
+    def get_budget(match):
+        budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        default = getattr(settings, 'QUERY_BUDGET_DEFAULT', None)
+        if match is None:
+            return default
+        if match.view_name in budgets:
+            return budgets[match.view_name]
+        return budgets.get(match._func_path, default)
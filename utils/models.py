@@ -1,8 +1,8 @@
 import uuid
 
-from django.core.cache import cache
 from django.db import models
 
+from utils.cache import invalidate_cache_tags
 from utils.choices import STATUS_TYPE
 
 
@@ -207,11 +207,11 @@ class Banner(ModelMixin):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        cache.clear()
+        invalidate_cache_tags('banners', source='banner')
 
     def delete(self, *args, **kwargs):
         super().delete(*args, **kwargs)
-        cache.clear()
+        invalidate_cache_tags('banners', source='banner')
 
 
 class EmailTemplate(ModelMixin):
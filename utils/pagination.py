@@ -0,0 +1,141 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are fetched with ``WHERE (field, id) > (last_value, last_id) ORDER BY field, id``
+so every page costs the same index range scan no matter how deep the client is,
+unlike OFFSET which has to walk every skipped row. Cursors are opaque base64 tokens
+that carry the ordering they were issued for.
+"""
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework import pagination, response
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import replace_query_param
+
+from oumraa import settings
+
+
+class KeysetPagination(pagination.BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+    # every field listed here must be backed by an index ending with the primary key
+    ordering_fields = ('id', 'price', 'created_at')
+    default_ordering = 'id'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'KEYSET_PAGE_SIZE', settings.REST_FRAMEWORK.get('PAGE_SIZE', 10))
+        self.max_page_size = getattr(settings, 'KEYSET_MAX_PAGE_SIZE', 100)
+        self.next_cursor = None
+        self.request = None
+
+    @staticmethod
+    def encode_cursor(ordering, value, pk):
+        payload = json.dumps({'o': ordering, 'v': value, 'id': pk}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor, model=None):
+        """``(ordering, value, pk)`` of ``cursor``, the value and pk converted to the field types of ``model``"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            ordering, value, pk = data['o'], data['v'], data['id']
+            if model is not None:
+                value = model._meta.get_field(ordering.lstrip('-')).to_python(value)
+                pk = model._meta.pk.to_python(pk)
+            return ordering, value, pk
+        except (ValueError, TypeError, KeyError, AttributeError, FieldDoesNotExist, DjangoValidationError):
+            raise ValidationError({'cursor': 'Invalid cursor.'})
+
+    def get_ordering_fields(self, queryset):
+        concrete_fields = {field.name for field in queryset.model._meta.concrete_fields}
+        return [field for field in self.ordering_fields if field in concrete_fields]
+
+    def get_page_params(self, params, queryset=None):
+        """Validate the cursor, page size and ordering query params
+
+        Returns a json serializable ``(ordering, cursor, page_size)`` tuple so that
+        the params can be part of a cache key / cache builder kwargs.
+        """
+        ordering = params.get(self.ordering_query_param) or self.default_ordering
+        allowed = self.get_ordering_fields(queryset) if queryset is not None else self.ordering_fields
+        if ordering.lstrip('-') not in allowed:
+            raise ValidationError({'ordering': f'Ordering must be one of: {", ".join(allowed)}.'})
+
+        try:
+            page_size = int(params.get(self.page_size_query_param) or self.page_size)
+        except ValueError:
+            raise ValidationError({'page_size': 'A valid integer is required.'})
+        page_size = max(1, min(page_size, self.max_page_size))
+
+        cursor = params.get(self.cursor_query_param) or None
+        model = queryset.model if queryset is not None else None
+        if cursor and self.decode_cursor(cursor, model)[0] != ordering:
+            raise ValidationError({'cursor': 'Cursor does not match the requested ordering.'})
+        return ordering, cursor, page_size
+
+    def paginate(self, queryset, ordering, cursor=None, page_size=None):
+        """Return ``(page, next_cursor)`` for the page following ``cursor``"""
+        page_size = page_size or self.page_size
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+
+        if field == 'id':
+            order_by = [ordering]
+        else:
+            order_by = [ordering, '-id' if descending else 'id']
+        queryset = queryset.order_by(*order_by)
+
+        if cursor:
+            _, value, pk = self.decode_cursor(cursor, queryset.model)
+            lookup = 'lt' if descending else 'gt'
+            if field == 'id':
+                queryset = queryset.filter(**{f'id__{lookup}': pk})
+            else:
+                queryset = queryset.filter(Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'id__{lookup}': pk}))
+
+        page = list(queryset[:page_size + 1])
+        next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            last = page[-1]
+            next_cursor = self.encode_cursor(ordering, self._cursor_value(getattr(last, field)), str(last.pk))
+        return page, next_cursor
+
+    @staticmethod
+    def _cursor_value(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering, cursor, page_size = self.get_page_params(request.query_params, queryset)
+        page, self.next_cursor = self.paginate(queryset, ordering, cursor, page_size)
+        return page
+
+    def get_next_link(self, next_cursor=None):
+        next_cursor = next_cursor if next_cursor is not None else self.next_cursor
+        if not next_cursor or self.request is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, next_cursor)
+
+    def get_paginated_response(self, data):
+        return response.Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,127 @@
+"""
+Per request performance counters.
+
+``collect_request_metrics`` counts the SQL queries and DB time of every connection
+for the duration of the block. Cache hits/misses are recorded by the cache helpers
+(``record_cache_access``) and serializer time by ``instrument_serializers``, which
+wraps ``BaseSerializer.data`` once at startup.
+"""
+import contextvars
+import math
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+_current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.serializer_time = 0.0
+        self._serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """connection.execute_wrapper hook"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'serializer_ms': round(self.serializer_time * 1000, 2),
+            'total_ms': round(self.total_time * 1000, 2),
+        }
+
+    def server_timing(self):
+        """Value of the Server-Timing response header"""
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'serializer;dur={self.serializer_time * 1000:.2f}',
+            f'total;dur={self.total_time * 1000:.2f}',
+        ])
+
+
+@contextmanager
+def collect_request_metrics(metrics=None):
+    """Count into ``metrics`` (a new ``RequestMetrics`` by default) for the duration of the block"""
+    metrics = metrics or RequestMetrics()
+    token = _current_metrics.set(metrics)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+def current_metrics():
+    return _current_metrics.get()
+
+
+def record_cache_access(hit):
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return
+    if hit:
+        metrics.cache_hits += 1
+    else:
+        metrics.cache_misses += 1
+
+
+def instrument_serializers():
+    """Time ``serializer.data`` for the request being measured
+
+    Nested ``.data`` calls (serializers used inside SerializerMethodFields) are
+    counted as part of the outermost serializer only.
+    """
+    from rest_framework.serializers import BaseSerializer
+
+    original = BaseSerializer.data
+    if getattr(original.fget, 'is_timed', False):
+        return
+
+    def data(self):
+        metrics = _current_metrics.get()
+        if metrics is None or metrics._serializer_depth:
+            return original.fget(self)
+
+        metrics._serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return original.fget(self)
+        finally:
+            metrics._serializer_depth -= 1
+            metrics.serializer_time += time.perf_counter() - start
+
+    data.is_timed = True
+    BaseSerializer.data = property(data)
+
+
+def percentile(timings, p):
+    """Nearest-rank percentile of a list of timings"""
+    ordered = sorted(timings)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
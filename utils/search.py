@@ -0,0 +1,259 @@
+"""
+Full text search indexes.
+
+A ``SearchIndex`` stores one weighted document per object in a side table owned by
+the database backend in use:
+
+- SQLite: an FTS5 virtual table ranked with bm25()
+- PostgreSQL: a tsvector column with a GIN index ranked with ts_rank_cd()
+
+``SearchIndex.search(queryset, query)`` filters any queryset of the indexed model to
+the matching objects and annotates ``search_rank`` (higher is better), so it composes
+with the usual filters, select_related/prefetch and pagination. With ``snippet_field``
+it also annotates ``search_snippet``, an excerpt of that field with the matched terms
+wrapped in <mark>.
+
+Documents are indexed as plain text: their HTML tags are dropped and entities decoded
+(``html_to_text``), so snippets never cut through markup. The postgres snippets are
+built from the model column, its tags are dropped in SQL.
+
+Documents are kept current by the models (``update``/``remove``), create the tables
+from a migration with ``create``/``drop`` and fill them with ``rebuild``.
+"""
+import hashlib
+import html
+import re
+import uuid
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import FloatField, TextField
+from django.db.models.expressions import RawSQL
+
+# relative importance of the document fields, the postgres setweight() labels
+WEIGHTS = {'A': 10.0, 'B': 5.0, 'C': 2.0, 'D': 1.0}
+SNIPPET_START, SNIPPET_STOP = '<mark>', '</mark>'
+SNIPPET_WORDS = 16
+HTML_TAG_PATTERN = r'<[^>]*>'
+
+
+def parse_search_terms(query, max_terms=10):
+    """Split user input into plain word terms, the backends match them as prefixes"""
+    return re.findall(r'\w+', (query or '').lower())[:max_terms]
+
+
+def html_to_text(value):
+    """``value`` without its HTML tags and entities, whitespace collapsed"""
+    return ' '.join(html.unescape(re.sub(HTML_TAG_PATTERN, ' ', value or '')).split())
+
+
+def search_cache_key(query):
+    """Cache key fragment for ``query``, the same in every process
+
+    Queries that parse to the same terms ("Dates!", "  dates") share the fragment.
+    """
+    normalized = ' '.join(parse_search_terms(query))
+    return hashlib.sha1(normalized.encode()).hexdigest()[:20]
+
+
+class SearchIndex:
+
+    def __init__(self, name, model, fields):
+        """``fields`` is a list of ``(field_name, weight)``, weight being one of A, B, C, D"""
+        self.name = name
+        self.model = model
+        self.fields = fields
+
+    @property
+    def available(self):
+        return connection.vendor in SEARCH_BACKENDS
+
+    @property
+    def backend(self):
+        if not self.available:
+            raise ImproperlyConfigured(f'Full text search is not available on {connection.vendor}')
+        return SEARCH_BACKENDS[connection.vendor](self)
+
+    # index maintenance is a no-op on databases without a search backend, only searching fails there
+
+    def create(self):
+        if self.available:
+            self.backend.create()
+
+    def drop(self):
+        if self.available:
+            self.backend.drop()
+
+    def update(self, pk, document):
+        """Insert or replace the document (``{field_name: text}``) of ``pk``"""
+        self.update_many([(pk, document)])
+
+    def update_many(self, documents):
+        """``documents`` is an iterable of ``(pk, document)``"""
+        if not self.available:
+            return
+        backend = self.backend
+        for pk, document in documents:
+            backend.update(pk, {field: html_to_text(document.get(field)) for field, _ in self.fields})
+
+    def remove(self, pk):
+        if self.available:
+            self.backend.remove(pk)
+
+    def rebuild(self, documents):
+        self.backend.clear()
+        self.update_many(documents)
+
+    def search(self, queryset, query, snippet_field=None):
+        terms = parse_search_terms(query)
+        if not terms:
+            return queryset.none()
+        return self.backend.search(queryset, terms, snippet_field)
+
+
+class BaseSearchBackend:
+
+    def __init__(self, index):
+        self.index = index
+        self.table = connection.ops.quote_name(index.name)
+
+    def db_pk(self, pk):
+        return self.index.model._meta.pk.get_db_prep_value(pk, connection)
+
+    def outer_pk_column(self):
+        opts = self.index.model._meta
+        return f'{connection.ops.quote_name(opts.db_table)}.{connection.ops.quote_name(opts.pk.column)}'
+
+    def execute(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def clear(self):
+        self.execute(f'DELETE FROM {self.table}')
+
+    def drop(self):
+        self.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def search(self, queryset, terms, snippet_field=None):
+        match_sql, match_params = self.match_sql(terms)
+        rank_sql, rank_params = self.rank_sql(terms)
+        queryset = queryset.filter(pk__in=RawSQL(match_sql, match_params)).annotate(
+            search_rank=RawSQL(rank_sql, rank_params, output_field=FloatField())
+        )
+        if snippet_field:
+            snippet_sql, snippet_params = self.snippet_sql(terms, snippet_field)
+            queryset = queryset.annotate(search_snippet=RawSQL(snippet_sql, snippet_params, output_field=TextField()))
+        return queryset.order_by('-search_rank')
+
+
+class SqliteSearchBackend(BaseSearchBackend):
+
+    def create(self):
+        columns = ', '.join(field for field, _ in self.index.fields)
+        self.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            f"object_id UNINDEXED, {columns}, tokenize='unicode61 remove_diacritics 2')"
+        )
+
+    @staticmethod
+    def rowid(pk):
+        # FTS5 rows are addressed by an integer rowid, derive a stable one from the pk
+        return pk.int >> 65 if isinstance(pk, uuid.UUID) else int(pk)
+
+    def update(self, pk, document):
+        columns = ', '.join(field for field, _ in self.index.fields)
+        placeholders = ', '.join(['%s'] * (len(self.index.fields) + 2))
+        self.execute(
+            f'INSERT OR REPLACE INTO {self.table} (rowid, object_id, {columns}) VALUES ({placeholders})',
+            [self.rowid(pk), self.db_pk(pk), *document.values()]
+        )
+
+    def remove(self, pk):
+        self.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [self.rowid(pk)])
+
+    @staticmethod
+    def match_expression(terms):
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def match_sql(self, terms):
+        return f'SELECT object_id FROM {self.table} WHERE {self.table} MATCH %s', [self.match_expression(terms)]
+
+    def rank_sql(self, terms):
+        weights = ', '.join(str(WEIGHTS[weight]) for _, weight in self.index.fields)
+        # bm25() is lower for better matches
+        return (
+            f'SELECT -bm25({self.table}, 0, {weights}) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND object_id = {self.outer_pk_column()}',
+            [self.match_expression(terms)]
+        )
+
+    def snippet_sql(self, terms, field):
+        # column 0 is object_id
+        column = 1 + [name for name, _ in self.index.fields].index(field)
+        return (
+            f'SELECT snippet({self.table}, {column}, %s, %s, %s, {SNIPPET_WORDS}) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND object_id = {self.outer_pk_column()}',
+            [SNIPPET_START, SNIPPET_STOP, '…', self.match_expression(terms)]
+        )
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    config = 'simple'
+
+    def create(self):
+        pk_type = self.index.model._meta.pk.db_type(connection)
+        self.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table} (object_id {pk_type} PRIMARY KEY, document tsvector NOT NULL)'
+        )
+        index_name = connection.ops.quote_name(f'{self.index.name}_document_gin')
+        self.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {self.table} USING GIN (document)')
+
+    def update(self, pk, document):
+        vector = ' || '.join(
+            f"setweight(to_tsvector('{self.config}', %s), '{weight}')" for _, weight in self.index.fields
+        )
+        self.execute(
+            f'INSERT INTO {self.table} (object_id, document) VALUES (%s, {vector}) '
+            f'ON CONFLICT (object_id) DO UPDATE SET document = EXCLUDED.document',
+            [self.db_pk(pk), *document.values()]
+        )
+
+    def remove(self, pk):
+        self.execute(f'DELETE FROM {self.table} WHERE object_id = %s', [self.db_pk(pk)])
+
+    @staticmethod
+    def tsquery(terms):
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def match_sql(self, terms):
+        return (
+            f"SELECT object_id FROM {self.table} WHERE document @@ to_tsquery('{self.config}', %s)",
+            [self.tsquery(terms)]
+        )
+
+    def rank_sql(self, terms):
+        weights = ', '.join(str(WEIGHTS[weight] / WEIGHTS['A']) for weight in 'DCBA')
+        # normalization 32 scales the rank into 0..1 (rank / (rank + 1))
+        return (
+            f"SELECT ts_rank_cd('{{{weights}}}', document, to_tsquery('{self.config}', %s), 32) "
+            f"FROM {self.table} WHERE object_id = {self.outer_pk_column()}",
+            [self.tsquery(terms)]
+        )
+
+    def snippet_sql(self, terms, field):
+        # ts_headline() needs the original text, ``field`` must be a column of the indexed model; its tags are
+        # dropped like html_to_text does for the indexed documents
+        opts = self.index.model._meta
+        column = f'{connection.ops.quote_name(opts.db_table)}.{connection.ops.quote_name(opts.get_field(field).column)}'
+        options = f'StartSel={SNIPPET_START}, StopSel={SNIPPET_STOP}, MaxWords={SNIPPET_WORDS}, MinWords=5'
+        text = f"regexp_replace({column}, %s, ' ', 'g')"
+        return (
+            f"ts_headline('{self.config}', {text}, to_tsquery('{self.config}', %s), %s)",
+            [HTML_TAG_PATTERN, self.tsquery(terms), options]
+        )
+
+
+SEARCH_BACKENDS = {
+    'sqlite': SqliteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
@@ -0,0 +1,83 @@
+"""
+Human readable per-day numbers (OM202610160001, ORD20261016000001, ...).
+
+``DailySequence.next()`` is a single INCR of a per-day counter in the cache (redis in
+production), so allocating a number costs O(1) and concurrent workers get distinct
+numbers while the counter lives. When the counter of the day does not exist yet (first
+number of the day, or the cache was flushed) it is seeded with the highest number
+already stored, so the sequence continues instead of restarting at 1. That seed only
+sees committed rows: after a flush, numbers handed out to transactions still running
+are handed out again. The rows are therefore inserted with ``create`` /
+``save_numbered``, which retry with the next number when the unique constraint finds
+the number taken.
+"""
+import logging
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Length
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# the counters only need to outlive their day
+SEQUENCE_TIMEOUT = 2 * 24 * 60 * 60
+
+
+class DailySequence:
+
+    def __init__(self, name, prefix, model, field, width=4):
+        """Numbers are ``<prefix><YYYYMMDD><n>``, ``n`` zero padded to ``width``, stored in ``model.field``"""
+        self.name = name
+        self.prefix = prefix
+        self.model = model
+        self.field = field
+        self.width = width
+
+    def day_prefix(self, day=None):
+        return f'{self.prefix}{(day or timezone.localdate()):%Y%m%d}'
+
+    def cache_key(self, day_prefix):
+        return f'sequence:{self.name}:{day_prefix}'
+
+    def last_allocated(self, day_prefix):
+        """Highest number stored with ``day_prefix``, only read to seed the counter of a day"""
+        # past the zero padding a longer number is a bigger one
+        number = (
+            self.model._base_manager.filter(**{f'{self.field}__startswith': day_prefix})
+            .order_by(Length(self.field).desc(), f'-{self.field}')
+            .values_list(self.field, flat=True).first()
+        )
+        return int(number[len(day_prefix):]) if number else 0
+
+    def next(self):
+        day_prefix = self.day_prefix()
+        key = self.cache_key(day_prefix)
+        try:
+            value = cache.incr(key)
+        except ValueError:
+            # cache.add is a SET NX: only one of the workers seeding the day wins
+            cache.add(key, self.last_allocated(day_prefix), SEQUENCE_TIMEOUT)
+            value = cache.incr(key)
+        return f'{day_prefix}{value:0{self.width}d}'
+
+    def create(self, create, attempts=5):
+        """Return ``create(number)`` called with the next number, retried with a new number while it is taken"""
+        for attempt in range(attempts):
+            number = self.next()
+            try:
+                with transaction.atomic():
+                    return create(number)
+            except IntegrityError:
+                taken = self.model._base_manager.filter(**{self.field: number}).exists()
+                if not taken or attempt == attempts - 1:
+                    raise
+                logger.warning('%s %s was handed out twice, the counter was re-seeded', self.name, number)
+
+    def save_numbered(self, instance, save):
+        """Give the new ``instance`` the next number and ``save()`` it, see ``create``"""
+        def numbered(number):
+            setattr(instance, self.field, number)
+            save()
+            return instance
+        return self.create(numbered)
@@ -0,0 +1,13 @@
+from celery import shared_task
+from django.core.cache import cache
+
+from utils.cache import rebuild_cached_payload, resolve_cache_builder
+
+
+@shared_task
+def refresh_cached_payload(key, builder_path, timeout, builder_kwargs=None):
+    """Rebuild a stale read-through payload outside of the request cycle"""
+    try:
+        rebuild_cached_payload(key, resolve_cache_builder(builder_path), timeout, builder_kwargs)
+    finally:
+        cache.delete(f'{key}:rebuild_lock')
@@ -0,0 +1,211 @@
+"""
+Query count regression harness.
+
+Mix ``QueryCountTestMixin`` into a TestCase in an app's tests.py, point it at the
+app's urlconf and pin the number of queries every url issues against the
+``seed_dataset`` data:
+
+    class WebQueryCountTests(QueryCountTestMixin, TestCase):
+        urlconf = 'web.urls'
+        url_prefix = '/api/web/'
+        query_counts = {'get-product': 4, ...}
+
+Every named url of the urlconf must be pinned, so a new endpoint (or a new N+1)
+fails the suite until its count is reviewed and updated. Urls are requested with
+GET unless ``requests`` (or ``get_request``) says otherwise, with an authenticated
+user and a cold cache, and must answer with a success: the count of an error
+response pins nothing. Every url runs in a savepoint rolled back after it, so the
+writes of one don't change the counts of the next.
+"""
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import skipIf
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from rest_framework.test import APIClient
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+IMAGE_SIZES = ('thumbnail', 'medium', 'large', 'original')
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# the redis code paths (Lua scripts included) run against fakeredis, skipped without it
+requires_redis = skipIf(fakeredis is None, 'fakeredis is not installed')
+
+
+def fake_redis():
+    return fakeredis.FakeStrictRedis()
+
+
+def seed_dataset(products=5, reviews_per_product=3, blog_posts=3):
+    """Create a small but complete catalog: every relation the serializers walk is populated"""
+    from account.models import User, Address
+    from product.models import Category, SubCategory, Brand, Product, ProductImage, Review, ProductFAQ, Wishlist, \
+        Banner
+    from utils.models import Country, State, City
+    from web.models import BlogCategory, BlogPost, BlogComment
+
+    user = User.objects.create_user(username='seed-user', email='seed@example.com', password='password')
+    reviewers = [
+        User.objects.create_user(username=f'seed-reviewer-{i}', email=f'reviewer{i}@example.com')
+        for i in range(reviews_per_product)
+    ]
+
+    country = Country.objects.create(name='India', phone_code='+91', capital='New Delhi', currency='INR',
+                                     currency_name='Indian Rupee', time_zone='Asia/Kolkata')
+    state = State.objects.create(country=country, name='Rajasthan')
+    city = City.objects.create(state=state, name='Jaipur')
+    address = Address.objects.create(user=user, full_name='Seed User', phone_number='9999999999',
+                                     address_line1='Street 1', city=city, state=state, postal_code='302001')
+
+    category = Category.objects.create(name='Seed Category')
+    sub_category = SubCategory.objects.create(name='Seed Sub Category', category=category)
+    brand = Brand.objects.create(name='Seed Brand')
+
+    product_list = []
+    for i in range(products):
+        product = Product.objects.create(name=f'Seed Product {i}', sub_category=sub_category, brand=brand,
+                                         sku=f'SEED-{i}', price=Decimal(100 + i), stock_quantity=10)
+        ProductImage.objects.create(
+            product=product, is_primary=True, file_id=f'seed-{i}', original_filename=f'{i}.jpg',
+            **{f'{size}_url': f'https://cdn.example.com/{size}/{i}.jpg' for size in IMAGE_SIZES},
+            **{f'{size}_key': f'{size}/{i}.jpg' for size in IMAGE_SIZES},
+        )
+        for reviewer_index, reviewer in enumerate(reviewers):
+            Review.objects.create(user=reviewer, product=product, rating=reviewer_index % 5 + 1, comment='Good')
+        ProductFAQ.objects.create(product=product, question='Question?', answer='Answer', is_home_page_related=True)
+        product_list.append(product)
+
+    wishlist = Wishlist.objects.create(user=user, product=product_list[0])
+    banner = Banner.objects.create(title='Seed Banner', image='https://cdn.example.com/banner.jpg')
+    banner.subcategories.add(sub_category)
+
+    blog_category = BlogCategory.objects.create(name='Seed Blog Category')
+    posts = [
+        BlogPost.objects.create(title=f'Seed Post {i}', content='Content', author=user, category=blog_category,
+                                post_status='published', is_featured=i == 0)
+        for i in range(blog_posts)
+    ]
+    comment = BlogComment.objects.create(post=posts[0], user=user, content='Comment', comment_status='approved')
+    BlogComment.objects.create(post=posts[0], parent=comment, user=user, content='Reply', comment_status='approved')
+
+    return SimpleNamespace(
+        user=user, address=address, country=country, state=state, city=city, category=category,
+        sub_category=sub_category, brand=brand, products=product_list, wishlist=wishlist, banner=banner,
+        blog_category=blog_category, posts=posts, comment=comment,
+    )
+
+
+def iter_url_names(urlconf):
+    """Yield ``(name, params)`` for every named url of ``urlconf``, including router includes"""
+    resolver = get_resolver(urlconf)
+    seen = set()
+    for name in resolver.reverse_dict:
+        if not isinstance(name, str) or name in seen:
+            continue
+        seen.add(name)
+        # routers register every url twice, the variant without '.<format>' has the fewest params
+        possibilities = resolver.reverse_dict.getlist(name)
+        params = min((possibility[0][0][1] for possibility in possibilities), key=len)
+        yield name, list(params)
+
+
+class QueryCountTestMixin:
+    urlconf = None
+    url_prefix = '/'
+    # url name -> pinned number of queries
+    query_counts = {}
+    # url name -> {'method': 'post', 'data': {...}, 'format': 'multipart', 'headers': {...}, 'staff': True} for
+    # the urls that should not be requested with GET as the seeded user; see get_request for data of seeded objects
+    requests = {}
+    # url name -> reason, for the urls known to fail; they must keep failing until fixed and are not pinned
+    expected_errors = {}
+
+    @classmethod
+    def setUpClass(cls):
+        # the seeded writes invalidate cache tags, so the cache must be swapped before any test data exists
+        cls._cache_override = override_settings(CACHES=LOCMEM_CACHES)
+        cls._cache_override.enable()
+        try:
+            super().setUpClass()
+        except Exception:
+            cls._cache_override.disable()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            cls._cache_override.disable()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seed = seed_dataset()
+
+    def setUp(self):
+        self.client = APIClient(raise_request_exception=False)
+        self.client.force_authenticate(self.seed.user)
+
+    def get_url_kwargs(self, name, params):
+        """Url kwargs of ``name``, override to point the urls at seeded objects"""
+        return {param: str(uuid4()) for param in params}
+
+    def get_request(self, name):
+        """How ``name`` is requested, ``requests[name]`` unless overridden"""
+        return self.requests.get(name, {})
+
+    def get_url(self, name, params):
+        path = reverse(name, urlconf=self.urlconf, kwargs=self.get_url_kwargs(name, params))
+        return self.url_prefix.rstrip('/') + path
+
+    def staff_user(self):
+        from account.models import User
+        user, _ = User.objects.get_or_create(username='seed-staff', defaults={
+            'email': 'staff@example.com', 'is_staff': True, 'is_superuser': True,
+        })
+        return user
+
+    def request_url(self, name, params):
+        """Request ``name``, returns ``(url, response, queries)``; a streamed body is consumed in the capture"""
+        request = self.get_request(name)
+        url = self.get_url(name, params)
+        client = self.client
+        if request.get('staff'):
+            client = APIClient(raise_request_exception=False)
+            client.force_authenticate(self.staff_user())
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, request.get('method', 'get'))(
+                url, request.get('data'), format=request.get('format', 'json'), headers=request.get('headers')
+            )
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return url, response, queries
+
+    def test_query_counts(self):
+        for name, params in iter_url_names(self.urlconf):
+            with self.subTest(url=name), transaction.atomic():
+                if name in self.expected_errors:
+                    url, response, queries = self.request_url(name, params)
+                    transaction.set_rollback(True)
+                    self.assertGreaterEqual(response.status_code, 400, f'{url} is fixed, drop it from expected_errors')
+                    continue
+                self.assertIn(name, self.query_counts, f'Pin the query count of the "{name}" url')
+                url, response, queries = self.request_url(name, params)
+                transaction.set_rollback(True)
+                self.assertLess(response.status_code, 400, f'{url} answered {response.status_code}: '
+                                f'{getattr(response, "content", b"")[:500]!r}')
+                self.assertEqual(
+                    len(queries), self.query_counts[name],
+                    f'{url} issued {len(queries)} queries instead of {self.query_counts[name]}:\n' +
+                    '\n'.join(query['sql'] for query in queries.captured_queries)
+                )
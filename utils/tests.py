@@ -1,3 +1,317 @@
-from django.test import TestCase
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.core.cache import cache
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from account.models import User
+from product.models import Order, Product, ProductView, order_numbers
+from product.search import product_search_index
+from utils.cache import _rebuild_lock_key, cached_read_through, defer_cache_invalidation, get_invalidation_stats, \
+    invalidate_cache_tags, restore_redis_hash, set_tagged_cache, take_redis_hash
+from utils.middleware import QueryBudgetMiddleware
+from utils.search import parse_search_terms, search_cache_key
+from utils.testing import LOCMEM_CACHES, fake_redis, requires_redis, seed_dataset
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DailySequenceTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_numbers_are_sequential_per_day(self):
+        prefix = order_numbers.day_prefix()
+        self.assertEqual([order_numbers.next() for _ in range(3)],
+                         [f'{prefix}000001', f'{prefix}000002', f'{prefix}000003'])
+
+    def test_counter_is_seeded_from_the_stored_numbers(self):
+        prefix = order_numbers.day_prefix()
+        user = seed_dataset(products=1, reviews_per_product=0, blog_posts=1).user
+        for number in (f'{prefix}000009', f'{prefix}1000000', 'ORD19990101000042'):
+            Order.objects.create(order_number=number, user=user, subtotal=0, total_amount=0, billing_address={},
+                                 shipping_address={})
+        cache.clear()
+        self.assertEqual(order_numbers.next(), f'{prefix}1000001')
+
+    def test_number_handed_out_again_after_a_reseed_is_retried(self):
+        prefix = order_numbers.day_prefix()
+        user = seed_dataset(products=1, reviews_per_product=0, blog_posts=1).user
+
+        def create_order(number):
+            return Order.objects.create(order_number=number, user=user, subtotal=0, total_amount=0,
+                                        billing_address={}, shipping_address={})
+
+        # the counter was re-seeded from the committed numbers while 000002 was still being inserted
+        cache.set(order_numbers.cache_key(prefix), 1)
+        create_order(f'{prefix}000002')
+        with self.assertLogs('utils.sequences', 'WARNING'):
+            self.assertEqual(order_numbers.create(create_order).order_number, f'{prefix}000003')
+
+    def test_concurrent_numbers_never_collide(self):
+        numbers = []
+
+        def allocate():
+            numbers.extend(order_numbers.next() for _ in range(50))
+
+        threads = [threading.Thread(target=allocate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(numbers)), 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DeferredInvalidationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_invalidations_run_once_when_the_block_exits(self):
+        set_tagged_cache('payload', 'value', 60, ['product:1'])
+        with self.captureOnCommitCallbacks(execute=True), defer_cache_invalidation():
+            with defer_cache_invalidation():
+                self.assertEqual(invalidate_cache_tags('product:1', source='product'), 0)
+            self.assertEqual(cache.get('payload'), 'value')
+            invalidate_cache_tags('product:1', 'products:all', source='product')
+        self.assertIsNone(cache.get('payload'))
+        self.assertEqual(get_invalidation_stats(['product'])['product'], {'writes': 1, 'keys': 1})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReadThroughTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_build_once(self):
+        building, release = threading.Event(), threading.Event()
+
+        def build():
+            building.set()
+            release.wait(5)
+            return 'payload', ['products:all']
+
+        builder = mock.Mock(side_effect=build)
+        results = []
+        first = threading.Thread(target=lambda: results.append(cached_read_through('listing', builder, 60)))
+        first.start()
+        building.wait(5)
+        # the second miss finds the rebuild lock taken and waits for the first one's result
+        second = threading.Thread(target=lambda: results.append(cached_read_through('listing', builder, 60)))
+        second.start()
+        time.sleep(0.1)
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertEqual(results, ['payload', 'payload'])
+        builder.assert_called_once()
+        self.assertIsNone(cache.get(_rebuild_lock_key('listing')))
+
+    def test_stale_payload_is_served_while_one_refresh_runs(self):
+        cache.set('listing', {'payload': 'stale', 'fresh_until': time.time() - 1}, 60)
+        builder = mock.Mock(return_value=('fresh', ['products:all']))
+
+        # another worker holds the lock and refreshes it
+        cache.add(_rebuild_lock_key('listing'), 1)
+        self.assertEqual(cached_read_through('listing', builder, 60), 'stale')
+        builder.assert_not_called()
+
+        cache.delete(_rebuild_lock_key('listing'))
+        self.assertEqual(cached_read_through('listing', builder, 60), 'fresh')
+        self.assertEqual(cached_read_through('listing', builder, 60), 'fresh')
+        builder.assert_called_once()
+
+    def test_miss_waits_for_the_rebuild_of_another_worker(self):
+        cache.add(_rebuild_lock_key('listing'), 1)
+        builder = mock.Mock(return_value=('own', []))
+        rebuilt = threading.Timer(0.1, cache.set, ['listing', {'payload': 'rebuilt', 'fresh_until': time.time() + 60}])
+        rebuilt.start()
+        self.assertEqual(cached_read_through('listing', builder, 60), 'rebuilt')
+        rebuilt.join()
+        builder.assert_not_called()
+
+    def test_miss_builds_itself_when_the_wait_times_out(self):
+        cache.add(_rebuild_lock_key('listing'), 1)
+        builder = mock.Mock(return_value=('own', []))
+        with mock.patch('oumraa.settings.CACHE_REBUILD_WAIT', 0.1, create=True), \
+                self.assertLogs('utils.cache', 'WARNING'):
+            self.assertEqual(cached_read_through('listing', builder, 60), 'own')
+        builder.assert_called_once()
+
+
+@requires_redis
+class RedisHashTests(TestCase):
+
+    def setUp(self):
+        self.redis = fake_redis()
+
+    def test_overlapping_takes_detach_the_hash_once(self):
+        self.redis.hincrby('counters', 'a', 2)
+        flushing_key, values = take_redis_hash(self.redis, 'counters')
+        self.assertEqual(values, {'a': 2})
+        # a second flush started meanwhile finds nothing instead of failing the RENAME
+        self.assertEqual(take_redis_hash(self.redis, 'counters')[1], {})
+
+        self.redis.hincrby('counters', 'a', 1)
+        restore_redis_hash(self.redis, 'counters', flushing_key, values)
+        self.assertEqual(take_redis_hash(self.redis, 'counters')[1], {'a': 3})
+        self.assertFalse(self.redis.exists(flushing_key))
+
+
+class QueryBudgetMiddlewareTests(TestCase):
+
+    def test_queries_of_a_streamed_body_are_counted(self):
+        def rows():
+            for user in User.objects.all():
+                yield user.username
+            yield str(Product.objects.count())
+
+        middleware = QueryBudgetMiddleware(lambda request: StreamingHttpResponse(rows()))
+        with mock.patch('oumraa.settings.QUERY_BUDGET_DEFAULT', 1, create=True), \
+                mock.patch('oumraa.settings.QUERY_BUDGET_ACTION', 'raise', create=True):
+            response = middleware(RequestFactory().get('/feed/'))
+            self.assertIn('0 queries', response['Server-Timing'])
+            with self.assertLogs('utils.middleware', 'INFO') as logs:
+                b''.join(response.streaming_content)
+        self.assertIn('"queries": 2', logs.output[0])
+        self.assertIn('/feed/ issued 2 queries, budget is 1', logs.output[1])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CacheTaggingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_only_the_keys_of_the_tags_are_invalidated(self):
+        set_tagged_cache('product', 'value', 60, ['product:1', 'products:all'])
+        set_tagged_cache('listing', 'value', 60, ['products:all'])
+        set_tagged_cache('other', 'value', 60, ['product:2'])
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_cache_tags('product:1', source='test')
+        self.assertEqual((cache.get('product'), cache.get('listing'), cache.get('other')), (None, 'value', 'value'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_cache_tags('products:all', source='test')
+        self.assertIsNone(cache.get('listing'))
+        self.assertEqual(cache.get('other'), 'value')
+        # the tag sets aren't pruned, the deleted product key counts again
+        self.assertEqual(get_invalidation_stats(['test'])['test'], {'writes': 2, 'keys': 3})
+
+    def test_invalidation_waits_for_the_commit(self):
+        product = seed_dataset(products=1, reviews_per_product=0).products[0]
+        builder = mock.Mock(side_effect=lambda: ('payload', product.cache_tags))
+        cached_read_through('product-payload', builder, 60)
+        self.assertIsNotNone(cache.get('product-payload'))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.name = 'Renamed'
+            product.save()
+            # a rebuild now would read the rows from before the commit
+            self.assertIsNotNone(cache.get('product-payload'))
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(cache.get('product-payload'))
+
+    def test_invalidates_right_away_outside_a_transaction(self):
+        set_tagged_cache('payload', 'value', 60, ['product:1'])
+        with mock.patch('utils.cache.transaction.get_connection') as get_connection:
+            get_connection.return_value.in_atomic_block = False
+            self.assertEqual(invalidate_cache_tags('product:1', source='test'), 1)
+        self.assertIsNone(cache.get('payload'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SearchIndexTests(TestCase):
+
+    def setUp(self):
+        self.products = seed_dataset(products=2, reviews_per_product=0).products
+
+    def search(self, query):
+        return list(product_search_index.search(Product.objects.all(), query).values_list('sku', 'search_rank'))
+
+    def test_fts5_round_trip(self):
+        self.assertEqual(connection.vendor, 'sqlite')
+        product = self.products[0]
+        product_search_index.update(product.pk, {'name': 'Kashmiri Saffron', 'sku': product.sku})
+        # prefix match, diacritics and case folded
+        self.assertEqual([sku for sku, _ in self.search('KASHMÍ')], [product.sku])
+
+        product_search_index.remove(product.pk)
+        self.assertEqual(self.search('kashmiri'), [])
+        self.assertEqual(product_search_index.search(Product.objects.all(), '!!').count(), 0)
+
+    def test_name_matches_rank_above_description_matches(self):
+        named, described = self.products
+        product_search_index.update(named.pk, {'name': 'Medjool dates', 'sku': named.sku})
+        product_search_index.update(described.pk, {'name': 'Dry fruit box', 'sku': described.sku,
+                                                    'short_description': 'almonds, cashews and dates'})
+        results = self.search('dates')
+        self.assertEqual([sku for sku, _ in results], [named.sku, described.sku])
+        self.assertGreater(results[0][1], results[1][1])
+
+    def test_queries_with_the_same_terms_share_a_cache_key(self):
+        self.assertEqual(parse_search_terms('  Dates, Figs!'), ['dates', 'figs'])
+        self.assertEqual(search_cache_key('Dates!'), search_cache_key('  dates'))
+        self.assertNotEqual(search_cache_key('dates'), search_cache_key('figs'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AdminChangelistTests(TestCase):
+    url = '/admin/product/productview/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seed = seed_dataset(products=2, reviews_per_product=0)
+        cls.admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='pw')
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+        self.model_admin = admin.site._registry[ProductView]
+
+    def add_views(self, count):
+        for i in range(count):
+            ProductView.objects.create(product=self.seed.products[i % 2], user=self.seed.user,
+                                       ip_address='127.0.0.1', user_agent='test')
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        return len(queries)
+
+    def test_foreign_key_columns_are_joined(self):
+        self.assertEqual(self.model_admin.list_select_related, ['user', 'product'])
+        self.add_views(2)
+        queries = self.changelist_queries()
+        self.add_views(10)
+        self.assertEqual(self.changelist_queries(), queries)
+
+    def test_big_tables_show_the_estimated_count(self):
+        self.add_views(3)
+        with mock.patch('utils.admin.estimated_row_count', return_value=5_000_000), \
+                mock.patch('oumraa.settings.ADMIN_ESTIMATED_COUNT_THRESHOLD', 2, create=True):
+            self.assertEqual(self.client.get(self.url).context['cl'].result_count, 5_000_000)
+            # fewer matches than the threshold are counted
+            response = self.client.get(self.url, {'status__exact': 'inactive'})
+            self.assertEqual(response.context['cl'].result_count, 0)
+
+    def test_show_more_continues_after_the_last_row(self):
+        self.add_views(5)
+        expected = list(ProductView.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        seen = []
+        url = self.url
+        with mock.patch.object(self.model_admin, 'list_per_page', 2):
+            while url:
+                cl = self.client.get(url).context['cl']
+                seen += [view.pk for view in cl.result_list]
+                url = cl.show_more_url and self.url + cl.show_more_url
+        self.assertEqual(seen, expected)
+        self.assertEqual(self.client.get(self.url, {'cursor': 'garbage'}).status_code, 302)
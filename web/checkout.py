@@ -0,0 +1,309 @@
+"""
+Cart to order checkout.
+
+``place_order`` turns the active cart of a user into an Order in one short
+transaction: the cart row is locked, every line is priced in one pass from a single
+query, the stock is reserved (product.inventory), the coupon is applied with a
+guarded usage counter and the OrderItems are inserted with one bulk_create. Lines on
+flash sale are priced at the sale price and claim the sale quantity.
+
+The reservations are named after the order number: ``confirm_order`` commits them
+once the order is paid, ``cancel_order`` puts the stock and the flash sale quantity
+back. The reservations of a pending order never expire on their own, so its stock is
+never given back while the order could still be paid. ``expire_unpaid_orders``
+cancels the checkout orders still unpaid after the reservation timeout (cash on
+delivery excluded); it is not on the beat schedule, as long as no payment confirms
+the orders it would cancel every one of them.
+
+Submits are made idempotent by the view with ``claim_idempotency_key`` /
+``store_idempotent_response``: a retried request with the same key gets the response
+of the first one.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from account.models import Address
+from oumraa import settings
+from product.flash_sales import claim_sale_quantity, get_sale_items, release_failed_claims, \
+    release_order_sale_claims
+from product.inventory import InsufficientStock, commit_reservations, release_reference, reserve_stock
+from product.models import Cart, Coupon, Order, OrderItem, OrderStatusHistory, StockReservation, order_numbers
+
+CENTS = Decimal('0.01')
+IDEMPOTENCY_PENDING = 'pending'
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def _money(amount):
+    return Decimal(amount).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def address_snapshot(address):
+    """The address as stored on the order, later edits of the address must not change it"""
+    return {
+        'id': str(address.pk),
+        'full_name': address.full_name,
+        'phone_number': address.phone_number,
+        'alternate_phone_number': address.alternate_phone_number,
+        'address_line1': address.address_line1,
+        'address_line2': address.address_line2,
+        'landmark': address.landmark,
+        'city': address.city.name,
+        'state': address.state.name,
+        'postal_code': address.postal_code,
+    }
+
+
+def price_cart_lines(items, sale_items=None):
+    """Price every cart line at the current product/variant price, or the flash sale price
+
+    ``items`` must come with product, product_variant and the product taxes loaded.
+    Returns the unsaved OrderItems, the subtotal and the (exclusive) tax amount.
+    """
+    sale_items = sale_items or {}
+    order_items, subtotal, tax_amount = [], Decimal(0), Decimal(0)
+    for item in items:
+        product, variant = item.product, item.product_variant
+        if product.status != 'active' or (variant and variant.status != 'active'):
+            raise CheckoutError(f'{product.name} is no longer available')
+
+        sale_item = sale_items.get(str(product.pk))
+        if sale_item:
+            unit_price = Decimal(sale_item['sale_price'])
+        else:
+            unit_price = (variant.price if variant and variant.price is not None else product.price)
+        total_price = _money(unit_price * item.quantity)
+        rate = sum((tax.tax_rate.rate for tax in product.taxes.all() if not tax.tax_rate.is_inclusive), Decimal(0))
+        order_items.append(OrderItem(
+            product=product, product_variant=variant, product_name=product.name,
+            product_sku=variant.sku if variant else product.sku, quantity=item.quantity,
+            unit_price=unit_price, total_price=total_price,
+            flash_sale_item_id=sale_item['item_id'] if sale_item else None,
+        ))
+        subtotal += total_price
+        tax_amount += _money(total_price * rate / 100)
+    return order_items, subtotal, tax_amount
+
+
+def apply_coupon(code, subtotal, shipping_amount):
+    """Return ``(coupon, discount, shipping_discount)``, taking one use of the coupon
+
+    The usage counter is incremented with a guarded update, so a coupon can never be
+    used more than ``usage_limit`` times. Must run in the checkout transaction.
+    """
+    now = timezone.now()
+    coupon = Coupon.objects.active().filter(code=code, valid_from__lte=now, valid_until__gte=now).first()
+    if coupon is None:
+        raise CheckoutError('Invalid or expired coupon')
+    if subtotal < coupon.minimum_amount:
+        raise CheckoutError(f'Coupon {code} needs a minimum order of {coupon.minimum_amount}')
+
+    used = Coupon.objects.filter(pk=coupon.pk).filter(
+        Q(usage_limit__isnull=True) | Q(used_count__lt=F('usage_limit'))
+    ).update(used_count=F('used_count') + 1)
+    if not used:
+        raise CheckoutError(f'Coupon {code} has been fully redeemed')
+
+    if coupon.discount_type == 'free_shipping':
+        return coupon, Decimal(0), shipping_amount
+    if coupon.discount_type == 'percentage':
+        discount = _money(subtotal * coupon.discount_value / 100)
+    else:
+        discount = coupon.discount_value
+    if coupon.maximum_discount is not None:
+        discount = min(discount, coupon.maximum_discount)
+    return coupon, min(discount, subtotal), Decimal(0)
+
+
+def claim_flash_sale_lines(items, sale_items, claims):
+    """Claim the flash sale quantity of the cart lines on sale, appending to ``claims``"""
+    quantities = {}
+    for item in items:
+        if str(item.product_id) in sale_items:
+            quantities[str(item.product_id)] = quantities.get(str(item.product_id), 0) + item.quantity
+
+    for product_id, quantity in quantities.items():
+        entry = sale_items[product_id]
+        if not claim_sale_quantity(entry, quantity):
+            name = next(item.product.name for item in items if str(item.product_id) == product_id)
+            raise CheckoutError(f'The flash sale of {name} is sold out')
+        claims.append((entry, quantity))
+
+
+def place_order(user, shipping_address_id, billing_address_id=None, coupon_code=None, notes=None):
+    """Create the order of the active cart of ``user``, raises CheckoutError when it cannot be placed"""
+    claims = []
+    try:
+        return _place_order(user, shipping_address_id, billing_address_id, coupon_code, notes, claims)
+    except Exception:
+        # flash sale claims live in redis, outside of the rolled back transaction
+        release_failed_claims(claims)
+        raise
+
+
+def _place_order(user, shipping_address_id, billing_address_id, coupon_code, notes, claims):
+    addresses = Address.objects.select_related('city', 'state').filter(user=user).in_bulk(
+        {shipping_address_id, billing_address_id or shipping_address_id}
+    )
+    addresses = {str(pk): address for pk, address in addresses.items()}
+    shipping_address = addresses.get(str(shipping_address_id))
+    billing_address = addresses.get(str(billing_address_id or shipping_address_id))
+    if shipping_address is None or billing_address is None:
+        raise CheckoutError('Address not found')
+
+    with transaction.atomic():
+        cart = Cart.objects.select_for_update().filter(user=user, status='active').first()
+        if cart is None:
+            raise CheckoutError('Cart is empty')
+        items = list(
+            cart.items.select_related('product', 'product_variant').prefetch_related('product__taxes__tax_rate')
+        )
+        if not items:
+            raise CheckoutError('Cart is empty')
+
+        sale_items = get_sale_items()
+        order_items, subtotal, tax_amount = price_cart_lines(items, sale_items)
+        claim_flash_sale_lines(items, sale_items, claims)
+        shipping_amount = Decimal(getattr(settings, 'CHECKOUT_SHIPPING_AMOUNT', 0))
+        coupon, discount, shipping_discount = None, Decimal(0), Decimal(0)
+        if coupon_code:
+            coupon, discount, shipping_discount = apply_coupon(coupon_code, subtotal, shipping_amount)
+
+        # created first: a number handed out twice after a counter re-seed is retried before anything uses it
+        order = order_numbers.create(lambda order_number: Order.objects.create(
+            order_number=order_number, user=user, subtotal=subtotal, tax_amount=tax_amount,
+            shipping_amount=shipping_amount - shipping_discount, discount_amount=discount,
+            total_amount=subtotal + tax_amount + shipping_amount - shipping_discount - discount,
+            shipping_address=address_snapshot(shipping_address),
+            billing_address=address_snapshot(billing_address), coupon=coupon, notes=notes,
+        ))
+        try:
+            reserve_stock(
+                ((item.product_id, item.product_variant_id, item.quantity) for item in items), order.order_number,
+                user=user
+            )
+        except InsufficientStock as e:
+            name = next(item.product.name for item in items if str(item.product_id) == str(e.product_id))
+            raise CheckoutError(f'{name}: only {e.available} items available in stock')
+
+        for order_item in order_items:
+            order_item.order = order
+        OrderItem.objects.bulk_create(order_items)
+        OrderStatusHistory.objects.create(order=order, order_status=order.order_status,
+                                          notes='Order placed', created_by=user)
+
+        # the cart is done with, the next add-to-cart starts a new one
+        Cart.objects.filter(pk=cart.pk).update(status='inactive')
+
+    order.placed_items = order_items
+    return order
+
+
+def _change_order_status(order, order_status, notes, user=None, **fields):
+    Order.objects.filter(pk=order.pk).update(order_status=order_status, **fields)
+    OrderStatusHistory.objects.create(order=order, order_status=order_status, notes=notes, created_by=user)
+    order.order_status = order_status
+    for field, value in fields.items():
+        setattr(order, field, value)
+
+
+def _lock_order(order):
+    return Order.objects.select_for_update().only('order_status', 'payment_status').get(pk=order.pk)
+
+
+def confirm_order(order, user=None):
+    """Mark ``order`` paid, its reserved stock is sold"""
+    with transaction.atomic():
+        locked = _lock_order(order)
+        if locked.order_status != 'pending':
+            # cancelled (its stock is back on sale) or confirmed already
+            raise CheckoutError(f'Order {order.order_number} is {locked.order_status}')
+        commit_reservations(order.order_number)
+        _change_order_status(order, 'confirmed', 'Payment received', user, payment_status='paid')
+
+
+def cancel_order(order, notes='Order cancelled', user=None, unpaid_only=False):
+    """Cancel the pending ``order``, its reserved stock and flash sale quantity are put back
+
+    Returns False when the order is not pending (cancelled already, or confirmed in the
+    meantime), with ``unpaid_only`` also when its payment was received.
+    """
+    with transaction.atomic():
+        locked = _lock_order(order)
+        if locked.order_status != 'pending' or (unpaid_only and locked.payment_status != 'pending'):
+            return False
+        release_reference(order.order_number, notes=notes)
+        claims = [
+            (item.flash_sale_item, item.quantity)
+            for item in order.items.select_related('flash_sale_item__flash_sale').exclude(flash_sale_item=None)
+        ]
+        _change_order_status(order, 'cancelled', notes, user)
+        # the redis claims are outside of the transaction
+        transaction.on_commit(lambda: release_order_sale_claims(claims))
+    return True
+
+
+def expire_unpaid_orders(batch_size=100):
+    """Cancel the checkout orders still unpaid when their stock reservations expire, returns how many
+
+    Only the orders placed by ``place_order`` (their stock is still reserved under the
+    order number) are cancelled, cash on delivery orders are paid on delivery.
+    """
+    timeout = getattr(settings, 'STOCK_RESERVATION_TIMEOUT', 15 * 60)
+    expired = Order.objects.filter(
+        order_status='pending', payment_status='pending', created_at__lte=timezone.now() - timedelta(seconds=timeout),
+        order_number__in=StockReservation.objects.filter(reservation_status='reserved').values('reference_id'),
+    ).exclude(payments__payment_method='cod').order_by('created_at')
+    cancelled = 0
+    while True:
+        orders = list(expired[:batch_size])
+        for order in orders:
+            cancelled += cancel_order(order, notes='Payment not received in time', unpaid_only=True)
+        if len(orders) < batch_size:
+            return cancelled
+
+
+def _idempotency_cache_key(user, key):
+    return f'checkout:idempotency:{user.pk}:{hashlib.sha1(key.encode()).hexdigest()}'
+
+
+def request_fingerprint(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def claim_idempotency_key(user, key, fingerprint):
+    """Claim ``key`` for a new checkout
+
+    Returns None when the key is new (the caller places the order), otherwise the stored
+    entry: ``{'state': 'pending'}`` while the first request is still running or
+    ``{'state': 'done', 'fingerprint': ..., 'response': ...}`` once it finished.
+    """
+    timeout = getattr(settings, 'CHECKOUT_IDEMPOTENCY_TIMEOUT', 24 * 60 * 60)
+    entry = {'state': IDEMPOTENCY_PENDING, 'fingerprint': fingerprint}
+    cache_key = _idempotency_cache_key(user, key)
+    # cache.add is a SET NX on redis: exactly one of the concurrent submits claims the key
+    if cache.add(cache_key, entry, timeout):
+        return None
+    return cache.get(cache_key) or entry
+
+
+def store_idempotent_response(user, key, fingerprint, status_code, data):
+    timeout = getattr(settings, 'CHECKOUT_IDEMPOTENCY_TIMEOUT', 24 * 60 * 60)
+    cache.set(_idempotency_cache_key(user, key), {
+        'state': 'done', 'fingerprint': fingerprint, 'status_code': status_code, 'response': data,
+    }, timeout)
+
+
+def release_idempotency_key(user, key):
+    """Forget a key whose checkout failed, so the client can retry it"""
+    cache.delete(_idempotency_cache_key(user, key))
@@ -0,0 +1,173 @@
+"""
+Buffered engagement counters for blog posts.
+
+Reads and likes/shares only HINCRBY a redis hash and push the view analytics row
+(with the time of the view) to a redis list; ``flush_blog_counters`` (run by celery
+beat) applies the pending deltas with one F() UPDATE per post and bulk inserts the
+BlogPostView rows. ``apply_pending_counters`` adds the unflushed deltas to a payload.
+The views of posts or users deleted before the flush are dropped (their rows would
+have been cascaded), a view that still cannot be inserted goes to the
+``blog_counters:views:failed`` list instead of blocking the queue.
+
+Without redis (local memory cache in dev/tests) the writes go straight to the
+database, still with F() expressions so no increment is lost.
+"""
+import json
+import logging
+
+from django.db import DataError, IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from account.models import User
+from utils.cache import drop_redis_hash, get_redis_client, restore_redis_hash, take_redis_hash
+from web.models import BlogPost, BlogPostView
+
+logger = logging.getLogger(__name__)
+
+PENDING_COUNTERS_KEY = 'blog_counters:pending'
+PENDING_VIEWS_KEY = 'blog_counters:views'
+FAILED_VIEWS_KEY = 'blog_counters:views:failed'
+BUFFERED_COUNTERS = ('views_count', 'likes_count', 'shares_count')
+
+
+def increment_blog_counter(post_id, field, amount=1):
+    """Add ``amount`` to a counter of a post, returns the counter's pending (unflushed) delta"""
+    if field not in BUFFERED_COUNTERS:
+        raise ValueError(f'{field} is not a buffered blog post counter')
+
+    redis = get_redis_client()
+    if redis is None:
+        BlogPost.all_objects.filter(pk=post_id).update(**{field: F(field) + amount})
+        return 0
+    return redis.hincrby(PENDING_COUNTERS_KEY, f'{post_id}:{field}', amount)
+
+
+def get_pending_counters(post_id):
+    """Unflushed deltas of a post, ``{'views_count': 3, ...}``"""
+    redis = get_redis_client()
+    if redis is None:
+        return {field: 0 for field in BUFFERED_COUNTERS}
+    values = redis.hmget(PENDING_COUNTERS_KEY, [f'{post_id}:{field}' for field in BUFFERED_COUNTERS])
+    return {field: int(value or 0) for field, value in zip(BUFFERED_COUNTERS, values)}
+
+
+def apply_pending_counters(post_id, data):
+    """Add the unflushed deltas of a post to the counters of its serialized ``data``"""
+    for field, delta in get_pending_counters(post_id).items():
+        if field in data:
+            data[field] += delta
+    return data
+
+
+def record_blog_post_view(post, request, ip_address):
+    """Count a read of ``post`` and queue its BlogPostView analytics row"""
+    view = {
+        'post_id': str(post.pk),
+        'user_id': str(request.user.pk) if request.user.is_authenticated else None,
+        'session_key': request.session.session_key if hasattr(request, 'session') else None,
+        'ip_address': ip_address,
+        'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+        'referrer': request.META.get('HTTP_REFERER', '') or None,
+        'viewed_at': timezone.now().isoformat(),
+    }
+
+    redis = get_redis_client()
+    if redis is None:
+        increment_blog_counter(post.pk, 'views_count')
+        BlogPostView.objects.create(**{**view, 'viewed_at': parse_datetime(view['viewed_at'])})
+        return
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.hincrby(PENDING_COUNTERS_KEY, f'{post.pk}:views_count', 1)
+    pipe.rpush(PENDING_VIEWS_KEY, json.dumps(view))
+    pipe.execute()
+
+
+def flush_blog_counters(views_batch_size=1000):
+    """Apply the buffered counters and views to the database
+
+    Returns ``(posts_updated, views_inserted)``.
+    """
+    redis = get_redis_client()
+    if redis is None:
+        return 0, 0
+
+    flushing_key, pending = take_redis_hash(redis, PENDING_COUNTERS_KEY)
+    deltas = {}
+    for key, value in pending.items():
+        post_id, field = key.rsplit(':', 1)
+        deltas.setdefault(post_id, {})[field] = value
+
+    try:
+        with transaction.atomic():
+            for post_id, fields in deltas.items():
+                BlogPost.all_objects.filter(pk=post_id).update(
+                    **{field: F(field) + delta for field, delta in fields.items() if delta}
+                )
+    except Exception:
+        # put the deltas back for the next flush
+        restore_redis_hash(redis, PENDING_COUNTERS_KEY, flushing_key, pending)
+        raise
+    drop_redis_hash(redis, PENDING_COUNTERS_KEY, flushing_key)
+
+    views_inserted = 0
+    while True:
+        pipe = redis.pipeline()
+        pipe.lrange(PENDING_VIEWS_KEY, 0, views_batch_size - 1)
+        pipe.ltrim(PENDING_VIEWS_KEY, views_batch_size, -1)
+        batch, _ = pipe.execute()
+        if not batch:
+            break
+        views = _blog_post_views(batch)
+        try:
+            with transaction.atomic():
+                BlogPostView.objects.bulk_create([view for _, view in views], batch_size=views_batch_size)
+        except (IntegrityError, DataError):
+            views_inserted += _insert_views(redis, views)
+        except Exception:
+            redis.rpush(PENDING_VIEWS_KEY, *batch)
+            raise
+        else:
+            views_inserted += len(views)
+
+    logger.info('Flushed blog counters of %s posts and %s views', len(deltas), views_inserted)
+    return len(deltas), views_inserted
+
+
+def _blog_post_views(batch):
+    """``(queued json, BlogPostView)`` of a batch, without the views of deleted posts or users"""
+    views = [json.loads(view) for view in batch]
+    post_ids = set(map(str, BlogPost.all_objects.filter(
+        pk__in={view['post_id'] for view in views}).values_list('pk', flat=True)))
+    user_ids = set(map(str, User.all_objects.filter(
+        pk__in={view['user_id'] for view in views if view['user_id']}).values_list('pk', flat=True)))
+    known = [
+        (raw, _blog_post_view(view)) for raw, view in zip(batch, views)
+        if view['post_id'] in post_ids and (not view['user_id'] or view['user_id'] in user_ids)
+    ]
+    if len(known) < len(batch):
+        logger.info('Dropped %s views of deleted posts or users', len(batch) - len(known))
+    return known
+
+
+def _insert_views(redis, views):
+    """Insert the views one at a time, the ones that fail go to the failed list"""
+    inserted = 0
+    for raw, view in views:
+        try:
+            with transaction.atomic():
+                view.save(force_insert=True)
+        except (IntegrityError, DataError):
+            logger.exception('Could not insert a blog post view, moved to %s', FAILED_VIEWS_KEY)
+            redis.rpush(FAILED_VIEWS_KEY, raw)
+        else:
+            inserted += 1
+    return inserted
+
+
+def _blog_post_view(view):
+    # views queued before viewed_at was part of the payload get the flush time
+    viewed_at = view.pop('viewed_at', None)
+    return BlogPostView(**view, viewed_at=parse_datetime(viewed_at) if viewed_at else timezone.now())
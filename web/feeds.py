@@ -0,0 +1,227 @@
+"""
+Streaming catalog feeds and sitemaps.
+
+The product feeds (Google Merchant XML, TSV and JSONL) and the sitemaps are rendered
+as generators of text chunks: the products are walked with ``.iterator()`` and the
+brand, category, images and variant stock are joined or prefetched per chunk, so an
+export holds one chunk in memory whatever the size of the catalog. The same
+generators back the streaming views (web.views) and the gzip files written by the
+export_feeds command.
+
+A feed exported ``since`` a date holds the products updated after it, the inactive
+ones included (as out of stock) so that the marketplaces pick up the removals.
+"""
+import csv
+import gzip
+import io
+import json
+import math
+import os
+from xml.sax.saxutils import escape
+
+from django.db.models import IntegerField, OuterRef, Prefetch, Subquery, Sum
+
+from oumraa import settings
+from product.models import Product, ProductImage, ProductVariant
+from web.models import BlogPost
+
+GOOGLE_NAMESPACE = 'http://base.google.com/ns/1.0'
+SITEMAP_NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+FEED_FIELDS = [
+    'id', 'title', 'description', 'link', 'image_link', 'additional_image_link', 'availability', 'price',
+    'sale_price', 'brand', 'condition', 'product_type', 'mpn', 'quantity', 'updated_at',
+]
+MAX_ADDITIONAL_IMAGES = 10
+
+
+def site_url():
+    return getattr(settings, 'SITE_URL', 'https://oumraa.com').rstrip('/')
+
+
+def feed_chunk_size():
+    return getattr(settings, 'FEED_CHUNK_SIZE', 1000)
+
+
+def sitemap_shard_size():
+    # the sitemap protocol allows 50,000 urls per file
+    return getattr(settings, 'SITEMAP_SHARD_SIZE', 50000)
+
+
+def product_url(product):
+    return f'{site_url()}/product/{product.pk}/'
+
+
+def blog_post_url(post):
+    return f'{site_url()}/blog/{post.pk}/'
+
+
+def feed_queryset(since=None):
+    """Products of the feed with the brand, category, ready images and variant stock attached"""
+    queryset = Product.all_objects.filter(updated_on__gte=since) if since else Product.active_objects.all()
+    variant_stock = ProductVariant.objects.filter(product=OuterRef('pk'), status='active').order_by().values(
+        'product').annotate(total=Sum('stock_quantity')).values('total')
+    return queryset.select_related('brand', 'sub_category__category').annotate(
+        # None without active variants
+        variant_stock=Subquery(variant_stock, output_field=IntegerField()),
+    ).prefetch_related(
+        Prefetch('images', queryset=ProductImage.objects.filter(processing_status='ready').order_by(
+            '-is_primary', 'sort_order', 'id'), to_attr='feed_images'),
+    ).order_by('pk')
+
+
+def feed_item(product):
+    """The feed attributes of ``product`` (see feed_queryset), prices as strings"""
+    currency = getattr(settings, 'FEED_CURRENCY', 'INR')
+    quantity = product.stock_quantity if product.variant_stock is None else product.variant_stock
+    in_stock = product.status == 'active' and (quantity > 0 or product.allow_backorder or not product.track_inventory)
+    images = [image.large_url or image.original_url for image in product.feed_images]
+    on_sale = product.compare_price and product.compare_price > product.price
+    return {
+        'id': product.sku,
+        'title': product.name,
+        'description': product.short_description or product.description,
+        'link': product_url(product),
+        'image_link': images[0] if images else '',
+        'additional_image_link': images[1:MAX_ADDITIONAL_IMAGES + 1],
+        'availability': 'in_stock' if in_stock else 'out_of_stock',
+        'price': f'{product.compare_price if on_sale else product.price} {currency}',
+        'sale_price': f'{product.price} {currency}' if on_sale else '',
+        'brand': product.brand.name if product.brand_id else '',
+        'condition': 'new',
+        'product_type': f'{product.sub_category.category.name} > {product.sub_category.name}',
+        'mpn': product.sku,
+        'quantity': max(quantity or 0, 0),
+        'updated_at': product.updated_on.isoformat(),
+    }
+
+
+def _xml_item(item):
+    elements = []
+    for field in FEED_FIELDS:
+        values = item[field] if isinstance(item[field], list) else [item[field]]
+        tag = field if field in ('title', 'description', 'link') else f'g:{field}'
+        elements.extend(f'<{tag}>{escape(str(value))}</{tag}>' for value in values if value != '')
+    return f'<item>{"".join(elements)}</item>\n'
+
+
+def _tsv_row(writer, buffer, item):
+    buffer.seek(0)
+    buffer.truncate()
+    writer.writerow([
+        ','.join(item[field]) if isinstance(item[field], list) else ' '.join(str(item[field]).split())
+        for field in FEED_FIELDS
+    ])
+    return buffer.getvalue()
+
+
+def render_feed(feed_format, since=None):
+    """Yield the feed of ``feed_format`` (``xml``, ``tsv`` or ``jsonl``) in text chunks"""
+    if feed_format == 'xml':
+        yield (f'<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0" xmlns:g="{GOOGLE_NAMESPACE}">'
+               f'<channel><title>{escape(getattr(settings, "FEED_TITLE", "Oumraa"))}</title>'
+               f'<link>{escape(site_url())}</link><description>Product feed</description>\n')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter='\t', lineterminator='\n')
+    if feed_format == 'tsv':
+        buffer.write('\t'.join(FEED_FIELDS) + '\n')
+        yield buffer.getvalue()
+
+    chunk = []
+    for product in feed_queryset(since).iterator(chunk_size=feed_chunk_size()):
+        item = feed_item(product)
+        if feed_format == 'xml':
+            chunk.append(_xml_item(item))
+        elif feed_format == 'tsv':
+            chunk.append(_tsv_row(writer, buffer, item))
+        else:
+            chunk.append(json.dumps(item, ensure_ascii=False) + '\n')
+        if len(chunk) >= feed_chunk_size():
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+    if feed_format == 'xml':
+        yield '</channel></rss>\n'
+
+
+FEED_FORMATS = {
+    'xml': 'application/xml; charset=utf-8',
+    'tsv': 'text/tab-separated-values; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def sitemap_sections():
+    """section -> (queryset of the urls, url of an object)"""
+    return {
+        'products': (Product.active_objects.all(), product_url),
+        'blog': (BlogPost.active_objects.filter(post_status='published'), blog_post_url),
+    }
+
+
+def sitemap_shard_count(section):
+    queryset, _ = sitemap_sections()[section]
+    return math.ceil(queryset.count() / sitemap_shard_size())
+
+
+def render_sitemap_index(shard_url):
+    """Yield the sitemap index, ``shard_url(section, number)`` is the url of a shard"""
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_NAMESPACE}">\n'
+    for section in sitemap_sections():
+        for number in range(1, sitemap_shard_count(section) + 1):
+            yield f'<sitemap><loc>{escape(shard_url(section, number))}</loc></sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+def render_sitemap_shard(section, number):
+    """The chunks of shard ``number`` (from 1) of ``section``, None if it doesn't exist"""
+    if section not in sitemap_sections() or number < 1:
+        return None
+    queryset, url = sitemap_sections()[section]
+    size = sitemap_shard_size()
+    # the first pk of the shard from the pk index, then a keyset range instead of a deep offset
+    start = list(queryset.order_by('pk').values_list('pk', flat=True)[(number - 1) * size:(number - 1) * size + 1])
+    if not start:
+        return None
+    objects = queryset.filter(pk__gte=start[0]).order_by('pk').only('pk', 'updated_on')[:size]
+
+    def render():
+        yield f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NAMESPACE}">\n'
+        chunk = []
+        for obj in objects.iterator(chunk_size=feed_chunk_size()):
+            chunk.append(f'<url><loc>{escape(url(obj))}</loc><lastmod>{obj.updated_on.date().isoformat()}'
+                         f'</lastmod></url>\n')
+            if len(chunk) >= feed_chunk_size():
+                yield ''.join(chunk)
+                chunk = []
+        yield ''.join(chunk)
+        yield '</urlset>\n'
+
+    return render()
+
+
+def write_chunks(path, chunks):
+    """Write text ``chunks`` to ``path``, gzipped if it ends with .gz"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt', encoding='utf-8') as file:
+        for chunk in chunks:
+            file.write(chunk)
+    return path
+
+
+def write_sitemaps(directory, base_url):
+    """Write the gzipped shards and their index to ``directory``, hosted at ``base_url``"""
+    os.makedirs(directory, exist_ok=True)
+    base_url = base_url.rstrip('/')
+    paths = []
+    for section in sitemap_sections():
+        for number in range(1, sitemap_shard_count(section) + 1):
+            paths.append(write_chunks(os.path.join(directory, f'sitemap-{section}-{number}.xml.gz'),
+                                      render_sitemap_shard(section, number)))
+    paths.append(write_chunks(
+        os.path.join(directory, 'sitemap.xml'),
+        render_sitemap_index(lambda section, number: f'{base_url}/sitemap-{section}-{number}.xml.gz'),
+    ))
+    return paths
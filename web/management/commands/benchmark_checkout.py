@@ -0,0 +1,73 @@
+import time
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from product.models import Cart, CartItem, Product
+from utils.profiling import collect_request_metrics, percentile
+from utils.testing import LOCMEM_CACHES, seed_dataset
+from web.checkout import release_idempotency_key
+from web.views import CheckoutView
+
+
+class Command(BaseCommand):
+    help = ('Measure the checkout latency for carts of different sizes, on throwaway data that is rolled back. '
+            'Runs on a local cache without committing, not comparable to production latency')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', default='1,10,50', help='Comma separated cart sizes (default: 1,10,50)')
+        parser.add_argument('--iterations', type=int, default=200, help='Checkouts per cart size (default: 200)')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['lines'].split(',')]
+        except ValueError:
+            raise CommandError('--lines must be a comma separated list of numbers')
+
+        # one outer transaction, so the checkout transactions are savepoints that never commit, and a process
+        # local cache, so the runs take no order numbers from the shared redis and make no redis round trips:
+        # the timings compare cart sizes and code changes, they are not production checkout latency
+        with override_settings(CACHES=LOCMEM_CACHES), transaction.atomic():
+            seed = seed_dataset(products=max(sizes), reviews_per_product=0, blog_posts=1)
+            Product.objects.filter(pk__in=[product.pk for product in seed.products]).update(
+                stock_quantity=len(sizes) * options['iterations'] * 10
+            )
+            self.stdout.write(f'{"lines":>6} {"runs":>6} {"queries":>8} {"p50 ms":>8} {"p95 ms":>8} '
+                              f'{"p99 ms":>8} {"max ms":>8}')
+            for size in sizes:
+                timings, queries = self.benchmark(seed, size, options['iterations'])
+                self.stdout.write(
+                    f'{size:>6} {len(timings):>6} {queries:>8} {percentile(timings, 50):>8.2f} '
+                    f'{percentile(timings, 95):>8.2f} {percentile(timings, 99):>8.2f} {max(timings):>8.2f}'
+                )
+            transaction.set_rollback(True)
+        self.stdout.write('Savepoints on a local cache: compare runs with each other, not with production latency')
+
+    def benchmark(self, seed, size, iterations):
+        factory = APIRequestFactory()
+        view = CheckoutView.as_view()
+        data = {'shipping_address_id': str(seed.address.pk)}
+        timings, queries = [], 0
+
+        for _ in range(iterations):
+            cart = Cart.objects.create(user=seed.user)
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=product, quantity=1, unit_price=product.price)
+                for product in seed.products[:size]
+            ])
+            key = f'benchmark-{uuid4()}'
+            request = factory.post('/api/web/checkout/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+            force_authenticate(request, seed.user)
+
+            with collect_request_metrics() as metrics:
+                start = time.perf_counter()
+                response = view(request)
+                timings.append((time.perf_counter() - start) * 1000)
+            release_idempotency_key(seed.user, key)
+            if response.status_code != 201:
+                raise CommandError(f'Checkout failed: {response.data}')
+            queries = metrics.queries
+        return timings, queries
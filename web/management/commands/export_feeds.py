@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from web.feeds import FEED_FORMATS, render_feed, site_url, write_chunks, write_sitemaps
+
+
+class Command(BaseCommand):
+    help = 'Write the product feed and/or the sitemaps to files (gzipped when the name ends with .gz)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--feed', help='Product feed file, e.g. products.xml.gz')
+        parser.add_argument('--format', choices=sorted(FEED_FORMATS), default='xml', help='Feed format (default: xml)')
+        parser.add_argument('--since', help='Only the products updated since this ISO 8601 datetime')
+        parser.add_argument('--sitemap-dir', help='Directory of the sitemap index and its shards')
+        parser.add_argument('--sitemap-url', help='Url the sitemap directory is served at (default: SITE_URL)')
+
+    def handle(self, *args, **options):
+        if not options['feed'] and not options['sitemap_dir']:
+            raise CommandError('Nothing to export, pass --feed and/or --sitemap-dir')
+
+        since = options['since']
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                raise CommandError('--since must be an ISO 8601 datetime')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        if options['feed']:
+            write_chunks(options['feed'], render_feed(options['format'], since))
+            self.stdout.write(self.style.SUCCESS(f'Wrote {options["feed"]}'))
+        if options['sitemap_dir']:
+            paths = write_sitemaps(options['sitemap_dir'], options['sitemap_url'] or site_url())
+            self.stdout.write(self.style.SUCCESS(f'Wrote {len(paths)} sitemap files to {options["sitemap_dir"]}'))
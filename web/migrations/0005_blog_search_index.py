@@ -0,0 +1,42 @@
+from django.db import migrations
+
+from utils.search import SearchIndex
+
+BLOG_SEARCH_FIELDS = [
+    ('title', 'A'),
+    ('tags', 'B'),
+    ('category', 'B'),
+    ('excerpt', 'C'),
+    ('author', 'C'),
+    ('content', 'D'),
+]
+
+
+def create_blog_search_index(apps, schema_editor):
+    index = SearchIndex('blog_search', apps.get_model('web', 'BlogPost'), BLOG_SEARCH_FIELDS)
+    index.create()
+
+    posts = apps.get_model('web', 'BlogPost').objects.select_related('category', 'author').prefetch_related('tags')
+    index.update_many((post.pk, {
+        'title': post.title,
+        'tags': ' '.join(tag.name for tag in post.tags.all()),
+        'category': post.category.name,
+        'excerpt': post.excerpt,
+        'author': f'{post.author.username} {post.author.first_name} {post.author.last_name}',
+        'content': post.content,
+    }) for post in posts.iterator(chunk_size=500))
+
+
+def drop_blog_search_index(apps, schema_editor):
+    SearchIndex('blog_search', apps.get_model('web', 'BlogPost'), BLOG_SEARCH_FIELDS).drop()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0004_alter_blogcomment_guest_email_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_blog_search_index, drop_blog_search_index),
+    ]
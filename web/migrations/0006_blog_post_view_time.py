@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:54
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0005_blog_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blogpostview',
+            name='viewed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+from utils.search import SearchIndex
+
+BLOG_SEARCH_FIELDS = [
+    ('title', 'A'),
+    ('tags', 'B'),
+    ('category', 'B'),
+    ('excerpt', 'C'),
+    ('author', 'C'),
+    ('content', 'D'),
+]
+
+
+def reindex_blog_posts(apps, schema_editor):
+    # the documents indexed before were the raw HTML, their snippets cut through tags
+    index = SearchIndex('blog_search', apps.get_model('web', 'BlogPost'), BLOG_SEARCH_FIELDS)
+    if not index.available:
+        return
+
+    posts = apps.get_model('web', 'BlogPost').objects.select_related('category', 'author').prefetch_related('tags')
+    index.rebuild((post.pk, {
+        'title': post.title,
+        'tags': ' '.join(tag.name for tag in post.tags.all()),
+        'category': post.category.name,
+        'excerpt': post.excerpt,
+        'author': f'{post.author.username} {post.author.first_name} {post.author.last_name}',
+        'content': post.content,
+    }) for post in posts.iterator(chunk_size=500))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0006_blog_post_view_time'),
+    ]
+
+    operations = [
+        migrations.RunPython(reindex_blog_posts, migrations.RunPython.noop),
+    ]
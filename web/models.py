@@ -2,6 +2,7 @@ from django.db import models
 from django.utils import timezone
 
 from account.models import User
+from utils.cache import invalidate_cache_tags
 from utils.models import ModelMixin
 from web.choices import *
 
@@ -37,7 +38,20 @@ class BlogCategory(ModelMixin):
     def save(self, *args, **kwargs):
         if not self.meta_title:
             self.meta_title = self.name
+        # the posts index the name only, the other edits don't touch the search index
+        renamed = not self._state.adding and \
+            BlogCategory.all_objects.filter(pk=self.pk).exclude(name=self.name).exists()
         super().save(*args, **kwargs)
+        invalidate_cache_tags('blog_categories', f'blog_category:{self.pk}', source='blog_category')
+
+        if renamed:
+            from web.search import update_blog_search_index
+            update_blog_search_index(self.posts.all())
+
+    def delete(self, *args, **kwargs):
+        tags = ['blog_categories', f'blog_category:{self.pk}']
+        super().delete(*args, **kwargs)
+        invalidate_cache_tags(*tags, source='blog_category')
 
     @property
     def full_name(self):
@@ -105,6 +119,9 @@ class BlogPost(ModelMixin):
     allow_comments = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False, db_index=True)
 
+    COUNTER_FIELDS = {'views_count', 'likes_count', 'shares_count', 'comments_count'}
+    SEARCH_FIELDS = {'title', 'excerpt', 'content', 'category', 'category_id', 'author', 'author_id'}
+
     class Meta:
         db_table = 'blog_posts'
         ordering = ['-created_at']
@@ -138,6 +155,24 @@ class BlogPost(ModelMixin):
 
         super().save(*args, **kwargs)
 
+        # Engagement counters are not part of the cached listings' invalidation contract
+        update_fields = kwargs.get('update_fields')
+        if not update_fields or not set(update_fields) <= self.COUNTER_FIELDS:
+            invalidate_cache_tags('blogs', f'blog_post:{self.pk}', source='blog_post')
+
+        if update_fields is None or set(update_fields) & self.SEARCH_FIELDS:
+            from web.search import update_blog_search_index
+            update_blog_search_index([self])
+
+    def delete(self, *args, **kwargs):
+        from web.search import blog_search_index
+
+        pk, tags = self.pk, ['blogs', f'blog_post:{self.pk}']
+        result = super().delete(*args, **kwargs)
+        invalidate_cache_tags(*tags, source='blog_post')
+        blog_search_index.remove(pk)
+        return result
+
     @property
     def is_published(self):
         """Check if post is published"""
@@ -153,9 +188,9 @@ class BlogPost(ModelMixin):
     #     return f"{self.estimated_read_time} minutes read"
 
     def increment_views(self):
-        """Increment view count"""
-        self.views_count += 1
-        self.save(update_fields=['views_count'])
+        """Increment view count, buffered and applied by the blog counters flush"""
+        from web.counters import increment_blog_counter
+        increment_blog_counter(self.pk, 'views_count')
 
     def get_related_posts(self, limit=5):
         """Get related posts based on category and tags"""
@@ -257,7 +292,8 @@ class BlogPostView(ModelMixin):
     ip_address = models.GenericIPAddressField()
     user_agent = models.TextField(blank=True)
     referrer = models.URLField(blank=True, null=True)
-    viewed_at = models.DateTimeField(auto_now_add=True)
+    # set when the view is recorded, the row itself may be inserted later by the counters flush
+    viewed_at = models.DateTimeField(default=timezone.now, editable=False)
     time_spent = models.IntegerField(default=0, help_text='Time spent reading in seconds')
     scroll_percentage = models.IntegerField(default=0, help_text='Percentage of page scrolled')
 
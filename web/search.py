@@ -0,0 +1,59 @@
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from utils.search import SearchIndex
+from web.models import BlogPost
+
+BLOG_SEARCH_FIELDS = [
+    ('title', 'A'),
+    ('tags', 'B'),
+    ('category', 'B'),
+    ('excerpt', 'C'),
+    ('author', 'C'),
+    ('content', 'D'),
+]
+
+blog_search_index = SearchIndex('blog_search', BlogPost, BLOG_SEARCH_FIELDS)
+
+
+def blog_search_document(post):
+    return {
+        'title': post.title,
+        'tags': ' '.join(tag.name for tag in post.tags.all()),
+        'category': post.category.name,
+        'excerpt': post.excerpt,
+        'author': f'{post.author.username} {post.author.get_full_name()}',
+        'content': post.content,
+    }
+
+
+def update_blog_search_index(posts):
+    """(Re)index ``posts``, a queryset or a list of blog posts"""
+    if hasattr(posts, 'select_related'):
+        posts = posts.select_related('category', 'author').prefetch_related('tags')
+    blog_search_index.update_many((post.pk, blog_search_document(post)) for post in posts)
+
+
+def rebuild_blog_search_index():
+    posts = BlogPost.all_objects.select_related('category', 'author').prefetch_related('tags')
+    blog_search_index.rebuild((post.pk, blog_search_document(post)) for post in posts.iterator(chunk_size=500))
+
+
+def search_blog_posts(queryset, query):
+    """Filter ``queryset`` to the posts matching ``query``, best matches first
+
+    The posts are annotated with ``search_rank`` and ``search_snippet`` (an excerpt of
+    the content with the matched terms in <mark>).
+    """
+    return blog_search_index.search(queryset, query, snippet_field='content')
+
+
+@receiver(m2m_changed, sender=BlogPost.tags.through)
+def reindex_blog_post_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # tag.posts.add(...), pk_set holds post ids (None on clear)
+        update_blog_search_index(instance.posts.all() if pk_set is None else BlogPost.all_objects.filter(pk__in=pk_set))
+    else:
+        update_blog_search_index([instance])
@@ -7,7 +7,10 @@ from rest_framework import serializers
 from account.models import User
 from oumraa import settings
 from product.models import Category, SubCategory, Product, ProductImage, Brand, ProductAttribute, ProductVariant, \
-    Review, ProductTax, ProductVariantAttribute, Coupon, ProductFAQ, CartItem, Cart, Banner, ReviewMedia
+    Review, ProductTax, ProductVariantAttribute, Coupon, ProductFAQ, CartItem, Cart, Banner, ReviewMedia, \
+    ProductRatingSummary, Order, OrderItem
+from product.flash_sales import overlay_sale_price
+from product.helpers import product_listing_queryset
 from web.helpers import CartManager
 from web.models import BlogCategory, BlogTag, BlogComment, BlogPost
 
@@ -67,9 +70,10 @@ class ProductSerializer(serializers.ModelSerializer):
             stock_info['estimated_delivery'] = '2-3 business days'
 
         # Variant stock info
-        if obj.variants.filter(status='active').exists():
+        active_variants = obj.active_variants
+        if active_variants:
             variant_stock = []
-            for variant in obj.variants.filter(status='active'):
+            for variant in active_variants:
                 variant_stock.append({
                     'variant_id': str(variant.id),
                     'sku': variant.sku,
@@ -82,41 +86,16 @@ class ProductSerializer(serializers.ModelSerializer):
 
     def get_rating_summary(self, obj):
         """Get comprehensive rating summary"""
-        reviews = obj.reviews.filter(is_approved=True)
+        return ProductRatingSummary.for_product(obj)
 
-        if not reviews.exists():
-            return {
-                'average_rating': 0,
-                'total_reviews': 0,
-                'rating_distribution': {str(i): 0 for i in range(1, 6)},
-                'percentage_distribution': {str(i): 0 for i in range(1, 6)}
-            }
-
-        rating_counts = {}
-        total_reviews = reviews.count()
-
-        for i in range(1, 6):
-            count = reviews.filter(rating=i).count()
-            rating_counts[str(i)] = count
-
-        percentage_distribution = {}
-        for rating, count in rating_counts.items():
-            percentage_distribution[rating] = round((count / total_reviews) * 100, 1) if total_reviews > 0 else 0
-
-        avg_rating = reviews.aggregate(avg=Avg('rating'))['avg'] or 0
-
-        return {
-            'average_rating': round(avg_rating, 1),
-            'total_reviews': total_reviews,
-            'rating_distribution': rating_counts,
-            'percentage_distribution': percentage_distribution,
-            'verified_purchases': reviews.filter(is_verified_purchase=True).count()
-        }
+    def to_representation(self, instance):
+        return overlay_sale_price(super().to_representation(instance))
 
     class Meta:
         model = Product
-        fields = ('id', 'name', 'short_description', 'sku', 'price', 'primary_image_url', 'category_name',
-                  'sub_category_name', 'is_featured', 'is_popular', 'is_best_seller', 'stock_info', 'rating_summary')
+        fields = ('id', 'name', 'short_description', 'sku', 'price', 'primary_image_url', 'primary_image_sources',
+                  'category_name', 'sub_category_name', 'is_featured', 'is_popular', 'is_best_seller', 'stock_info',
+                  'rating_summary')
 
 
 class BlogCategorySerializer(serializers.ModelSerializer):
@@ -184,6 +163,15 @@ class BlogPostListSerializer(serializers.ModelSerializer):
         ]
 
 
+class BlogPostSearchSerializer(BlogPostListSerializer):
+    """Blog post list item of a search result, see web.search.search_blog_posts"""
+    search_rank = serializers.FloatField(read_only=True)
+    search_snippet = serializers.CharField(read_only=True)
+
+    class Meta(BlogPostListSerializer.Meta):
+        fields = BlogPostListSerializer.Meta.fields + ['search_rank', 'search_snippet']
+
+
 class BlogPostDetailSerializer(serializers.ModelSerializer):
     """Detailed serializer for single blog post"""
     author_name = serializers.CharField(source='author.get_full_name', read_only=True)
@@ -294,13 +282,15 @@ class BlogCommentCreateSerializer(serializers.ModelSerializer):
 class ProductImageDetailSerializer(serializers.ModelSerializer):
     """Detailed serializer for product images"""
     responsive_urls = serializers.SerializerMethodField()
+    format_srcsets = serializers.ReadOnlyField()
 
     class Meta:
         model = ProductImage
         fields = [
             'id', 'thumbnail_url', 'medium_url', 'large_url', 'original_url',
             'alt_text', 'is_primary', 'sort_order', 'original_filename',
-            'original_width', 'original_height', 'responsive_urls', 'created_at'
+            'original_width', 'original_height', 'processing_status', 'responsive_urls', 'format_srcsets',
+            'created_at'
         ]
 
     def get_responsive_urls(self, obj):
@@ -403,10 +393,12 @@ class ReviewMediaSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ReviewMedia
-        fields = ['id', 'file', 'media_type']
+        fields = ['id', 'file', 'thumbnail_url', 'media_type', 'processing_status']
 
     def get_file(self, obj):
         """Return full URL for media file"""
+        if obj.file_url:
+            return obj.file_url
         request = self.context.get('request')
         if obj.file and hasattr(obj.file, 'url'):
             return request.build_absolute_uri(obj.file.url) if request else obj.file.url
@@ -474,11 +466,12 @@ class RelatedProductSerializer(serializers.ModelSerializer):
         ]
 
     def get_primary_image(self, obj):
-        primary_img = obj.images.filter(is_primary=True).first()
+        primary_img = obj.primary_image
         if primary_img:
             return {
                 'thumbnail': primary_img.thumbnail_url,
                 'medium': primary_img.medium_url,
+                'medium_sources': primary_img.get_format_urls('medium'),
                 'alt_text': primary_img.alt_text
             }
         return None
@@ -579,9 +572,12 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             'created_at', 'updated_on'
         ]
 
+    def to_representation(self, instance):
+        return overlay_sale_price(super().to_representation(instance))
+
     def get_primary_image(self, obj):
         """Get primary image with all sizes"""
-        primary = obj.images.filter(is_primary=True).first()
+        primary = obj.primary_image
         if primary:
             return ProductImageDetailSerializer(primary).data
         return None
@@ -630,39 +626,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
 
     def get_rating_summary(self, obj):
         """Get comprehensive rating summary"""
-        reviews = obj.reviews.filter(is_approved=True)
-
-        if not reviews.exists():
-            return {
-                'average_rating': 0,
-                'total_reviews': 0,
-                'rating_distribution': {str(i): 0 for i in range(1, 6)},
-                'percentage_distribution': {str(i): 0 for i in range(1, 6)}
-            }
-
-        # Calculate rating distribution
-        rating_counts = {}
-        total_reviews = reviews.count()
-
-        for i in range(1, 6):
-            count = reviews.filter(rating=i).count()
-            rating_counts[str(i)] = count
-
-        # Calculate percentages
-        percentage_distribution = {}
-        for rating, count in rating_counts.items():
-            percentage_distribution[rating] = round((count / total_reviews) * 100, 1) if total_reviews > 0 else 0
-
-        # Calculate average
-        avg_rating = reviews.aggregate(avg=Avg('rating'))['avg'] or 0
-
-        return {
-            'average_rating': round(avg_rating, 1),
-            'total_reviews': total_reviews,
-            'rating_distribution': rating_counts,
-            'percentage_distribution': percentage_distribution,
-            'verified_purchases': reviews.filter(is_verified_purchase=True).count()
-        }
+        return ProductRatingSummary.for_product(obj)
 
     def get_pricing_info(self, obj):
         """Get comprehensive pricing information"""
@@ -689,9 +653,9 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             })
 
         # Price range for variants
-        if obj.variants.filter(status='active').exists():
-            variant_prices = obj.variants.filter(status='active').values_list('price', flat=True)
-            variant_prices = [p for p in variant_prices if p is not None]
+        active_variants = obj.active_variants
+        if active_variants:
+            variant_prices = [variant.price for variant in active_variants if variant.price is not None]
 
             if variant_prices:
                 min_price = min(variant_prices)
@@ -779,9 +743,10 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             stock_info['estimated_delivery'] = '2-3 business days'
 
         # Variant stock info
-        if obj.variants.filter(status='active').exists():
+        active_variants = obj.active_variants
+        if active_variants:
             variant_stock = []
-            for variant in obj.variants.filter(status='active'):
+            for variant in active_variants:
                 variant_stock.append({
                     'variant_id': str(variant.id),
                     'sku': variant.sku,
@@ -794,7 +759,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
 
     def get_related_products(self, obj):
         """Get related products"""
-        related = Product.objects.active().filter(
+        related = product_listing_queryset(Product.objects.active()).filter(
             sub_category=obj.sub_category,
             status='active'
         ).exclude(id=obj.id).annotate(avg_rating=Avg('reviews__rating'),
@@ -907,7 +872,7 @@ class ProductMinimalSerializer(serializers.ModelSerializer):
 
     def get_primary_image(self, obj):
         """Get primary image"""
-        primary_img = obj.images.filter(is_primary=True).first()
+        primary_img = obj.primary_image
         if primary_img:
             return {
                 'thumbnail_url': primary_img.thumbnail_url,
@@ -928,7 +893,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = [
             'id', 'product', 'product_variant', 'quantity', 'unit_price',
-            'item_total', 'is_available', 'max_quantity', 'created_on', 'updated_on'
+            'item_total', 'is_available', 'max_quantity', 'created_at', 'updated_on'
         ]
 
     def get_item_total(self, obj):
@@ -958,7 +923,7 @@ class CartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = [
             'id', 'items', 'totals', 'items_count',
-            'created_on', 'updated_on'
+            'created_at', 'updated_on'
         ]
 
     def get_totals(self, obj):
@@ -1220,4 +1185,35 @@ class BlogPostSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'title', 'comments_count']
 
     def get_comments_count(self, obj):
-        return obj.comments.filter(comment_status='approved').count()
\ No newline at end of file
+        return obj.comments.filter(comment_status='approved').count()
+
+
+class CheckoutSerializer(serializers.Serializer):
+    shipping_address_id = serializers.UUIDField()
+    billing_address_id = serializers.UUIDField(required=False, allow_null=True)
+    coupon_code = serializers.CharField(max_length=50, required=False, allow_blank=True)
+    notes = serializers.CharField(required=False, allow_blank=True)
+
+
+class CheckoutOrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'product', 'product_variant', 'product_name', 'product_sku', 'quantity', 'unit_price',
+                  'total_price']
+
+
+class CheckoutOrderSerializer(serializers.ModelSerializer):
+    items = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Order
+        fields = ['id', 'order_number', 'order_status', 'payment_status', 'subtotal', 'tax_amount',
+                  'shipping_amount', 'discount_amount', 'total_amount', 'billing_address', 'shipping_address',
+                  'coupon', 'notes', 'items', 'created_at']
+
+    def get_items(self, obj):
+        # place_order hands the created items over, no need to read them back
+        items = getattr(obj, 'placed_items', None)
+        if items is None:
+            items = obj.items.all()
+        return CheckoutOrderItemSerializer(items, many=True).data
@@ -0,0 +1,14 @@
+from celery import shared_task
+
+from web.checkout import expire_unpaid_orders
+from web.counters import flush_blog_counters
+
+
+@shared_task
+def flush_blog_counters_task():
+    flush_blog_counters()
+
+
+@shared_task
+def expire_unpaid_orders_task():
+    return expire_unpaid_orders()
@@ -1,3 +1,444 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from uuid import uuid4
+from xml.etree import ElementTree
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from product.inventory import commit_reservations, release_expired_reservations
+from product.models import Cart, CartItem, FlashSale, FlashSaleItem, Order, Payment, Product, ProductVariant, \
+    StockReservation
+from utils.pagination import KeysetPagination
+from utils.testing import LOCMEM_CACHES, QueryCountTestMixin, fake_redis, requires_redis, seed_dataset
+from web.checkout import CheckoutError, cancel_order, confirm_order, expire_unpaid_orders
+from web.counters import FAILED_VIEWS_KEY, PENDING_VIEWS_KEY, flush_blog_counters
+from web.models import BlogPost, BlogPostView
+from web.search import search_blog_posts
+
+
+class WebQueryCountTests(QueryCountTestMixin, TestCase):
+    urlconf = 'web.urls'
+    url_prefix = '/api/web/'
+    query_counts = {
+        'Add-to-cart': 17,
+        'card-summary': 8,
+        'checkout': 21,
+        'cart-summary': 8,
+        'clear-cart-item': 3,
+        'comment-create': 2,
+        'comment-detail': 6,
+        'comment-replies': 4,
+        'get-blog': 4,
+        'get-blog-category': 1,
+        'get-blog-details': 19,
+        'get-category': 2,
+        'get-home-faq': 1,
+        'get-product': 4,
+        'get-product-details': 26,
+        'get-product-faq': 1,
+        'get_brand': 1,
+        'get_homepage_banner': 2,
+        'merge.card-summary': 8,
+        'post-comments': 7,
+        'product-feed': 2,
+        'product-search': 5,
+        'product_by_subcategory': 5,
+        'remove-cart-item': 8,
+        'sitemap-index': 2,
+        'sitemap-shard': 2,
+        'update-to-cart': 13,
+    }
+
+    requests = {
+        'product-search': {'data': {'q': 'Seed'}},
+        'comment-create': {'method': 'post', 'data': {'content': 'Comment'}},
+        'update-to-cart': {'method': 'post', 'data': {'quantity': 2}},
+        'remove-cart-item': {'method': 'post'},
+        'checkout': {'method': 'post', 'headers': {'Idempotency-Key': 'query-count'}},
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cart = Cart.objects.create(user=cls.seed.user)
+        cls.cart_item = CartItem.objects.create(cart=cart, product=cls.seed.products[0], quantity=1,
+                                                unit_price=cls.seed.products[0].price)
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('web.views.log_search_query')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_url_kwargs(self, name, params):
+        product_id = str(self.seed.products[0].pk)
+        post_id = str(self.seed.posts[0].pk)
+        comment_id = str(self.seed.comment.pk)
+        return {
+            'get-product-details': {'id': product_id},
+            'get-product-faq': {'id': product_id},
+            'get-blog-details': {'id': post_id},
+            'post-comments': {'post_id': post_id},
+            'comment-create': {'post_id': post_id},
+            'comment-detail': {'pk': comment_id},
+            'comment-replies': {'comment_id': comment_id},
+            'product-feed': {'feed_format': 'jsonl'},
+            'sitemap-shard': {'section': 'products', 'number': 1},
+            'update-to-cart': {'id': str(self.cart_item.pk)},
+            'remove-cart-item': {'item_id': str(self.cart_item.pk)},
+        }.get(name) or super().get_url_kwargs(name, params)
+
+    def get_request(self, name):
+        if name == 'Add-to-cart':
+            return {'method': 'post', 'data': {'product_id': str(self.seed.products[1].pk)}}
+        if name == 'product_by_subcategory':
+            return {'method': 'post', 'data': {'subcategory_ids': [str(self.seed.sub_category.pk)]}}
+        if name == 'checkout':
+            return {**self.requests[name], 'data': {'shipping_address_id': str(self.seed.address.pk)}}
+        return super().get_request(name)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductListingTests(TestCase):
+
+    def setUp(self):
+        seed_dataset(products=3, reviews_per_product=0)
+
+    def test_pages_follow_the_cursor(self):
+        first = self.client.get('/api/web/product/', {'ordering': '-price', 'page_size': 2}).json()
+        cursor = first['next'].split('cursor=')[1].split('&')[0]
+        second = self.client.get('/api/web/product/', {'ordering': '-price', 'page_size': 2, 'cursor': cursor}).json()
+        self.assertEqual(len(first['results']) + len(second['results']), 3)
+        self.assertIsNone(second['next'])
+
+    def test_cursor_value_of_the_wrong_type_is_a_bad_request(self):
+        for payload in ({'o': '-price', 'v': 'abc', 'id': str(Product.objects.first().pk)},
+                        {'o': '-price', 'v': '10', 'id': 'not-a-uuid'}):
+            cursor = KeysetPagination.encode_cursor(payload['o'], payload['v'], payload['id'])
+            response = self.client.get('/api/web/product/', {'ordering': '-price', 'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BlogSearchTests(TestCase):
+
+    def setUp(self):
+        self.posts = seed_dataset(products=1, reviews_per_product=0, blog_posts=2).posts
+
+    def test_posts_are_found_with_a_snippet(self):
+        post = self.posts[1]
+        post.content = 'How to store saffron so it keeps its aroma'
+        post.save()
+        results = list(search_blog_posts(BlogPost.objects.all(), 'saffron aroma'))
+        self.assertEqual(results, [post])
+        self.assertIn('<mark>saffron</mark>', results[0].search_snippet)
+
+    def test_snippets_are_cut_from_the_text_without_markup(self):
+        post = self.posts[1]
+        post.content = '<p class="saffron-intro">Store <strong>saffron</strong> in a jar</p><p>Keep it&nbsp;dry</p>'
+        post.save()
+        # the class attribute is not indexed
+        self.assertEqual(search_blog_posts(BlogPost.objects.all(), 'intro').count(), 0)
+        snippet = search_blog_posts(BlogPost.objects.all(), 'saffron').get().search_snippet
+        self.assertEqual(snippet, 'Store <mark>saffron</mark> in a jar Keep it dry')
+
+    def test_renaming_the_category_reindexes_its_posts(self):
+        category = self.posts[0].category
+        category.name = 'Recipes'
+        category.save()
+        self.assertEqual(search_blog_posts(BlogPost.objects.all(), 'recipes').count(), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BlogCounterTests(TestCase):
+
+    def setUp(self):
+        self.post = seed_dataset(products=1, reviews_per_product=0, blog_posts=1).posts[0]
+
+    def test_detail_counts_the_view_and_adds_the_pending_counters(self):
+        with mock.patch('web.counters.get_pending_counters',
+                        return_value={'views_count': 4, 'likes_count': 2, 'shares_count': 0}):
+            response = self.client.get(f'/api/web/blog/{self.post.pk}/', HTTP_USER_AGENT='tests')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['views_count'], 4)
+        self.assertEqual(BlogPost.objects.get(pk=self.post.pk).views_count, 1)
+        self.assertEqual(BlogPostView.objects.get().user_agent, 'tests')
+        self.assertEqual(self.client.get(f'/api/web/blog/{uuid4()}/').status_code, 404)
+
+    @requires_redis
+    def test_flushed_views_keep_the_time_they_happened(self):
+        viewed_at = timezone.now() - timedelta(minutes=10)
+        redis = fake_redis()
+        redis.rpush(PENDING_VIEWS_KEY, json.dumps({
+            'post_id': str(self.post.pk), 'user_id': None, 'session_key': None, 'ip_address': '127.0.0.1',
+            'user_agent': '', 'referrer': None, 'viewed_at': viewed_at.isoformat(),
+        }))
+        with mock.patch('web.counters.get_redis_client', return_value=redis):
+            self.assertEqual(flush_blog_counters(), (0, 1))
+        self.assertEqual(BlogPostView.objects.get().viewed_at, viewed_at)
+
+    @requires_redis
+    def test_views_that_cannot_be_inserted_do_not_block_the_queue(self):
+        redis = fake_redis()
+        for post_id, ip_address in [(self.post.pk, '10.0.0.1'), (uuid4(), '10.0.0.2'), (self.post.pk, '10.0.0.3'),
+                                    (self.post.pk, '10.0.0.4')]:
+            redis.rpush(PENDING_VIEWS_KEY, json.dumps({
+                'post_id': str(post_id), 'user_id': None, 'session_key': None, 'ip_address': ip_address,
+                'user_agent': '', 'referrer': None, 'viewed_at': timezone.now().isoformat(),
+            }))
+        save = BlogPostView.save
+
+        def bad_row(view, *args, **kwargs):
+            if view.ip_address == '10.0.0.3':
+                raise IntegrityError('bad row')
+            return save(view, *args, **kwargs)
+
+        with mock.patch('web.counters.get_redis_client', return_value=redis), \
+                mock.patch.object(BlogPostView.objects, 'bulk_create', side_effect=IntegrityError('bad row')), \
+                mock.patch.object(BlogPostView, 'save', bad_row), self.assertLogs('web.counters', 'ERROR'):
+            # the view of the deleted post is dropped, the bad row is moved aside
+            self.assertEqual(flush_blog_counters(views_batch_size=10), (0, 2))
+        self.assertEqual(set(BlogPostView.objects.values_list('ip_address', flat=True)), {'10.0.0.1', '10.0.0.4'})
+        self.assertEqual(redis.llen(PENDING_VIEWS_KEY), 0)
+        self.assertEqual(json.loads(redis.lindex(FAILED_VIEWS_KEY, 0))['ip_address'], '10.0.0.3')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CheckoutTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seed = seed_dataset(products=3)
+        cart = Cart.objects.create(user=cls.seed.user)
+        for quantity, product in enumerate(cls.seed.products, start=1):
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity, unit_price=product.price)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.seed.user)
+
+    def checkout(self, key='key-1', **data):
+        data.setdefault('shipping_address_id', str(self.seed.address.pk))
+        return self.client.post('/api/web/checkout/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_checkout_places_the_order(self):
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201, response.data)
+
+        order = Order.objects.get(order_number=response.data['order']['order_number'])
+        self.assertEqual(order.subtotal, 100 * 1 + 101 * 2 + 102 * 3)
+        self.assertEqual(order.total_amount, order.subtotal)
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(order.status_history.get().order_status, 'pending')
+        self.assertEqual(order.shipping_address['city'], 'Jaipur')
+        self.assertEqual(
+            list(Product.objects.order_by('sku').values_list('stock_quantity', flat=True)), [9, 8, 7]
+        )
+        self.assertFalse(Cart.objects.filter(user=self.seed.user, status='active').exists())
+
+    def test_retried_checkout_returns_the_first_order(self):
+        first = self.checkout()
+        retry = self.checkout()
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data['order']['order_number'], first.data['order']['order_number'])
+        self.assertEqual(Order.objects.count(), 1)
+
+        other = self.checkout(notes='Another checkout')
+        self.assertEqual(other.status_code, 422)
+
+    def test_failed_checkout_can_be_retried(self):
+        Product.objects.filter(pk=self.seed.products[2].pk).update(stock_quantity=1)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.seed.products[0].pk).stock_quantity, 10)
+
+        Product.objects.filter(pk=self.seed.products[2].pk).update(stock_quantity=10)
+        self.assertEqual(self.checkout().status_code, 201)
+
+    def test_idempotency_key_is_required(self):
+        response = self.client.post('/api/web/checkout/', {'shipping_address_id': str(self.seed.address.pk)},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_flash_sale_lines_use_the_sale_price_and_limit(self):
+        product = self.seed.products[0]
+        now = timezone.now()
+        sale = FlashSale.objects.create(name='Sale', start_time=now - timedelta(hours=1),
+                                        end_time=now + timedelta(hours=1))
+        item = FlashSaleItem.objects.create(flash_sale=sale, product=product, original_price=product.price,
+                                            sale_price=Decimal('50.00'), stock_limit=1)
+
+        listing = self.client.get('/api/web/product/')
+        on_sale = {row['id']: row['flash_sale'] for row in listing.data['results']}
+        self.assertEqual(on_sale[str(product.pk)]['sale_price'], '50.00')
+
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Decimal(response.data['order']['subtotal']), 50 + 101 * 2 + 102 * 3)
+        item.refresh_from_db()
+        self.assertEqual(item.sold_quantity, 1)
+
+        cart = Cart.objects.create(user=self.seed.user)
+        CartItem.objects.create(cart=cart, product=product, quantity=1, unit_price=product.price)
+        response = self.checkout(key='key-2')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sold out', response.data['error'])
+
+    def stock(self):
+        return list(Product.objects.order_by('sku').values_list('stock_quantity', flat=True))
+
+    def age_order(self, order_number):
+        past = timezone.now() - timedelta(minutes=20)
+        Order.objects.filter(order_number=order_number).update(created_at=past)
+        StockReservation.objects.filter(reference_id=order_number).update(expires_at=past)
+
+    def test_unpaid_orders_expire_with_their_stock_and_sale_claims(self):
+        product = self.seed.products[0]
+        now = timezone.now()
+        sale = FlashSale.objects.create(name='Sale', start_time=now - timedelta(hours=1),
+                                        end_time=now + timedelta(hours=1))
+        item = FlashSaleItem.objects.create(flash_sale=sale, product=product, original_price=product.price,
+                                            sale_price=Decimal('50.00'), stock_limit=1)
+        order_number = self.checkout().data['order']['order_number']
+        self.age_order(order_number)
+
+        # the expired reservations of a pending order wait for its cancellation
+        self.assertEqual(release_expired_reservations(), 0)
+        self.assertEqual(self.stock(), [9, 8, 7])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(expire_unpaid_orders(), 1)
+        order = Order.objects.get(order_number=order_number)
+        self.assertEqual(order.order_status, 'cancelled')
+        self.assertEqual(self.stock(), [10, 10, 10])
+        item.refresh_from_db()
+        self.assertEqual(item.sold_quantity, 0)
+        self.assertRaises(CheckoutError, confirm_order, order)
+        self.assertFalse(cancel_order(order))
+
+    def test_paid_orders_keep_their_stock(self):
+        order = Order.objects.get(order_number=self.checkout().data['order']['order_number'])
+        confirm_order(order)
+        self.age_order(order.order_number)
+
+        self.assertEqual((expire_unpaid_orders(), release_expired_reservations()), (0, 0))
+        self.assertEqual(self.stock(), [9, 8, 7])
+        self.assertEqual(Order.objects.get(pk=order.pk).order_status, 'confirmed')
+
+    def test_order_paid_while_it_expires_is_not_cancelled(self):
+        order = Order.objects.get(order_number=self.checkout().data['order']['order_number'])
+        self.age_order(order.order_number)
+        lock = Order.objects.select_for_update
+
+        def paid_before_the_lock():
+            # the payment commits between the expired orders query and the lock
+            commit_reservations(order.order_number)
+            Order.objects.filter(pk=order.pk).update(order_status='confirmed', payment_status='paid')
+            return lock()
+
+        with mock.patch.object(Order.objects, 'select_for_update', paid_before_the_lock):
+            self.assertEqual(expire_unpaid_orders(), 0)
+        self.assertEqual(self.stock(), [9, 8, 7])
+        self.assertEqual(Order.objects.get(pk=order.pk).order_status, 'confirmed')
+
+    def test_cash_on_delivery_and_other_orders_do_not_expire(self):
+        order = Order.objects.get(order_number=self.checkout().data['order']['order_number'])
+        Payment.objects.create(order=order, payment_method='cod', transaction_id='cod-1', amount=order.total_amount)
+        self.age_order(order.order_number)
+        # not placed by the checkout, nothing is reserved for it
+        legacy = Order.objects.create(order_number='LEGACY-1', user=self.seed.user, subtotal=0, total_amount=0,
+                                      billing_address={}, shipping_address={})
+        Order.objects.filter(pk=legacy.pk).update(created_at=timezone.now() - timedelta(days=1))
+
+        self.assertEqual(expire_unpaid_orders(), 0)
+        self.assertEqual(self.stock(), [9, 8, 7])
+        self.assertEqual(set(Order.objects.values_list('order_status', flat=True)), {'pending'})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FeedTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seed = seed_dataset(products=3, reviews_per_product=0)
+
+    def setUp(self):
+        self.client = APIClient()
+        patcher = mock.patch.multiple('oumraa.settings', create=True, SITE_URL='https://shop.test', FEED_CHUNK_SIZE=2,
+                                      SITEMAP_SHARD_SIZE=2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_feed_streams_every_product_in_constant_queries(self):
+        first, second, third = self.seed.products
+        Product.objects.filter(pk=first.pk).update(compare_price=Decimal('150'))
+        ProductVariant.objects.create(product=second, sku='SEED-1-RED', stock_quantity=0)
+
+        # the products, then their images per chunk of 2
+        with self.assertNumQueries(3):
+            items = [json.loads(line) for line in self.stream('/api/web/feeds/products.jsonl').splitlines()]
+
+        items = {item['id']: item for item in items}
+        self.assertEqual(sorted(items), ['SEED-0', 'SEED-1', 'SEED-2'])
+        self.assertEqual((items['SEED-0']['price'], items['SEED-0']['sale_price']), ('150.00 INR', '100.00 INR'))
+        self.assertEqual(items['SEED-1']['availability'], 'out_of_stock')
+        self.assertEqual(items['SEED-2']['link'], f'https://shop.test/product/{third.pk}/')
+
+        rss = ElementTree.fromstring(self.stream('/api/web/feeds/products.xml'))
+        self.assertEqual(len(rss.findall('channel/item')), 3)
+        rows = self.stream('/api/web/feeds/products.tsv').splitlines()
+        self.assertEqual((rows[0].split('\t')[0], len(rows)), ('id', 4))
+
+    def test_incremental_feed_includes_removed_products(self):
+        since = timezone.now()
+        product = self.seed.products[0]
+        product.deactivate()
+
+        items = [json.loads(line) for line in
+                 self.stream(f'/api/web/feeds/products.jsonl?since={since.isoformat().replace("+", "%2B")}').splitlines()]
+        self.assertEqual([(item['id'], item['availability']) for item in items], [(product.sku, 'out_of_stock')])
+        self.assertEqual(self.client.get('/api/web/feeds/products.jsonl?since=yesterday').status_code, 400)
+        self.assertEqual(self.client.get('/api/web/feeds/products.csv').status_code, 404)
+
+    def test_sitemaps_are_sharded(self):
+        index = ElementTree.fromstring(self.stream('/api/web/sitemap.xml'))
+        shards = [loc.text for loc in index.iter('{http://www.sitemaps.org/schemas/sitemap/0.9}loc')]
+        self.assertEqual([shard.rsplit('/', 1)[1] for shard in shards], [
+            'sitemap-products-1.xml', 'sitemap-products-2.xml', 'sitemap-blog-1.xml', 'sitemap-blog-2.xml',
+        ])
+
+        urls = []
+        for number in (1, 2):
+            shard = ElementTree.fromstring(self.stream(f'/api/web/sitemap-products-{number}.xml'))
+            urls += [loc.text for loc in shard.iter('{http://www.sitemaps.org/schemas/sitemap/0.9}loc')]
+        self.assertEqual(sorted(urls), sorted(f'https://shop.test/product/{p.pk}/' for p in self.seed.products))
+        self.assertEqual(self.client.get('/api/web/sitemap-products-3.xml').status_code, 404)
+
+    def test_export_command_writes_gzip_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            feed = os.path.join(directory, 'products.jsonl.gz')
+            call_command('export_feeds', feed=feed, format='jsonl', sitemap_dir=directory,
+                         sitemap_url='https://cdn.test/sitemaps', stdout=open(os.devnull, 'w'))
+            with gzip.open(feed, 'rt') as file:
+                self.assertEqual(len(file.readlines()), 3)
+            with gzip.open(os.path.join(directory, 'sitemap-blog-2.xml.gz'), 'rt') as file:
+                self.assertEqual(file.read().count('<url>'), 1)
+            with open(os.path.join(directory, 'sitemap.xml')) as file:
+                self.assertIn('https://cdn.test/sitemaps/sitemap-products-1.xml.gz', file.read())
@@ -6,6 +6,7 @@ urlpatterns = [
     path('category/', GetCategoryView.as_view(), name='get-category'),
     path('blog-category/', GetBlogCategoryView.as_view(), name='get-blog-category'),
     path('product/', GetProductView.as_view(), name='get-product'),
+    path('product-search/', ProductSearchView.as_view(), name='product-search'),
     path('faq/', GetFAQView.as_view(), name='get-home-faq'),
     path('product/<str:id>/', GetProductDetailView.as_view(), name='get-product-details'),
     path('product-faq/<str:id>/', GetProductFaqView.as_view(), name='get-product-faq'),
@@ -18,9 +19,13 @@ urlpatterns = [
     path('clear-cart/', ClearCartView.as_view(), name='clear-cart-item'),
     path('cart-summary/', CartSummeryView.as_view(), name='card-summary'),
     path('cart-summary/', MergeCartAccountView.as_view(), name='merge.card-summary'),
+    path('checkout/', CheckoutView.as_view(), name='checkout'),
     path('banner-list/', GetBannerView.as_view(), name='get_homepage_banner'),
     path('sub-category/', ProductsBySubCategoryAPIView.as_view(), name='product_by_subcategory'),
     path('brands/', GetBrandAPIView.as_view(), name='get_brand'),
+    path('feeds/products.<str:feed_format>', ProductFeedView.as_view(), name='product-feed'),
+    path('sitemap.xml', SitemapIndexView.as_view(), name='sitemap-index'),
+    path('sitemap-<str:section>-<int:number>.xml', SitemapShardView.as_view(), name='sitemap-shard'),
 
     path('posts/<str:post_id>/comments/', PostCommentsListView.as_view(), name='post-comments'),
     path('posts/<str:post_id>/comments/create/', CommentCreateView.as_view(), name='comment-create'),
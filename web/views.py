@@ -1,10 +1,16 @@
 
 from django.core.cache import cache
 from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
 from django_filters import filters
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, permissions, generics
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import AllowAny
@@ -12,9 +18,21 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
+from account.tasks import log_search_query
+from product.flash_sales import overlay_sale_prices
+from product.helpers import product_listing_cache_tags, product_listing_queryset, filter_products
 from product.models import ProductFAQ, Banner
+from product.search import search_products
+from utils.cache import set_tagged_cache, cached_read_through
+from utils.pagination import KeysetPagination
+from utils.search import parse_search_terms, search_cache_key
+from web.checkout import CheckoutError, IDEMPOTENCY_PENDING, claim_idempotency_key, place_order, \
+    release_idempotency_key, request_fingerprint, store_idempotent_response
+from web.feeds import FEED_FORMATS, render_feed, render_sitemap_index, render_sitemap_shard
 from web.helpers import GetClientIPMixin
-from web.models import BlogPostView, BlogPost, BlogTag, BlogCategory
+from web.counters import apply_pending_counters, increment_blog_counter, record_blog_post_view
+from web.models import BlogPost, BlogTag, BlogCategory
+from web.search import search_blog_posts
 from web.serializer import *
 
 
@@ -86,24 +104,29 @@ class GetCategoryView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def _get_cached_categories(self, category_id=None, subcategory_id=None):
-        cache_key = "categories_with_subcategories_v1"
+        cache_key = "categories_with_subcategories_v2"
         if category_id:
             cache_key += f"_cat{category_id}"
         if subcategory_id:
             cache_key += f"_sub{subcategory_id}"
 
         cache_timeout = getattr(settings, 'CATEGORY_CACHE_TIMEOUT', 7200)
+        return cached_read_through(cache_key, self._build_categories, cache_timeout,
+                                   builder_kwargs={'category_id': category_id})
 
-        categories = cache.get(cache_key)
-        if categories is None:
-            queryset = Category.active_objects.prefetch_related("sub_categories").order_by("name")
+    @staticmethod
+    def _build_categories(category_id=None):
+        queryset = Category.active_objects.prefetch_related("sub_categories").order_by("name")
 
-            if category_id:
-                queryset = queryset.filter(id=category_id)
+        if category_id:
+            queryset = queryset.filter(id=category_id)
 
-            categories = CategorySerializer(queryset, many=True).data
-            cache.set(cache_key, categories, cache_timeout)
-        return categories
+        categories = CategorySerializer(queryset, many=True).data
+        tags = {'categories'}
+        for category in queryset:
+            tags.add(f'category:{category.pk}')
+            tags.update(f'sub_category:{sub_category.pk}' for sub_category in category.sub_categories.all())
+        return categories, tags
 
 
 class GetBlogCategoryView(APIView):
@@ -117,14 +140,14 @@ class GetBlogCategoryView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def _get_cached_blog_categories(self):
-        cache_key = "blog_categories_v1"
+        cache_key = "blog_categories_v2"
         cache_timeout = getattr(settings, 'BLOG_CATEGORY_CACHE_TIMEOUT', 7200)
-        categories = cache.get(cache_key)
-        if categories is None:
-            queryset = BlogCategory.active_objects.order_by("name")
-            categories = ListBlogCategorySerializer(queryset, many=True).data
-            cache.set(cache_key, categories, cache_timeout)
-        return categories
+        return cached_read_through(cache_key, self._build_blog_categories, cache_timeout)
+
+    @staticmethod
+    def _build_blog_categories():
+        queryset = BlogCategory.active_objects.order_by("name")
+        return ListBlogCategorySerializer(queryset, many=True).data, ['blog_categories']
 
 
 class GetFAQView(APIView):
@@ -138,14 +161,14 @@ class GetFAQView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def _get_cached_faqs(self):
-        cache_key = "home_faq_v1"
+        cache_key = "home_faq_v2"
         cache_timeout = getattr(settings, 'HOME_FAQ_CACHE_TIMEOUT', 7200)
-        faqs = cache.get(cache_key)
-        if faqs is None:
-            queryset = ProductFAQ.active_objects.filter(is_home_page_related=True).order_by("sort_order")
-            faqs = ProductFaqSerializer(queryset, many=True).data
-            cache.set(cache_key, faqs, cache_timeout)
-        return faqs
+        return cached_read_through(cache_key, self._build_faqs, cache_timeout)
+
+    @staticmethod
+    def _build_faqs():
+        queryset = ProductFAQ.active_objects.filter(is_home_page_related=True).order_by("sort_order")
+        return ProductFaqSerializer(queryset, many=True).data, ['faqs']
 
 
 class GetProductView(APIView):
@@ -164,25 +187,37 @@ class GetProductView(APIView):
             max_price = request.query_params.get("max_price")
             brand_id = request.query_params.get("brand_id")
 
+            paginator = KeysetPagination()
+            paginator.request = request
+            # checks the cursor against the product fields, a bad one is a 400
+            page_params = paginator.get_page_params(request.query_params, product_listing_queryset())
+
             if is_featured or is_popular or is_best_seller:
                 products = self._get_cached_featured_products(
                     product_id, category_id, sub_category_id,
                     is_featured, is_popular, is_best_seller,
-                    min_price, max_price, brand_id
+                    min_price, max_price, brand_id, page_params
                 )
             else:
                 products = self._get_cached_products(
                     product_id, category_id, sub_category_id,
-                    min_price, max_price, brand_id
+                    min_price, max_price, brand_id, page_params
                 )
 
-            return Response(products, status=status.HTTP_200_OK)
+            # the sale prices change independently of the cached page
+            return Response({
+                'next': paginator.get_next_link(products['next_cursor']),
+                'results': overlay_sale_prices(products['results']),
+            }, status=status.HTTP_200_OK)
+        except ValidationError as e:
+            return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def _get_cached_products(self, product_id=None, category_id=None, sub_category_id=None,
-                             min_price=None, max_price=None, brand_id=None):
-        cache_key = "products_v1"
+                             min_price=None, max_price=None, brand_id=None, page_params=None):
+        ordering, cursor, page_size = page_params or KeysetPagination().get_page_params({})
+        cache_key = "products_v3"
         if product_id:
             cache_key += f"_id{product_id}"
         if category_id:
@@ -195,34 +230,35 @@ class GetProductView(APIView):
             cache_key += f"_max{max_price}"
         if brand_id:
             cache_key += f"_brand{brand_id}"
+        # one cache entry per page, never the whole filtered catalog
+        cache_key += f"_o{ordering}_s{page_size}_c{cursor or ''}"
 
         cache_timeout = getattr(settings, 'PRODUCT_CACHE_TIMEOUT', 7200)
-        products = cache.get(cache_key)
-
-        if products is None:
-            queryset = Product.active_objects.all().select_related('sub_category').order_by("id")
-
-            if product_id:
-                queryset = queryset.filter(id=product_id)
-            if category_id:
-                queryset = queryset.filter(sub_category__category=category_id)
-            if sub_category_id:
-                queryset = queryset.filter(sub_category=sub_category_id)
-            if min_price:
-                queryset = queryset.filter(price__gte=min_price)
-            if max_price:
-                queryset = queryset.filter(price__lte=max_price)
-            if brand_id:
-                queryset = queryset.filter(brand_id=brand_id)
-
-            products = ProductSerializer(queryset, many=True).data
-            cache.set(cache_key, products, cache_timeout)
-        return products
+        return cached_read_through(cache_key, self._build_products, cache_timeout, builder_kwargs={
+            'ordering': ordering, 'cursor': cursor, 'page_size': page_size,
+            'product_id': product_id, 'category_id': category_id, 'sub_category_id': sub_category_id,
+            'min_price': min_price, 'max_price': max_price, 'brand_id': brand_id,
+        })
+
+    @staticmethod
+    def _build_products(product_id=None, category_id=None, sub_category_id=None,
+                        is_featured=None, is_best_seller=None, is_popular=None,
+                        min_price=None, max_price=None, brand_id=None,
+                        ordering='id', cursor=None, page_size=None):
+        queryset = filter_products(
+            product_listing_queryset(), product_id, category_id, sub_category_id,
+            is_featured, is_best_seller, is_popular, min_price, max_price, brand_id
+        )
+
+        page, next_cursor = KeysetPagination().paginate(queryset, ordering, cursor, page_size)
+        products = {'results': ProductSerializer(page, many=True).data, 'next_cursor': next_cursor}
+        return products, product_listing_cache_tags(page, category_id, sub_category_id, brand_id)
 
     def _get_cached_featured_products(self, product_id=None, category_id=None, sub_category_id=None,
                                       is_featured=None, is_best_seller=None, is_popular=None,
-                                      min_price=None, max_price=None, brand_id=None):
-        cache_key = "featured_products_v1"
+                                      min_price=None, max_price=None, brand_id=None, page_params=None):
+        ordering, cursor, page_size = page_params or KeysetPagination().get_page_params({})
+        cache_key = "featured_products_v3"
         if product_id:
             cache_key += f"_id{product_id}"
         if category_id:
@@ -241,35 +277,47 @@ class GetProductView(APIView):
             cache_key += f"_max{max_price}"
         if brand_id:
             cache_key += f"_brand{brand_id}"
+        # one cache entry per page, never the whole filtered catalog
+        cache_key += f"_o{ordering}_s{page_size}_c{cursor or ''}"
 
         cache_timeout = getattr(settings, 'PRODUCT_CACHE_TIMEOUT', 7200)
-        products = cache.get(cache_key)
-
-        if products is None:
-            queryset = Product.active_objects.all().select_related('sub_category').order_by("id")
-
-            if product_id:
-                queryset = queryset.filter(id=product_id)
-            if category_id:
-                queryset = queryset.filter(sub_category__category=category_id)
-            if sub_category_id:
-                queryset = queryset.filter(sub_category=sub_category_id)
-            if is_featured:
-                queryset = queryset.filter(is_featured=True)
-            if is_best_seller:
-                queryset = queryset.filter(is_best_seller=True)
-            if is_popular:
-                queryset = queryset.filter(is_popular=True)
-            if min_price:
-                queryset = queryset.filter(price__gte=min_price)
-            if max_price:
-                queryset = queryset.filter(price__lte=max_price)
-            if brand_id:
-                queryset = queryset.filter(brand_id=brand_id)
-
-            products = ProductSerializer(queryset, many=True).data
-            cache.set(cache_key, products, cache_timeout)
-        return products
+        return cached_read_through(cache_key, self._build_products, cache_timeout, builder_kwargs={
+            'ordering': ordering, 'cursor': cursor, 'page_size': page_size,
+            'product_id': product_id, 'category_id': category_id, 'sub_category_id': sub_category_id,
+            'is_featured': is_featured, 'is_best_seller': is_best_seller, 'is_popular': is_popular,
+            'min_price': min_price, 'max_price': max_price, 'brand_id': brand_id,
+        })
+
+
+class ProductSearchView(GetClientIPMixin, APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not parse_search_terms(query):
+            return Response({"error": "Search query is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = filter_products(
+            product_listing_queryset(),
+            category_id=request.query_params.get("category"),
+            sub_category_id=request.query_params.get("subcategory"),
+            is_featured=request.query_params.get("is_featured"),
+            is_best_seller=request.query_params.get("is_best_seller"),
+            is_popular=request.query_params.get("is_popular"),
+            min_price=request.query_params.get("min_price"),
+            max_price=request.query_params.get("max_price"),
+            brand_id=request.query_params.get("brand_id"),
+        )
+        paginator = LimitOffsetPagination()
+        page = paginator.paginate_queryset(search_products(queryset, query), request, view=self)
+        serializer = ProductSerializer(page, many=True)
+
+        # logged by a worker, the response does not wait for the insert
+        log_search_query.delay(
+            query[:500], request.user.id if request.user.is_authenticated else None, paginator.count,
+            self.get_client_ip()
+        )
+        return paginator.get_paginated_response(serializer.data)
 
 
 class GetProductDetailView(APIView):
@@ -277,7 +325,7 @@ class GetProductDetailView(APIView):
 
     def get(self, request, id):
         try:
-            product = Product.objects.filter(id=id).last()
+            product = product_listing_queryset(Product.objects.filter(id=id)).last()
             serializer = ProductDetailSerializer(product, many=False).data
             return Response(serializer, status=status.HTTP_200_OK)
         except Exception as e:
@@ -311,7 +359,7 @@ class GetBlogsView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     def _get_cached_blogs(self, blog_id=None, is_featured=False, search_query=""):
-        cache_key = "blogs_v1"
+        cache_key = "blogs_v2"
         if blog_id:
             cache_key += f"_id{blog_id}"
 
@@ -319,57 +367,63 @@ class GetBlogsView(APIView):
             cache_key += f"_featured_blogs"
 
         if search_query:
-            cache_key += f"_search_{hash(search_query)}"
+            cache_key += f"_search_{search_cache_key(search_query)}"
 
         cache_timeout = getattr(settings, 'BLOGS_CACHE_TIMEOUT', 7200)
+        if search_query:
+            cache_timeout = min(cache_timeout, 1800)
 
-        blogs = cache.get(cache_key)
-        if blogs is None:
-            queryset = BlogPost.active_objects.all().select_related('author', 'category').order_by("id")
-
-            if blog_id:
-                queryset = queryset.filter(id=blog_id)
-
-            if is_featured:
-                queryset = queryset.filter(is_featured=True)[:5]
+        return cached_read_through(cache_key, self._build_blogs, cache_timeout, builder_kwargs={
+            'blog_id': blog_id, 'is_featured': is_featured, 'search_query': search_query,
+        })
 
-            if search_query:
-                search_filter = Q(title__icontains=search_query) | \
-                                Q(content__icontains=search_query) | \
-                                Q(category__name__icontains=search_query) | \
-                                Q(author__username__icontains=search_query)
+    @staticmethod
+    def _build_blogs(blog_id=None, is_featured=False, search_query=""):
+        queryset = BlogPost.active_objects.all().select_related('author', 'category').order_by("id")
 
-                queryset = queryset.filter(search_filter)
+        if blog_id:
+            queryset = queryset.filter(id=blog_id)
 
-            blogs = BlogPostListSerializer(queryset, many=True).data
+        if search_query:
+            queryset = search_blog_posts(queryset, search_query)
 
-            if search_query:
-                cache_timeout = min(cache_timeout, 1800)
+        if is_featured:
+            queryset = queryset.filter(is_featured=True)[:5]
 
-            cache.set(cache_key, blogs, cache_timeout)
+        serializer_class = BlogPostSearchSerializer if search_query else BlogPostListSerializer
+        blogs = serializer_class(queryset, many=True).data
 
-        return blogs
+        tags = {'blogs'}
+        for blog in queryset:
+            tags.update([f'blog_post:{blog.pk}', f'blog_category:{blog.category_id}'])
+        return blogs, tags
 
 
-class GetBlogDetailView(APIView):
+class GetBlogDetailView(GetClientIPMixin, APIView):
     permission_classes = [permissions.AllowAny]
 
     def get(self, request, id):
         try:
             blog = (BlogPost.objects.select_related("author", "category")
                     .prefetch_related("tags", "comments").filter(id=id).first())
+            if blog is None:
+                return Response({"error": "Blog not found"}, status=status.HTTP_404_NOT_FOUND)
+
+            # Count the view and track its analytics row, buffered and flushed by celery beat
+            if not request.user.is_staff:
+                record_blog_post_view(blog, request, self.get_client_ip())
             serializer = BlogPostDetailSerializer(blog, context={"request": request}).data
-            return Response(serializer, status=status.HTTP_200_OK)
+            return Response(apply_pending_counters(blog.pk, serializer), status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class BlogPostViewSet(ModelViewSet):
+class BlogPostViewSet(GetClientIPMixin, ModelViewSet):
     """ViewSet for blog posts"""
 
     def get_serializer_class(self):
         if self.action == 'list':
-            return BlogPostListSerializer
+            return BlogPostSearchSerializer if self.request.query_params.get('search') else BlogPostListSerializer
         elif self.action in ['create', 'update', 'partial_update']:
             return BlogPostCreateUpdateSerializer
         return BlogPostDetailSerializer
@@ -412,15 +466,10 @@ class BlogPostViewSet(ModelViewSet):
         if self.request.query_params.get('trending') == 'true':
             queryset = queryset.filter(is_trending=True)
 
-        # Search
+        # Search, ranked best match first
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(title__icontains=search) |
-                Q(excerpt__icontains=search) |
-                Q(content__icontains=search) |
-                Q(tags__name__icontains=search)
-            ).distinct()
+            return search_blog_posts(queryset, search)
 
         return queryset.order_by('-created_at')
 
@@ -428,34 +477,12 @@ class BlogPostViewSet(ModelViewSet):
         """Get single post and increment view count"""
         instance = self.get_object()
 
-        # Increment view count
+        # Count the view and track its analytics row, buffered and flushed by celery beat
         if not request.user.is_staff:  # Don't count admin views
-            instance.increment_views()
-
-            # Track detailed view analytics
-            self.track_post_view(instance, request)
+            record_blog_post_view(instance, request, self.get_client_ip())
 
         serializer = self.get_serializer(instance)
-        return Response(serializer.data)
-
-    def track_post_view(self, post, request):
-        """Track post view for analytics"""
-        # Get client IP
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-
-        # Create view record
-        BlogPostView.objects.create(
-            post=post,
-            user=request.user if request.user.is_authenticated else None,
-            session_key=request.session.session_key,
-            ip_address=ip,
-            user_agent=request.META.get('HTTP_USER_AGENT', ''),
-            referrer=request.META.get('HTTP_REFERER', '')
-        )
+        return Response(apply_pending_counters(instance.pk, serializer.data))
 
     @action(detail=True, methods=['post'])
     def like(self, request, pk=None):
@@ -464,12 +491,11 @@ class BlogPostViewSet(ModelViewSet):
 
         # In a real app, you'd track individual likes
         # For now, just increment the counter
-        post.likes_count += 1
-        post.save(update_fields=['likes_count'])
+        pending = increment_blog_counter(post.pk, 'likes_count')
 
         return Response({
             'message': 'Post liked',
-            'likes_count': post.likes_count
+            'likes_count': post.likes_count + (pending or 1)
         })
 
     @action(detail=True, methods=['post'])
@@ -477,12 +503,11 @@ class BlogPostViewSet(ModelViewSet):
         """Track post share"""
         post = self.get_object()
 
-        post.shares_count += 1
-        post.save(update_fields=['shares_count'])
+        pending = increment_blog_counter(post.pk, 'shares_count')
 
         return Response({
             'message': 'Share tracked',
-            'shares_count': post.shares_count
+            'shares_count': post.shares_count + (pending or 1)
         })
 
     @action(detail=True, methods=['get', 'post'])
@@ -840,6 +865,58 @@ class MergeCartAccountView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class CheckoutView(APIView):
+    """Place an order from the active cart
+
+    Clients send an ``Idempotency-Key`` header, unique per checkout attempt: a retried or
+    double submitted request with the same key returns the order of the first one.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if not idempotency_key:
+            return Response({
+                'success': False, 'error': 'The Idempotency-Key header is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = CheckoutSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False, 'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(serializer.validated_data)
+        previous = claim_idempotency_key(request.user, idempotency_key, fingerprint)
+        if previous is not None:
+            return self.replay(previous, fingerprint)
+
+        try:
+            order = place_order(request.user, **serializer.validated_data)
+        except CheckoutError as e:
+            release_idempotency_key(request.user, idempotency_key)
+            return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception:
+            release_idempotency_key(request.user, idempotency_key)
+            raise
+
+        data = {'success': True, 'order': CheckoutOrderSerializer(order).data}
+        store_idempotent_response(request.user, idempotency_key, fingerprint, status.HTTP_201_CREATED, data)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def replay(previous, fingerprint):
+        if previous.get('fingerprint') != fingerprint:
+            return Response({
+                'success': False, 'error': 'The Idempotency-Key was already used for another checkout'
+            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if previous['state'] == IDEMPOTENCY_PENDING:
+            return Response({
+                'success': False, 'error': 'This checkout is still being processed'
+            }, status=status.HTTP_409_CONFLICT)
+        return Response(previous['response'], status=previous['status_code'])
+
+
 # ============================================================================
 # 4. BULK CART OPERATIONS
 # ============================================================================
@@ -935,7 +1012,8 @@ class ProductsBySubCategoryAPIView(APIView):
         if cached_data:
             return Response(cached_data)
 
-        products = Product.objects.filter(subcategory_id__in=subcategory_ids).order_by("id")
+        products = product_listing_queryset(
+            Product.objects.filter(sub_category_id__in=subcategory_ids)).order_by("id")
 
         paginator = LimitOffsetPagination()
         page = paginator.paginate_queryset(products, request)
@@ -943,7 +1021,9 @@ class ProductsBySubCategoryAPIView(APIView):
 
         paginated_response = paginator.get_paginated_response(serializer.data)
 
-        cache.set(cache_key, paginated_response.data, timeout=600)
+        tags = {f'products:sub_category:{sub_category_id}' for sub_category_id in subcategory_ids}
+        tags.update(f'product:{product.pk}' for product in page)
+        set_tagged_cache(cache_key, paginated_response.data, 600, tags)
 
         return paginated_response
 
@@ -961,28 +1041,33 @@ class GetBannerView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def _get_cached_banners(self, banner_id=None, subcategory_id=None):
-        cache_key = "banners_v1"
+        cache_key = "banners_v2"
         if banner_id:
             cache_key += f"_id{banner_id}"
         if subcategory_id:
             cache_key += f"_subcat{subcategory_id}"
 
         cache_timeout = getattr(settings, "BANNER_CACHE_TIMEOUT", 7200)
+        return cached_read_through(cache_key, self._build_banners, cache_timeout, builder_kwargs={
+            'banner_id': banner_id, 'subcategory_id': subcategory_id,
+        })
 
-        banners = cache.get(cache_key)
-        if banners is None:
-            queryset = Banner.objects.prefetch_related("subcategories").order_by("-sort_order")
-
-            if banner_id:
-                queryset = queryset.filter(id=banner_id)
+    @staticmethod
+    def _build_banners(banner_id=None, subcategory_id=None):
+        queryset = Banner.objects.prefetch_related("subcategories").order_by("-sort_order")
 
-            if subcategory_id:
-                queryset = queryset.filter(subcategories=subcategory_id)
+        if banner_id:
+            queryset = queryset.filter(id=banner_id)
 
-            banners = BannerSerializer(queryset, many=True).data
-            cache.set(cache_key, banners, cache_timeout)
+        if subcategory_id:
+            queryset = queryset.filter(subcategories=subcategory_id)
 
-        return banners
+        banners = BannerSerializer(queryset, many=True).data
+        tags = {'banners'}
+        for banner in queryset:
+            tags.add(f'banner:{banner.pk}')
+            tags.update(f'sub_category:{sub_category.pk}' for sub_category in banner.subcategories.all())
+        return banners, tags
 
 
 class GetBrandAPIView(APIView):
@@ -996,18 +1081,15 @@ class GetBrandAPIView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     def _get_cached_brands(self, banner_id=None, subcategory_id=None):
-        cache_key = "brands_v1"
+        cache_key = "brands_v2"
 
         cache_timeout = getattr(settings, "BRAND_CACHE_TIMEOUT", 7200)
+        return cached_read_through(cache_key, self._build_brands, cache_timeout)
 
-        brands = cache.get(cache_key)
-        if brands is None:
-            queryset = Brand.objects.active().order_by("created_at")
-
-            brands = BrandsSerializer(queryset, many=True).data
-            cache.set(cache_key, brands, cache_timeout)
-
-        return brands
+    @staticmethod
+    def _build_brands():
+        queryset = Brand.objects.active().order_by("created_at")
+        return BrandsSerializer(queryset, many=True).data, ['brands']
 
 
 class PostCommentsListView(generics.ListAPIView):
@@ -1112,4 +1194,48 @@ class CommentRepliesListView(generics.ListAPIView):
         parent_comment = get_object_or_404(
             BlogComment, id=comment_id, comment_status='approved'
         )
-        return parent_comment.replies.filter(comment_status='approved').select_related('user').order_by('created_at')
\ No newline at end of file
+        return parent_comment.replies.filter(comment_status='approved').select_related('user').order_by('created_at')
+
+
+class ProductFeedView(APIView):
+    """Streams the catalog feed, ``?since=<iso datetime>`` for the products updated since"""
+    permission_classes = [AllowAny]
+
+    def get(self, request, feed_format):
+        if feed_format not in FEED_FORMATS:
+            return Response({"error": f"Unknown feed format {feed_format}"}, status=status.HTTP_404_NOT_FOUND)
+        token = getattr(settings, 'PRODUCT_FEED_TOKEN', None)
+        if token and not constant_time_compare(request.query_params.get('token', ''), token):
+            return Response({"error": "Invalid feed token"}, status=status.HTTP_403_FORBIDDEN)
+
+        since = request.query_params.get('since')
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({"error": "since must be an ISO 8601 datetime"}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        response = StreamingHttpResponse(render_feed(feed_format, since), content_type=FEED_FORMATS[feed_format])
+        response['Content-Disposition'] = f'inline; filename="products.{feed_format}"'
+        return response
+
+
+class SitemapIndexView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        def shard_url(section, number):
+            return request.build_absolute_uri(reverse('sitemap-shard', args=[section, number]))
+
+        return StreamingHttpResponse(render_sitemap_index(shard_url), content_type='application/xml; charset=utf-8')
+
+
+class SitemapShardView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request, section, number):
+        chunks = render_sitemap_shard(section, number)
+        if chunks is None:
+            return Response({"error": "Sitemap not found"}, status=status.HTTP_404_NOT_FOUND)
+        return StreamingHttpResponse(chunks, content_type='application/xml; charset=utf-8')